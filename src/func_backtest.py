@@ -1,15 +1,21 @@
 import numpy as np
+import pandas as pd
 import datetime as dt
 
-from func_signal import call_check_signal_func
+import func_log
+import func_profile
+from func_signal import call_check_signal_func, call_check_signal_array_func, call_check_signal_vector_func, get_asof_index, get_asof_index_array, get_signal_key, get_side_name, side_code_dict
 
 
-def update_max_drawdown(symbol, side, close_price, max_drawdown, ohlcv_df, position_dict):
-    if side == 'buy':
-        low_price = close_price if close_price != None else ohlcv_df.loc[0, 'low']
+logger = func_log.get_logger(__name__)
+
+
+def update_max_drawdown(symbol, side, close_price, max_drawdown, current_bar, position_dict):
+    if side == side_code_dict['buy']:
+        low_price = close_price if close_price != None else current_bar['low']
         drawdown = (position_dict[symbol]['open_price'] - low_price) / position_dict[symbol]['open_price']
-    elif side == 'sell':
-        high_price = close_price if close_price != None else ohlcv_df.loc[0, 'high']
+    elif side == side_code_dict['sell']:
+        high_price = close_price if close_price != None else current_bar['high']
         drawdown = (high_price - position_dict[symbol]['open_price']) / position_dict[symbol]['open_price']
         
     if drawdown > max_drawdown:
@@ -18,6 +24,15 @@ def update_max_drawdown(symbol, side, close_price, max_drawdown, ohlcv_df, posit
     return max_drawdown
 
 
+def gen_bar_dict(bar):
+    '''
+    Prices of bar as float64, so compact float32 frames keep position and budget in float64.
+    '''
+    bar_dict = {column: float(bar[column]) for column in ['open', 'high', 'low', 'close']}
+
+    return bar_dict
+
+
 def get_action_base(symbol, objective, action_list, signal_time, config_params, ohlcv_df_dict):
     for timeframe in config_params['base'][objective]:
         base_ohlcv_df = ohlcv_df_dict['base'][timeframe][symbol]
@@ -25,7 +40,7 @@ def get_action_base(symbol, objective, action_list, signal_time, config_params,
         for signal in config_params['base'][objective][timeframe]:
             for func_name in config_params['base'][objective][timeframe][signal]['check']:
                 action_side = call_check_signal_func(func_name)(objective, 'base', signal_time, signal, action_list, base_ohlcv_df, timeframe, config_params)
-                print(f"     base {symbol} {func_name} {signal} {timeframe}: {action_side}")
+                logger.debug("     base %s %s %s %s: %s", symbol, func_name, signal, timeframe, get_side_name(action_side))
 
     return action_list
 
@@ -38,11 +53,12 @@ def get_action_lead(objective, action_list, signal_time, config_params, ohlcv_df
             for signal in config_params['lead'][objective][timeframe]:
                 for func_name in config_params['lead'][objective][timeframe][signal]['check']:
                     action_side = call_check_signal_func(func_name)(objective, 'lead', signal_time, signal, action_list, lead_ohlcv_df, timeframe, config_params)
-                    print(f"     lead {lead_symbol} {func_name} {signal} {timeframe}: {action_side}")
+                    logger.debug("     lead %s %s %s %s: %s", lead_symbol, func_name, signal, timeframe, get_side_name(action_side))
 
     return action_list
 
 
+@func_profile.profile_func
 def get_action(symbol, objective, action_list, signal_time, config_params, ohlcv_df_dict):
     action_list = get_action_base(symbol, objective, action_list, signal_time, config_params, ohlcv_df_dict)
     action_list = get_action_lead(objective, action_list, signal_time, config_params, ohlcv_df_dict)    
@@ -73,6 +89,12 @@ def get_available_data_flag(symbol, signal_time, max_open_timeframe, ohlcv_df_di
     return available_data_flag
 
 
+def get_target_code_list(config_params):
+    target_code_list = [side_code_dict[x] for x in config_params['target_side'] if x != 'no_action']
+
+    return target_code_list
+
+
 def get_open_position_flag(symbol, signal_time, max_open_timeframe, config_params, ohlcv_df_dict):
     available_data_flag = get_available_data_flag(symbol, signal_time, max_open_timeframe, ohlcv_df_dict)    
     
@@ -80,25 +102,25 @@ def get_open_position_flag(symbol, signal_time, max_open_timeframe, config_param
         action_list = []
         action_list = get_action(symbol, 'open', action_list, signal_time, config_params, ohlcv_df_dict)
 
-        if (len(set(action_list)) == 1) & (action_list[0] in config_params['target_side']) & (action_list[0] != 'no_action'):
+        if (len(set(action_list)) == 1) & (action_list[0] in get_target_code_list(config_params)):
             open_position_flag = True
             side = action_list[0]
         else:
             open_position_flag = False
             side = None
-            print(f"     No action")
+            logger.debug("     No action")
     else:
         open_position_flag = False
         side = None
-        print(f"     Not available data")
+        logger.debug("     Not available data")
 
     return open_position_flag, side
 
 
-def get_tp_flag(symbol, side, current_ohlcv_df, position_dict):
-    if (side == 'buy') & (current_ohlcv_df.loc[0, 'high'] >= position_dict[symbol]['tp']):
+def get_tp_flag(symbol, side, current_bar, position_dict):
+    if (side == side_code_dict['buy']) & (current_bar['high'] >= position_dict[symbol]['tp']):
         tp_flag = True
-    elif (side == 'sell') & (current_ohlcv_df.loc[0, 'low'] <= position_dict[symbol]['tp']):
+    elif (side == side_code_dict['sell']) & (current_bar['low'] <= position_dict[symbol]['tp']):
         tp_flag = True
     else:
         tp_flag = False
@@ -106,56 +128,128 @@ def get_tp_flag(symbol, side, current_ohlcv_df, position_dict):
     return tp_flag
 
 
-def get_sl_flag(symbol, side, current_ohlcv_df, position_dict):
-    print(f"       side: {side}")
-    print(f"       price: {current_ohlcv_df.loc[0, 'low']}")
-    print(f"       sl: {position_dict[symbol]['sl']}")
+def get_sl_flag(symbol, side, current_bar, position_dict):
+    logger.debug("       side: %s", get_side_name(side))
+    logger.debug("       price: %s", current_bar['low'])
+    logger.debug("       sl: %s", position_dict[symbol]['sl'])
 
-    if (side == 'buy') & (current_ohlcv_df.loc[0, 'low'] <= position_dict[symbol]['sl']):
+    if (side == side_code_dict['buy']) & (current_bar['low'] <= position_dict[symbol]['sl']):
         sl_flag = True
-    elif (side == 'sell') & (current_ohlcv_df.loc[0, 'high'] >= position_dict[symbol]['sl']):
+    elif (side == side_code_dict['sell']) & (current_bar['high'] >= position_dict[symbol]['sl']):
         sl_flag = True
     else:
         sl_flag = False
 
-    print(f"       sl_flag: {sl_flag}")
+    logger.debug("       sl_flag: %s", sl_flag)
 
     return sl_flag
 
 
-def get_close_position_flag(symbol, side, signal_time, config_params, current_ohlcv_df, ohlcv_df_dict, position_dict):
-    if (position_dict[symbol]['stop_count'] == 0) & (get_tp_flag(symbol, side, current_ohlcv_df, position_dict)):
+def get_sl_first_flag(side, tp_price, sl_price, high_array, low_array):
+    '''
+    True if sl is touched before tp in high_array and low_array, touching both in the same bar counts as sl first.
+    '''
+    if side == side_code_dict['buy']:
+        tp_hit_array = high_array >= tp_price
+        sl_hit_array = low_array <= sl_price
+    else:
+        tp_hit_array = low_array <= tp_price
+        sl_hit_array = high_array >= sl_price
+
+    if sl_hit_array.any():
+        sl_first_flag = (not tp_hit_array.any()) or (np.argmax(sl_hit_array) <= np.argmax(tp_hit_array))
+    else:
+        sl_first_flag = False
+
+    return sl_first_flag
+
+
+def add_intrabar(current_bar, start_index, end_index, high_array, low_array):
+    '''
+    Add high and low of intrabar_timeframe bars inside current bar.
+    '''
+    current_bar['intrabar_high'] = high_array[start_index:end_index]
+    current_bar['intrabar_low'] = low_array[start_index:end_index]
+
+    return current_bar
+
+
+def get_intrabar_sl_flag(symbol, side, current_bar, position_dict):
+    '''
+    True if current bar touches both tp and sl and its intrabar bars touch sl first.
+    Without intrabar bars, tp is checked first.
+    '''
+    intrabar_sl_flag = False
+
+    if 'intrabar_high' in current_bar:
+        tp_price = position_dict[symbol]['tp']
+        sl_price = position_dict[symbol]['sl']
+
+        if side == side_code_dict['buy']:
+            both_flag = (current_bar['high'] >= tp_price) & (current_bar['low'] <= sl_price)
+        else:
+            both_flag = (current_bar['low'] <= tp_price) & (current_bar['high'] >= sl_price)
+
+        if both_flag:
+            intrabar_sl_flag = get_sl_first_flag(side, tp_price, sl_price, current_bar['intrabar_high'], current_bar['intrabar_low'])
+
+    return intrabar_sl_flag
+
+
+def get_stop_close_flag(symbol, side, config_params, current_bar, position_dict):
+    if (position_dict[symbol]['stop_count'] == 0) & (get_intrabar_sl_flag(symbol, side, current_bar, position_dict)):
+        close_position_flag = True
+        close_price = position_dict[symbol]['sl']
+        close_percent = config_params['sl']['stop_percent']
+        logger.info("     Stop loss before take profit at %s", close_price)
+    elif (position_dict[symbol]['stop_count'] == 0) & (get_tp_flag(symbol, side, current_bar, position_dict)):
         close_position_flag = True
         close_price = position_dict[symbol]['tp']
         close_percent = config_params['tp']['stop_percent']
-        print(f"     Take profit at {close_price}")
-    elif (position_dict[symbol]['stop_count'] == 0) & (get_sl_flag(symbol, side, current_ohlcv_df, position_dict)):
+        logger.info("     Take profit at %s", close_price)
+    elif (position_dict[symbol]['stop_count'] == 0) & (get_sl_flag(symbol, side, current_bar, position_dict)):
         close_position_flag = True
         close_price = position_dict[symbol]['sl']
         close_percent = config_params['sl']['stop_percent']
-        print(f"     Stop loss at {close_price}")
+        logger.info("     Stop loss at %s", close_price)
+    else:
+        close_position_flag = False
+        close_price = None
+        close_percent = None
+
+    return close_position_flag, close_price, close_percent
+
+
+def get_signal_close_flag(symbol, action_list, current_bar, position_dict):
+    if (len(set(action_list)) != 1) | (action_list[0] != position_dict[symbol]['side']):
+        close_position_flag = True
+        close_price = current_bar['close']
+        close_percent = 100
+        logger.info("     Closed by signal at %s", close_price)
     else:
+        close_position_flag = False
+        close_price = None
+        close_percent = None
+        logger.debug("     Not close")
+
+    return close_position_flag, close_price, close_percent
+
+
+def get_close_position_flag(symbol, side, signal_time, config_params, current_bar, ohlcv_df_dict, position_dict):
+    close_position_flag, close_price, close_percent = get_stop_close_flag(symbol, side, config_params, current_bar, position_dict)
+
+    if not close_position_flag:
         action_list = [side]
         action_list = get_action(symbol, 'close', action_list, signal_time, config_params, ohlcv_df_dict)
-
-        if (len(set(action_list)) != 1) | (action_list[0] != position_dict[symbol]['side']):
-            close_position_flag = True
-            close_price = current_ohlcv_df.loc[0, 'close']
-            close_percent = 100
-            print(f"     Closed by signal at {close_price}")
-        else:
-            close_position_flag = False
-            close_price = None
-            close_percent = None
-            print("     Not close")
+        close_position_flag, close_price, close_percent = get_signal_close_flag(symbol, action_list, current_bar, position_dict)
 
     return close_position_flag, close_price, close_percent
 
 
 def get_stop_side(stop_key, side):
-    if ((stop_key == 'tp') & (side == 'buy')) | ((stop_key == 'sl') &(side == 'sell')):
+    if ((stop_key == 'tp') & (side == side_code_dict['buy'])) | ((stop_key == 'sl') &(side == side_code_dict['sell'])):
         stop_side = 'upper'
-    elif ((stop_key == 'tp') & (side == 'sell')) | ((stop_key == 'sl') & (side == 'buy')):
+    elif ((stop_key == 'tp') & (side == side_code_dict['sell'])) | ((stop_key == 'sl') & (side == side_code_dict['buy'])):
         stop_side = 'lower'
 
     return stop_side
@@ -176,22 +270,19 @@ def get_stop_price_percent(stop_key, stop_side, open_price, stop_price_list, con
 def get_stop_price_signal(stop_key, stop_side, symbol, signal_time, stop_price_list, ohlcv_df_dict, config_params):
     if config_params[stop_key]['signal'] != None:
         ohlcv_df = ohlcv_df_dict['base'][config_params[stop_key]['signal']['timeframe']][symbol]
-        check_df = ohlcv_df[ohlcv_df['time'] <= signal_time]
-        check_series = check_df.loc[len(check_df) - 1, :]
+        index = get_asof_index(ohlcv_df['time'], signal_time)
 
         signal = list(config_params[stop_key]['signal']['signal'])[0]
-        stop_price_list.append(check_series[signal])
-
-    return stop_price_list
+        signal_key = get_signal_key(signal, config_params[stop_key]['signal']['signal'][signal])
 
+        # No stop price from signal before its first row
+        if index != None:
+            stop_price_list.append(float(ohlcv_df[signal_key].to_numpy()[index]))
 
-def get_stop_price(stop_key, side, symbol, signal_time, open_price, ohlcv_df_dict, config_params):
-    stop_price_list = []
+    return stop_price_list
 
-    stop_side = get_stop_side(stop_key, side)
-    stop_price_list = get_stop_price_percent(stop_key, stop_side, open_price, stop_price_list, config_params)
-    stop_price_list = get_stop_price_signal(stop_key, stop_side, symbol, signal_time, stop_price_list, ohlcv_df_dict, config_params)
 
+def select_stop_price(stop_side, stop_price_list):
     if (stop_side == 'upper') & (len(stop_price_list) > 0):
         stop_price = min(stop_price_list)
     elif (stop_side == 'lower') & (len(stop_price_list) > 0):
@@ -204,6 +295,19 @@ def get_stop_price(stop_key, side, symbol, signal_time, open_price, ohlcv_df_dic
     return stop_price
 
 
+@func_profile.profile_func
+def get_stop_price(stop_key, side, symbol, signal_time, open_price, ohlcv_df_dict, config_params):
+    stop_price_list = []
+
+    stop_side = get_stop_side(stop_key, side)
+    stop_price_list = get_stop_price_percent(stop_key, stop_side, open_price, stop_price_list, config_params)
+    stop_price_list = get_stop_price_signal(stop_key, stop_side, symbol, signal_time, stop_price_list, ohlcv_df_dict, config_params)
+    stop_price = select_stop_price(stop_side, stop_price_list)
+
+    return stop_price
+
+
+@func_profile.profile_func
 def update_open_opsition(symbol, side, open_price, amount, tp_price, sl_price, signal_time, position_dict, config_params, interval_dict):
     action_time = signal_time + dt.timedelta(minutes=interval_dict[config_params['action_timeframe']])
 
@@ -218,21 +322,22 @@ def update_open_opsition(symbol, side, open_price, amount, tp_price, sl_price, s
         'stop_count': 0
     }
 
-    print(f"     {side}: {amount}")
-    print(f"     price: {position_dict[symbol]['open_price']}")
-    print(f"     tp: {position_dict[symbol]['tp']}")
-    print(f"     sl: {position_dict[symbol]['sl']}")
+    logger.info("     %s: %s", get_side_name(side), amount)
+    logger.info("     price: %s", position_dict[symbol]['open_price'])
+    logger.info("     tp: %s", position_dict[symbol]['tp'])
+    logger.info("     sl: %s", position_dict[symbol]['sl'])
 
     return position_dict
 
 
+@func_profile.profile_func
 def update_close_position(symbol, side, close_price, close_percent, signal_time, config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict):
     action_time = signal_time + dt.timedelta(minutes=interval_dict[config_params['action_timeframe']])
 
     close_amount = position_dict[symbol]['amount'] * (close_percent / 100)
 
     transaction_dict['symbol'].append(symbol)
-    transaction_dict['side'].append(side)
+    transaction_dict['side'].append(get_side_name(side))
     transaction_dict['amount'].append(close_amount)
     transaction_dict['open_time'].append(position_dict[symbol]['open_time'])
     transaction_dict['open_price'].append(position_dict[symbol]['open_price'])
@@ -241,12 +346,12 @@ def update_close_position(symbol, side, close_price, close_percent, signal_time,
     transaction_dict['value'].append(position_dict[symbol]['open_price'] * close_amount)
     transaction_dict['notional'].append(position_dict[symbol]['notional'])
 
-    if position_dict[symbol]['side'] == 'buy':
+    if position_dict[symbol]['side'] == side_code_dict['buy']:
         adjusted_open_price = position_dict[symbol]['open_price'] * (1 + (config_params['taker_fee_percent'] / 100))
         adjusted_close_price = close_price * (1 - (config_params['taker_fee_percent'] / 100))
         profit = close_amount * (adjusted_close_price - adjusted_open_price)
         profit_percent = ((adjusted_close_price - adjusted_open_price) / adjusted_open_price) * 100
-    elif position_dict[symbol]['side'] == 'sell':
+    elif position_dict[symbol]['side'] == side_code_dict['sell']:
         adjusted_open_price = position_dict[symbol]['open_price'] * (1 - (config_params['taker_fee_percent'] / 100))
         adjusted_close_price = close_price * (1 + (config_params['taker_fee_percent'] / 100))
         profit = close_amount * (adjusted_open_price - adjusted_close_price)
@@ -275,19 +380,20 @@ def update_stop_price(side, symbol, signal_time, config_params, position_dict, o
             
         if position_dict[symbol][stop_key] != stop_price:
             position_dict[symbol][stop_key] = stop_price
-            print(f"     Update {stop_key}: {stop_price}")
+            logger.debug("     Update %s: %s", stop_key, stop_price)
 
     return position_dict
 
 
+@func_profile.profile_func
 def open_position(symbol, signal_time, max_open_timeframe, config_params, budget, ohlcv_df_dict, position_dict, interval_dict):
     open_position_flag, side = get_open_position_flag(symbol, signal_time, max_open_timeframe, config_params, ohlcv_df_dict)
 
     if open_position_flag:
         ohlcv_df = ohlcv_df_dict['base'][config_params['action_timeframe']][symbol]
-        current_ohlcv_df = ohlcv_df[ohlcv_df['time'] == signal_time].reset_index(drop=True)
+        current_bar = gen_bar_dict(ohlcv_df[ohlcv_df['time'] == signal_time].reset_index(drop=True).loc[0, :])
         
-        open_price = current_ohlcv_df.loc[0, 'close']
+        open_price = current_bar['close']
         amount = ((config_params['action_percent'] / 100) * budget) / open_price * config_params['leverage']
         tp_price = get_stop_price('tp', side, symbol, signal_time, open_price, ohlcv_df_dict, config_params)
         sl_price = get_stop_price('sl', side, symbol, signal_time, open_price, ohlcv_df_dict, config_params)
@@ -297,17 +403,791 @@ def open_position(symbol, signal_time, max_open_timeframe, config_params, budget
     return position_dict
 
 
+@func_profile.profile_func
 def close_position(symbol, signal_time, max_drawdown, config_params, budget, reinvest_profit_flag, ohlcv_df_dict, position_dict, transaction_dict, interval_dict):
     side = position_dict[symbol]['side']
     ohlcv_df = ohlcv_df_dict['base'][config_params['action_timeframe']][symbol]
-    current_ohlcv_df = ohlcv_df[ohlcv_df['time'] == signal_time].reset_index(drop=True)
+    current_bar = gen_bar_dict(ohlcv_df[ohlcv_df['time'] == signal_time].reset_index(drop=True).loc[0, :])
+
+    if config_params.get('intrabar_timeframe') != None:
+        intrabar_df = ohlcv_df_dict['base'][config_params['intrabar_timeframe']][symbol]
+        start_index, end_index = intrabar_df['time'].searchsorted([signal_time, signal_time + dt.timedelta(minutes=interval_dict[config_params['action_timeframe']])])
+        current_bar = add_intrabar(current_bar, start_index, end_index, intrabar_df['high'].to_numpy(), intrabar_df['low'].to_numpy())
     
-    close_position_flag, close_price, close_percent = get_close_position_flag(symbol, side, signal_time, config_params, current_ohlcv_df, ohlcv_df_dict, position_dict)
-    max_drawdown = update_max_drawdown(symbol, side, close_price, max_drawdown, current_ohlcv_df, position_dict)
+    close_position_flag, close_price, close_percent = get_close_position_flag(symbol, side, signal_time, config_params, current_bar, ohlcv_df_dict, position_dict)
+    max_drawdown = update_max_drawdown(symbol, side, close_price, max_drawdown, current_bar, position_dict)
 
     if close_position_flag:
         budget, position_dict, transaction_dict = update_close_position(symbol, side, close_price, close_percent, signal_time, config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
     else:
         position_dict = update_stop_price(side, symbol, signal_time, config_params, position_dict, ohlcv_df_dict)
 
-    return budget, max_drawdown, position_dict, transaction_dict
\ No newline at end of file
+    return budget, max_drawdown, position_dict, transaction_dict
+
+
+def gen_transaction_dict():
+    transaction_dict = {
+        'symbol': [],
+        'side': [],
+        'amount': [],
+        'open_time': [],
+        'open_price': [],
+        'close_time': [],
+        'close_price': [],
+        'value': [],
+        'notional': [],
+        'profit': [],
+        'profit_percent': []
+    }
+
+    return transaction_dict
+
+
+def gen_backtest_dict(ohlcv_df_dict):
+    '''
+    Numpy array of each column in ohlcv_df_dict for run_backtest, time as int64 nanosecond.
+    '''
+    backtest_dict = {}
+
+    for symbol_type in ohlcv_df_dict:
+        backtest_dict[symbol_type] = {}
+
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            backtest_dict[symbol_type][timeframe] = {}
+
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
+                array_dict = {column: ohlcv_df[column].to_numpy() for column in ohlcv_df.columns}
+                array_dict['time'] = ohlcv_df['time'].values.astype('datetime64[ns]').astype(np.int64)
+
+                backtest_dict[symbol_type][timeframe][symbol] = array_dict
+
+    return backtest_dict
+
+
+def get_current_bar(symbol, signal_time, config_params, backtest_dict):
+    '''
+    Action timeframe bar of symbol at signal_time, None if symbol has no bar at signal_time.
+    '''
+    array_dict = backtest_dict['base'][config_params['action_timeframe']][symbol]
+    index = int(np.searchsorted(array_dict['time'], signal_time))
+
+    # Missing bar or signal time after the last row
+    if (index == len(array_dict['time'])) or (array_dict['time'][index] != signal_time):
+        return None
+
+    current_bar = gen_bar_dict({column: array_dict[column][index] for column in ['open', 'high', 'low', 'close']})
+
+    return current_bar
+
+
+def get_clear_price(symbol, signal_time, config_params, backtest_dict):
+    '''
+    Close of the last action timeframe bar of symbol at or before signal_time, to clear final position.
+    '''
+    array_dict = backtest_dict['base'][config_params['action_timeframe']][symbol]
+    index = get_asof_index(array_dict['time'], signal_time)
+    clear_price = float(array_dict['close'][index])
+
+    return clear_price
+
+
+@func_profile.profile_func
+def add_align_index(action_time_array, backtest_dict):
+    '''
+    As-of alignment map from action bar index to the last row at or before it of every timeframe and symbol,
+    built once so checks find their row in O(1) with get_align_index and get_align_index_array.
+    Action bars before the first row of a frame are -1, never used as row.
+    '''
+    align_dict = {
+        'time': action_time_array,
+        'last_time': None,
+        'last_index': None
+    }
+
+    for symbol_type in ['base', 'lead']:
+        align_dict[symbol_type] = {}
+
+        for timeframe in backtest_dict[symbol_type]:
+            align_dict[symbol_type][timeframe] = {}
+
+            for symbol in backtest_dict[symbol_type][timeframe]:
+                align_dict[symbol_type][timeframe][symbol] = get_asof_index_array(backtest_dict[symbol_type][timeframe][symbol]['time'], action_time_array)
+
+    backtest_dict['align'] = align_dict
+
+    return backtest_dict
+
+
+def get_action_index(signal_time, align_dict):
+    '''
+    Action bar index of signal_time, None if signal_time is not an action time.
+    All checks of a bar share signal_time, so the last index is kept.
+    '''
+    if align_dict['last_time'] != signal_time:
+        action_index = int(np.searchsorted(align_dict['time'], signal_time))
+
+        if (action_index == len(align_dict['time'])) or (align_dict['time'][action_index] != signal_time):
+            action_index = None
+
+        align_dict['last_time'] = signal_time
+        align_dict['last_index'] = action_index
+
+    return align_dict['last_index']
+
+
+def get_align_index(symbol_type, timeframe, symbol, signal_time, backtest_dict):
+    '''
+    Last row of timeframe at or before signal_time, from the alignment map of add_align_index if built.
+    '''
+    align_dict = backtest_dict.get('align')
+    action_index = get_action_index(signal_time, align_dict) if align_dict != None else None
+
+    if action_index != None:
+        index = int(align_dict[symbol_type][timeframe][symbol][action_index])
+
+        # No row at or before signal time
+        if index < 0:
+            index = None
+    else:
+        index = get_asof_index(backtest_dict[symbol_type][timeframe][symbol]['time'], signal_time)
+
+    return index
+
+
+def get_align_index_array(symbol_type, timeframe, symbol, action_time_array, backtest_dict):
+    '''
+    Last row of timeframe at or before each action time, from the alignment map of add_align_index if built on action_time_array.
+    -1 where there is no row, check_signal_*_vector give no_action for it.
+    '''
+    align_dict = backtest_dict.get('align')
+
+    if (align_dict != None) and (align_dict['time'] is action_time_array):
+        index_array = align_dict[symbol_type][timeframe][symbol]
+    else:
+        index_array = get_asof_index_array(backtest_dict[symbol_type][timeframe][symbol]['time'], action_time_array)
+
+    return index_array
+
+
+@func_profile.profile_func
+def get_action_array(symbol, objective, action_list, signal_time, config_params, backtest_dict):
+    for timeframe in config_params['base'][objective]:
+        array_dict = backtest_dict['base'][timeframe][symbol]
+        index = get_align_index('base', timeframe, symbol, signal_time, backtest_dict)
+
+        for signal in config_params['base'][objective][timeframe]:
+            for func_name in config_params['base'][objective][timeframe][signal]['check']:
+                call_check_signal_array_func(func_name)(objective, 'base', index, signal, action_list, array_dict, timeframe, config_params)
+
+    # Lead checks are the same for all base symbols, use the consensus of add_lead_consensus if any
+    lead_consensus_dict = backtest_dict.get('lead_consensus', {})
+
+    if objective in lead_consensus_dict:
+        index = np.searchsorted(lead_consensus_dict['time'], signal_time)
+        action_list.append(int(lead_consensus_dict[objective][index]))
+    else:
+        for timeframe in config_params['lead'][objective]:
+            for lead_symbol in config_params['lead']['symbol']:
+                array_dict = backtest_dict['lead'][timeframe][lead_symbol]
+                index = get_align_index('lead', timeframe, lead_symbol, signal_time, backtest_dict)
+
+                for signal in config_params['lead'][objective][timeframe]:
+                    for func_name in config_params['lead'][objective][timeframe][signal]['check']:
+                        call_check_signal_array_func(func_name)(objective, 'lead', index, signal, action_list, array_dict, timeframe, config_params)
+
+    return action_list
+
+
+def get_stop_price_signal_array(stop_key, stop_side, symbol, signal_time, stop_price_list, backtest_dict, config_params):
+    if config_params[stop_key]['signal'] != None:
+        stop_timeframe = config_params[stop_key]['signal']['timeframe']
+        array_dict = backtest_dict['base'][stop_timeframe][symbol]
+        index = get_align_index('base', stop_timeframe, symbol, signal_time, backtest_dict)
+
+        signal = list(config_params[stop_key]['signal']['signal'])[0]
+        signal_key = get_signal_key(signal, config_params[stop_key]['signal']['signal'][signal])
+
+        # No stop price from signal before its first row
+        if index != None:
+            stop_price_list.append(float(array_dict[signal_key][index]))
+
+    return stop_price_list
+
+
+@func_profile.profile_func
+def get_stop_price_array(stop_key, side, symbol, signal_time, open_price, backtest_dict, config_params):
+    stop_price_list = []
+
+    stop_side = get_stop_side(stop_key, side)
+    stop_price_list = get_stop_price_percent(stop_key, stop_side, open_price, stop_price_list, config_params)
+    stop_price_list = get_stop_price_signal_array(stop_key, stop_side, symbol, signal_time, stop_price_list, backtest_dict, config_params)
+    stop_price = select_stop_price(stop_side, stop_price_list)
+
+    return stop_price
+
+
+@func_profile.profile_func
+def open_position_array(symbol, signal_time, max_open_timeframe, config_params, budget, backtest_dict, position_dict, interval_dict):
+    '''
+    Same as open_position on backtest_dict, signal_time as int64 nanosecond.
+    '''
+    # Index 0 is used for signal check, First timestamp start at index 1.
+    if backtest_dict['base'][max_open_timeframe][symbol]['time'][1] <= signal_time:
+        action_list = get_action_array(symbol, 'open', [], signal_time, config_params, backtest_dict)
+
+        if (len(set(action_list)) == 1) & (action_list[0] in get_target_code_list(config_params)):
+            position_dict = open_position_side_array(symbol, action_list[0], signal_time, config_params, budget, backtest_dict, position_dict, interval_dict)
+
+    return position_dict
+
+
+def open_position_side_array(symbol, side, signal_time, config_params, budget, backtest_dict, position_dict, interval_dict):
+    current_bar = get_current_bar(symbol, signal_time, config_params, backtest_dict)
+
+    if current_bar == None:
+        logger.debug("     No bar of %s", symbol)
+        return position_dict
+
+    open_price = current_bar['close']
+    amount = ((config_params['action_percent'] / 100) * budget) / open_price * config_params['leverage']
+    tp_price = get_stop_price_array('tp', side, symbol, signal_time, open_price, backtest_dict, config_params)
+    sl_price = get_stop_price_array('sl', side, symbol, signal_time, open_price, backtest_dict, config_params)
+
+    position_dict = update_open_opsition(symbol, side, open_price, amount, tp_price, sl_price, pd.Timestamp(signal_time), position_dict, config_params, interval_dict)
+
+    return position_dict
+
+
+@func_profile.profile_func
+def close_position_array(symbol, signal_time, max_drawdown, config_params, budget, reinvest_profit_flag, backtest_dict, position_dict, transaction_dict, interval_dict):
+    '''
+    Same as close_position on backtest_dict, signal_time as int64 nanosecond.
+    '''
+    side = position_dict[symbol]['side']
+    current_bar = get_current_bar(symbol, signal_time, config_params, backtest_dict)
+
+    # Position is kept as is without bar
+    if current_bar == None:
+        logger.debug("     No bar of %s", symbol)
+        return budget, max_drawdown, position_dict, transaction_dict
+
+    if config_params.get('intrabar_timeframe') != None:
+        array_dict = backtest_dict['base'][config_params['intrabar_timeframe']][symbol]
+        start_index, end_index = np.searchsorted(array_dict['time'], [signal_time, signal_time + interval_dict[config_params['action_timeframe']] * 60 * 10**9])
+        current_bar = add_intrabar(current_bar, start_index, end_index, array_dict['high'], array_dict['low'])
+
+    close_position_flag, close_price, close_percent = get_stop_close_flag(symbol, side, config_params, current_bar, position_dict)
+
+    if not close_position_flag:
+        action_list = get_action_array(symbol, 'close', [side], signal_time, config_params, backtest_dict)
+        close_position_flag, close_price, close_percent = get_signal_close_flag(symbol, action_list, current_bar, position_dict)
+
+    max_drawdown = update_max_drawdown(symbol, side, close_price, max_drawdown, current_bar, position_dict)
+
+    if close_position_flag:
+        budget, position_dict, transaction_dict = update_close_position(symbol, side, close_price, close_percent, pd.Timestamp(signal_time), config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
+    else:
+        for stop_key in ['tp', 'sl']:
+            stop_price = get_stop_price_array(stop_key, side, symbol, signal_time, position_dict[symbol]['open_price'], backtest_dict, config_params)
+
+            if position_dict[symbol][stop_key] != stop_price:
+                position_dict[symbol][stop_key] = stop_price
+                logger.debug("     Update %s: %s", stop_key, stop_price)
+
+    return budget, max_drawdown, position_dict, transaction_dict
+
+
+def get_backtest_result(budget, final_budget, max_drawdown, transaction_dict):
+    '''
+    Summary of one backtest: return, max drawdown and win rate in percent.
+    '''
+    profit_array = np.array(transaction_dict['profit'], dtype=np.float64)
+
+    result_dict = {
+        'final_budget': final_budget,
+        'return_percent': (final_budget - budget) / budget * 100,
+        'max_drawdown_percent': max_drawdown * 100,
+        'win_rate_percent': (profit_array > 0).mean() * 100 if len(profit_array) > 0 else np.nan,
+        'transaction': len(profit_array)
+    }
+
+    return result_dict
+
+
+def get_vector_check_flag(objective, symbol_type, config_params):
+    '''
+    Check if all checks of objective can use check_signal_*_vector, inner band trigger depends on previous checks.
+    '''
+    vector_check_flag = True
+
+    for timeframe in config_params[symbol_type][objective]:
+        for signal in config_params[symbol_type][objective][timeframe]:
+            signal_dict = config_params[symbol_type][objective][timeframe][signal]
+
+            if ('check_signal_band' in signal_dict['check']) and (signal_dict['trigger'] != 'outer'):
+                vector_check_flag = False
+
+    return vector_check_flag
+
+
+def get_vectorize_flag(config_params):
+    '''
+    Check if config_params can be backtested by run_vectorized_backtest:
+    one base symbol, no lead signal, full close by percent stops and no inner band trigger.
+    '''
+    vectorize_flag = (len(config_params['base']['symbol']) == 1) & (config_params['action_percent'] <= 100)
+
+    for objective in ['open', 'close']:
+        if (len(config_params['lead']['symbol']) > 0) & (len(config_params['lead'][objective]) > 0):
+            vectorize_flag = False
+
+        if not get_vector_check_flag(objective, 'base', config_params):
+            vectorize_flag = False
+
+    for stop_key in ['tp', 'sl']:
+        if (config_params[stop_key]['signal'] != None) | (config_params[stop_key]['stop_percent'] != 100):
+            vectorize_flag = False
+
+    return vectorize_flag
+
+
+def get_action_code_array(objective, symbol, action_time_array, config_params, backtest_dict):
+    '''
+    Side code of every check at each action time, shape (action time, check).
+    '''
+    code_array_list = []
+
+    for timeframe in config_params['base'][objective]:
+        array_dict = backtest_dict['base'][timeframe][symbol]
+        index_array = get_align_index_array('base', timeframe, symbol, action_time_array, backtest_dict)
+
+        for signal in config_params['base'][objective][timeframe]:
+            for func_name in config_params['base'][objective][timeframe][signal]['check']:
+                code_array = call_check_signal_vector_func(func_name)(objective, 'base', index_array, signal, array_dict, timeframe, config_params)
+                code_array_list.append(code_array)
+
+    action_code_array = np.column_stack(code_array_list) if len(code_array_list) > 0 else np.empty((len(action_time_array), 0), dtype=np.int8)
+
+    return action_code_array
+
+
+def get_lead_code_array(objective, action_time_array, config_params, backtest_dict):
+    '''
+    Side code of every lead check at each action time, shape (action time, check). Same for all base symbols.
+    '''
+    code_array_list = []
+
+    for timeframe in config_params['lead'][objective]:
+        for lead_symbol in config_params['lead']['symbol']:
+            array_dict = backtest_dict['lead'][timeframe][lead_symbol]
+            index_array = get_align_index_array('lead', timeframe, lead_symbol, action_time_array, backtest_dict)
+
+            for signal in config_params['lead'][objective][timeframe]:
+                for func_name in config_params['lead'][objective][timeframe][signal]['check']:
+                    code_array = call_check_signal_vector_func(func_name)(objective, 'lead', index_array, signal, array_dict, timeframe, config_params)
+                    code_array_list.append(code_array)
+
+    lead_code_array = np.column_stack(code_array_list) if len(code_array_list) > 0 else np.empty((len(action_time_array), 0), dtype=np.int8)
+
+    return lead_code_array
+
+
+def get_lead_consensus_array(objective, action_time_array, config_params, backtest_dict):
+    '''
+    Side code agreed by all lead checks at each action time, 0 if they disagree. None if no lead check.
+    Open or close needs all checks on one side, so the consensus can stand for all lead checks.
+    '''
+    lead_code_array = get_lead_code_array(objective, action_time_array, config_params, backtest_dict)
+
+    if lead_code_array.shape[1] == 0:
+        return None
+
+    agree_flag_array = (lead_code_array == lead_code_array[:, :1]).all(axis=1)
+    lead_consensus_array = np.where(agree_flag_array, lead_code_array[:, 0], 0).astype(np.int8)
+
+    return lead_consensus_array
+
+
+@func_profile.profile_func
+def add_lead_consensus(action_time_array, config_params, backtest_dict):
+    '''
+    Evaluate lead checks once for the whole history, shared by all base symbols in get_action_array.
+    Objectives with inner band trigger on lead depend on previous checks and are still checked bar by bar.
+    '''
+    lead_consensus_dict = {
+        'time': action_time_array
+    }
+
+    for objective in ['open', 'close']:
+        if (len(config_params['lead']['symbol']) > 0) & get_vector_check_flag(objective, 'lead', config_params):
+            lead_consensus_array = get_lead_consensus_array(objective, action_time_array, config_params, backtest_dict)
+
+            if lead_consensus_array is not None:
+                lead_consensus_dict[objective] = lead_consensus_array
+
+    backtest_dict['lead_consensus'] = lead_consensus_dict
+
+    return backtest_dict
+
+
+def get_check_count(objective, config_params, backtest_dict):
+    '''
+    Length of action_list of get_action_array, lead checks count as one if they have a consensus.
+    '''
+    check_count_dict = {}
+
+    for symbol_type in ['base', 'lead']:
+        symbol_count = 1 if symbol_type == 'base' else len(config_params['lead']['symbol'])
+        check_count_dict[symbol_type] = 0
+
+        for timeframe in config_params[symbol_type][objective]:
+            for signal in config_params[symbol_type][objective][timeframe]:
+                check_count_dict[symbol_type] += len(config_params[symbol_type][objective][timeframe][signal]['check']) * symbol_count
+
+    if objective in backtest_dict.get('lead_consensus', {}):
+        check_count_dict['lead'] = 1
+
+    check_count = check_count_dict['base'] + check_count_dict['lead']
+
+    return check_count
+
+
+@func_profile.profile_func
+def get_open_code_matrix(action_time_array, max_open_timeframe, config_params, backtest_dict):
+    '''
+    Open side code of each base symbol at each action time, shape (action time, symbol), 0 if not open.
+    Checks with inner band trigger fall back to get_action_array row by row.
+    '''
+    symbol_list = config_params['base']['symbol']
+    target_code_list = get_target_code_list(config_params)
+    vector_check_flag = get_vector_check_flag('open', 'base', config_params) & get_vector_check_flag('open', 'lead', config_params)
+    open_code_matrix = np.zeros((len(action_time_array), len(symbol_list)), dtype=np.int8)
+
+    if vector_check_flag:
+        lead_code_array = get_lead_code_array('open', action_time_array, config_params, backtest_dict)
+
+    for i, symbol in enumerate(symbol_list):
+        # Index 0 is used for signal check, First timestamp start at index 1.
+        available_flag_array = backtest_dict['base'][max_open_timeframe][symbol]['time'][1] <= action_time_array
+
+        if vector_check_flag:
+            code_array = np.column_stack([get_action_code_array('open', symbol, action_time_array, config_params, backtest_dict), lead_code_array])
+        else:
+            code_array = np.zeros((len(action_time_array), get_check_count('open', config_params, backtest_dict)), dtype=np.int8)
+
+            for j in np.flatnonzero(available_flag_array):
+                code_array[j] = get_action_array(symbol, 'open', [], action_time_array[j], config_params, backtest_dict)
+
+        if code_array.shape[1] > 0:
+            open_side_array = code_array[:, 0]
+            open_flag_array = available_flag_array & (code_array == open_side_array[:, None]).all(axis=1) & np.isin(open_side_array, target_code_list)
+            open_code_matrix[:, i] = np.where(open_flag_array, open_side_array, 0)
+
+    return open_code_matrix
+
+
+def get_rank_matrix(rank_column, action_time_array, config_params, backtest_dict):
+    '''
+    Value of rank_column on action timeframe of each base symbol at each action time, shape (action time, symbol), nan ranked last.
+    '''
+    symbol_list = config_params['base']['symbol']
+    rank_matrix = np.full((len(action_time_array), len(symbol_list)), -np.inf)
+
+    for i, symbol in enumerate(symbol_list):
+        array_dict = backtest_dict['base'][config_params['action_timeframe']][symbol]
+        index_array = get_align_index_array('base', config_params['action_timeframe'], symbol, action_time_array, backtest_dict)
+        rank_array = array_dict[rank_column][np.maximum(index_array, 0)].astype(np.float64)
+        rank_matrix[:, i] = np.where((index_array >= 0) & ~np.isnan(rank_array), rank_array, -np.inf)
+
+    return rank_matrix
+
+
+def get_next_index_array(flag_array):
+    '''
+    Index of the first True at or after each position, len(flag_array) if none.
+    '''
+    index_array = np.where(flag_array, np.arange(len(flag_array)), len(flag_array))
+    next_index_array = np.minimum.accumulate(index_array[::-1])[::-1]
+
+    return next_index_array
+
+
+def get_stop_hit_index(side, tp_price, sl_price, high_array, low_array, start_index, end_index):
+    '''
+    First index from start_index to end_index (included) where tp or sl is hit, end_index + 1 if none.
+    Search in growing chunks so a trade only scans its holding bars.
+    '''
+    chunk = 64
+    i = start_index
+
+    while i <= end_index:
+        j = min(i + chunk, end_index + 1)
+
+        if side == side_code_dict['buy']:
+            hit_flag_array = (high_array[i:j] >= tp_price) | (low_array[i:j] <= sl_price)
+        else:
+            hit_flag_array = (low_array[i:j] <= tp_price) | (high_array[i:j] >= sl_price)
+
+        if hit_flag_array.any():
+            return i + int(np.argmax(hit_flag_array))
+
+        i = j
+        chunk *= 2
+
+    return end_index + 1
+
+
+@func_profile.profile_func
+def run_vectorized_backtest(budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict):
+    '''
+    Backtest single position strategy with array operations. Same result as run_backtest for config_params passing get_vectorize_flag.
+    Signals of all action time are computed at once, then each trade jumps to its exit bar.
+    '''
+    backtest_dict = gen_backtest_dict(ohlcv_df_dict)
+    symbol = config_params['base']['symbol'][0]
+    array_dict = backtest_dict['base'][config_params['action_timeframe']][symbol]
+
+    action_time_array = array_dict['time'][1:]
+    backtest_dict = add_align_index(action_time_array, backtest_dict)
+    close_array = array_dict['close'][1:].astype(np.float64)
+    high_array = array_dict['high'][1:].astype(np.float64)
+    low_array = array_dict['low'][1:].astype(np.float64)
+    last_index = len(action_time_array) - 1
+
+    # Intrabar bars of each action bar are intrabar_index_array[i] to intrabar_index_array[i + 1]
+    intrabar_timeframe = config_params.get('intrabar_timeframe')
+
+    if intrabar_timeframe != None:
+        intrabar_dict = backtest_dict['base'][intrabar_timeframe][symbol]
+        interval_ns = interval_dict[config_params['action_timeframe']] * 60 * 10**9
+        intrabar_index_array = np.searchsorted(intrabar_dict['time'], np.append(action_time_array, action_time_array[-1] + interval_ns if len(action_time_array) > 0 else 0))
+
+    # Open side code of each action time, 0 if not open
+    max_open_timeframe = get_max_open_timeframe(config_params, interval_dict)
+    available_flag_array = backtest_dict['base'][max_open_timeframe][symbol]['time'][1] <= action_time_array
+    open_code_array = get_action_code_array('open', symbol, action_time_array, config_params, backtest_dict)
+    target_code_list = get_target_code_list(config_params)
+
+    open_side_array = open_code_array[:, 0].copy() if open_code_array.shape[1] > 0 else np.zeros(len(action_time_array), dtype=np.int8)
+    open_flag_array = available_flag_array & (open_code_array == open_side_array[:, None]).all(axis=1) & np.isin(open_side_array, target_code_list)
+    open_side_array[~open_flag_array] = 0
+    next_open_array = get_next_index_array(open_flag_array)
+
+    # Close by signal of each position side
+    close_code_array = get_action_code_array('close', symbol, action_time_array, config_params, backtest_dict)
+    next_signal_close_dict = {
+        side: get_next_index_array((close_code_array != side).any(axis=1)) for side in [side_code_dict['buy'], side_code_dict['sell']]
+    }
+
+    transaction_dict = gen_transaction_dict()
+    budget_array = np.full(len(action_time_array), np.nan)
+    position_dict = {}
+    max_drawdown = 0
+    signal_index = 0
+    end_index = last_index
+
+    while (len(action_time_array) > 0) & (signal_index <= last_index):
+        open_index = next_open_array[signal_index]
+
+        if open_index > last_index:
+            break
+
+        side = int(open_side_array[open_index])
+        open_price = close_array[open_index]
+        amount = ((config_params['action_percent'] / 100) * budget) / open_price * config_params['leverage']
+        tp_price = select_stop_price(get_stop_side('tp', side), get_stop_price_percent('tp', get_stop_side('tp', side), open_price, [], config_params))
+        sl_price = select_stop_price(get_stop_side('sl', side), get_stop_price_percent('sl', get_stop_side('sl', side), open_price, [], config_params))
+        position_dict = update_open_opsition(symbol, side, open_price, amount, tp_price, sl_price, pd.Timestamp(action_time_array[open_index]), position_dict, config_params, interval_dict)
+
+        # Exit at first stop hit or close signal after open
+        signal_close_index = next_signal_close_dict[side][open_index + 1] if open_index < last_index else last_index + 1
+        search_end_index = min(signal_close_index, last_index)
+        close_index = get_stop_hit_index(side, tp_price, sl_price, high_array, low_array, open_index + 1, search_end_index)
+
+        if close_index <= search_end_index:
+            tp_flag = (high_array[close_index] >= tp_price) if side == side_code_dict['buy'] else (low_array[close_index] <= tp_price)
+            sl_flag = (low_array[close_index] <= sl_price) if side == side_code_dict['buy'] else (high_array[close_index] >= sl_price)
+
+            if tp_flag & sl_flag & (intrabar_timeframe != None):
+                start_index, end_index = intrabar_index_array[close_index], intrabar_index_array[close_index + 1]
+                tp_flag = not get_sl_first_flag(side, tp_price, sl_price, intrabar_dict['high'][start_index:end_index], intrabar_dict['low'][start_index:end_index])
+
+            close_price = tp_price if tp_flag else sl_price
+        elif signal_close_index <= last_index:
+            close_index = signal_close_index
+            close_price = close_array[close_index]
+        else:
+            close_index = None
+            close_price = None
+
+        # Drawdown of holding bars, the closing bar uses close price
+        hold_end_index = close_index if close_index != None else last_index
+        if side == side_code_dict['buy']:
+            adverse_array = low_array[open_index + 1:hold_end_index + 1].copy()
+        else:
+            adverse_array = high_array[open_index + 1:hold_end_index + 1].copy()
+
+        if (close_index != None) & (len(adverse_array) > 0):
+            adverse_array[-1] = close_price
+
+        if len(adverse_array) > 0:
+            worst_price = adverse_array.min() if side == side_code_dict['buy'] else adverse_array.max()
+            max_drawdown = update_max_drawdown(symbol, side, worst_price, max_drawdown, None, position_dict)
+
+        budget_array[signal_index:hold_end_index] = budget
+
+        if close_index == None:
+            end_index = last_index
+            break
+
+        budget, position_dict, transaction_dict = update_close_position(symbol, side, close_price, 100, pd.Timestamp(action_time_array[close_index]), config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
+        budget_array[close_index] = budget
+        signal_index = close_index
+
+        if budget <= 0:
+            # Position can still be opened on the same bar before stop
+            if open_flag_array[close_index]:
+                side = int(open_side_array[close_index])
+                open_price = close_array[close_index]
+                amount = ((config_params['action_percent'] / 100) * budget) / open_price * config_params['leverage']
+                position_dict = update_open_opsition(symbol, side, open_price, amount, np.nan, np.nan, pd.Timestamp(action_time_array[close_index]), position_dict, config_params, interval_dict)
+
+            logger.warning("Out of money at %s", pd.Timestamp(action_time_array[close_index]))
+            end_index = close_index
+            break
+
+    budget_array[signal_index:end_index + 1] = np.where(np.isnan(budget_array[signal_index:end_index + 1]), budget, budget_array[signal_index:end_index + 1])
+    budget_array = budget_array[:end_index + 1]
+
+    budget_dict = {
+        'time': [pd.Timestamp(x) for x in action_time_array[:end_index + 1]],
+        'budget': budget_array.tolist()
+    }
+
+    # Clear final position
+    for symbol in list(position_dict):
+        side = position_dict[symbol]['side']
+        budget, position_dict, transaction_dict = update_close_position(symbol, side, close_array[end_index], 100, pd.Timestamp(action_time_array[end_index]), config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
+
+    return budget, max_drawdown, transaction_dict, budget_dict
+
+
+@func_profile.profile_func
+def run_backtest(budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict, vectorize_flag=False):
+    '''
+    Backtest all action time over numpy arrays of ohlcv_df_dict.
+    Same result as looping close_position and open_position over gen_action_time_list.
+    If vectorize_flag, use run_vectorized_backtest when config_params allows it.
+    '''
+    if vectorize_flag and get_vectorize_flag(config_params):
+        return run_vectorized_backtest(budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict)
+
+    backtest_dict = gen_backtest_dict(ohlcv_df_dict)
+    max_open_timeframe = get_max_open_timeframe(config_params, interval_dict)
+    action_time_array = backtest_dict['base'][config_params['action_timeframe']][config_params['base']['symbol'][0]]['time'][1:]
+    backtest_dict = add_align_index(action_time_array, backtest_dict)
+    backtest_dict = add_lead_consensus(action_time_array, config_params, backtest_dict)
+    max_position = int(1 / (config_params['action_percent'] / 100))
+
+    transaction_dict = gen_transaction_dict()
+    budget_dict = {
+        'time': [],
+        'budget': []
+    }
+    position_dict = {}
+    max_drawdown = 0
+
+    for signal_time in action_time_array:
+        for symbol in list(position_dict):
+            budget, max_drawdown, position_dict, transaction_dict = close_position_array(symbol, signal_time, max_drawdown, config_params, budget, reinvest_profit_flag, backtest_dict, position_dict, transaction_dict, interval_dict)
+
+        for symbol in [x for x in config_params['base']['symbol'] if x not in position_dict][:max_position]:
+            position_dict = open_position_array(symbol, signal_time, max_open_timeframe, config_params, budget, backtest_dict, position_dict, interval_dict)
+
+        budget_dict['time'].append(pd.Timestamp(signal_time))
+        budget_dict['budget'].append(budget)
+
+        if budget <= 0:
+            logger.warning("Out of money at %s", pd.Timestamp(signal_time))
+            break
+
+    # Clear final position
+    for symbol in list(position_dict):
+        side = position_dict[symbol]['side']
+        close_price = get_clear_price(symbol, signal_time, config_params, backtest_dict)
+        budget, position_dict, transaction_dict = update_close_position(symbol, side, close_price, 100, pd.Timestamp(signal_time), config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
+
+    return budget, max_drawdown, transaction_dict, budget_dict
+
+
+@func_profile.profile_func
+def run_portfolio_backtest(budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict, max_position=None, rank_column=None, margin_flag=True):
+    '''
+    Backtest all base symbols as one portfolio sharing budget.
+    Open signals of all symbols are computed at once by get_open_code_matrix, open positions are closed as in run_backtest.
+    At most max_position positions are held (from action_percent if None). When more symbols signal than free slots,
+    symbols with the highest rank_column on action timeframe are opened first, config order if rank_column is None.
+    If margin_flag, position is opened only if its margin fits budget not used by open positions.
+    Unlike run_backtest, which only checks the first max_position symbols not in position in config order,
+    every symbol not in position is checked for the free slots. With margin_flag False, results match run_backtest
+    only if base symbols are no more than max_position.
+    '''
+    backtest_dict = gen_backtest_dict(ohlcv_df_dict)
+    symbol_list = config_params['base']['symbol']
+    max_open_timeframe = get_max_open_timeframe(config_params, interval_dict)
+    action_time_array = backtest_dict['base'][config_params['action_timeframe']][symbol_list[0]]['time'][1:]
+    backtest_dict = add_align_index(action_time_array, backtest_dict)
+    backtest_dict = add_lead_consensus(action_time_array, config_params, backtest_dict)
+
+    if max_position == None:
+        max_position = int(1 / (config_params['action_percent'] / 100))
+
+    open_code_matrix = get_open_code_matrix(action_time_array, max_open_timeframe, config_params, backtest_dict)
+
+    if rank_column != None:
+        rank_matrix = get_rank_matrix(rank_column, action_time_array, config_params, backtest_dict)
+
+    transaction_dict = gen_transaction_dict()
+    budget_dict = {
+        'time': [],
+        'budget': []
+    }
+    position_dict = {}
+    max_drawdown = 0
+
+    for i, signal_time in enumerate(action_time_array):
+        for symbol in list(position_dict):
+            budget, max_drawdown, position_dict, transaction_dict = close_position_array(symbol, signal_time, max_drawdown, config_params, budget, reinvest_profit_flag, backtest_dict, position_dict, transaction_dict, interval_dict)
+
+        symbol_index_array = np.array([x for x in np.flatnonzero(open_code_matrix[i]) if symbol_list[x] not in position_dict], dtype=np.int64)
+
+        if rank_column != None:
+            symbol_index_array = symbol_index_array[np.argsort(-rank_matrix[i, symbol_index_array], kind='stable')]
+
+        for symbol_index in symbol_index_array[:max(max_position - len(position_dict), 0)]:
+            symbol = symbol_list[symbol_index]
+
+            if margin_flag:
+                used_margin = sum(position_dict[x]['notional'] for x in position_dict) / config_params['leverage']
+
+                if used_margin + (config_params['action_percent'] / 100) * budget > budget * (1 + 1e-9):
+                    logger.debug("     Not enough margin for %s", symbol)
+                    continue
+
+            position_dict = open_position_side_array(symbol, int(open_code_matrix[i, symbol_index]), signal_time, config_params, budget, backtest_dict, position_dict, interval_dict)
+
+        budget_dict['time'].append(pd.Timestamp(signal_time))
+        budget_dict['budget'].append(budget)
+
+        if budget <= 0:
+            logger.warning("Out of money at %s", pd.Timestamp(signal_time))
+            break
+
+    # Clear final position
+    for symbol in list(position_dict):
+        side = position_dict[symbol]['side']
+        close_price = get_clear_price(symbol, signal_time, config_params, backtest_dict)
+        budget, position_dict, transaction_dict = update_close_position(symbol, side, close_price, 100, pd.Timestamp(signal_time), config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
+
+    return budget, max_drawdown, transaction_dict, budget_dict
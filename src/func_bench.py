@@ -0,0 +1,424 @@
+import numpy as np
+import pandas as pd
+import datetime as dt
+import tracemalloc
+import copy
+import time
+
+import func_get
+import func_signal
+import func_backtest
+import func_cache
+import func_log
+
+
+logger = func_log.get_logger(__name__)
+
+
+bench_interval_dict = {'1m': 1, '5m': 5, '15m': 15, '30m': 30, '1h': 60, '2h': 120, '4h': 240, '1d': 1440}
+
+# Params of each indicator in func_signal.get_func_add_dict
+bench_signal_dict = {
+    'sma': {'windows': 20},
+    'ema': {'windows': 20},
+    'tma': {'windows': 20},
+    'cross_sma': {'short_windows': 15, 'long_windows': 200},
+    'cross_ema': {'short_windows': 15, 'long_windows': 200},
+    'cross_tma': {'short_windows': 15, 'long_windows': 200},
+    'bollinger': {'windows': 20, 'std': 2},
+    'supertrend': {'atr_range': 10, 'multiplier': 3},
+    'wt': {'channel_range': 10, 'average_range': 21},
+    'rsi': {'average_range': 14},
+    'donchian': {'windows': 20},
+    'hull': {'windows': 16}
+}
+
+# Representative strategies of backtest notebooks
+bench_config_dict = {
+    'messi': {
+        'safety_ohlcv_range': 200,
+        'action_timeframe': '2h',
+        'target_side': ['buy', 'sell'],
+        'base': {
+            'symbol': ['ETH-PERP'],
+            'open': {
+                '2h': {
+                    'tma': {
+                        'check': ['check_signal_side_change'],
+                        'look_back': 1,
+                        'windows': 50,
+                        'revert': False
+                    }
+                }
+            },
+            'close': {
+                '2h': {
+                    'tma': {
+                        'check': ['check_signal_side'],
+                        'look_back': 1,
+                        'windows': 50,
+                        'revert': False
+                    }
+                }
+            }
+        },
+        'lead': {
+            'symbol': [],
+            'open': {
+            },
+            'close': {
+            }
+        },
+        'tp': {
+            'stop_percent': 100,
+            'price_percent': None,
+            'signal': None
+        },
+        'sl': {
+            'stop_percent': 100,
+            'price_percent': None,
+            'signal': None
+        },
+        'action_percent': 100,
+        'leverage': 1,
+        'taker_fee_percent': 0.07
+    },
+    'cross': {
+        'safety_ohlcv_range': 200,
+        'action_timeframe': '15m',
+        'target_side': ['buy'],
+        'base': {
+            'symbol': ['BTC-PERP'],
+            'open': {
+                '15m': {
+                    'cross_sma': {
+                        'check': ['check_signal_side_change'],
+                        'look_back': 1,
+                        'short_windows': 15,
+                        'long_windows': 200,
+                        'revert': False
+                    }
+                }
+            },
+            'close': {
+                '15m': {
+                    'cross_sma': {
+                        'check': ['check_signal_side'],
+                        'look_back': 1,
+                        'short_windows': 15,
+                        'long_windows': 200,
+                        'revert': False
+                    }
+                }
+            }
+        },
+        'lead': {
+            'symbol': [],
+            'open': {
+            },
+            'close': {
+            }
+        },
+        'tp': {
+            'stop_percent': 100,
+            'price_percent': None,
+            'signal': None
+        },
+        'sl': {
+            'stop_percent': 100,
+            'price_percent': None,
+            'signal': None
+        },
+        'action_percent': 10,
+        'leverage': 10,
+        'taker_fee_percent': 0.07
+    },
+    'cryptoris': {
+        'safety_ohlcv_range': 200,
+        'action_timeframe': '15m',
+        'target_side': ['buy', 'sell'],
+        'base': {
+            'symbol': ['BTC-PERP', 'ETH-PERP'],
+            'open': {
+                '15m': {
+                    'cross_ema': {
+                        'check': ['check_signal_side_change'],
+                        'look_back': 1,
+                        'short_windows': 5,
+                        'long_windows': 30,
+                        'revert': False
+                    }
+                },
+                '1h': {
+                    'tma': {
+                        'check': ['check_signal_side'],
+                        'look_back': 1,
+                        'windows': 20,
+                        'revert': False
+                    }
+                }
+            },
+            'close': {
+                '15m': {
+                    'cross_ema': {
+                        'check': ['check_signal_side'],
+                        'look_back': 1,
+                        'short_windows': 5,
+                        'long_windows': 30,
+                        'revert': False
+                    }
+                }
+            }
+        },
+        'lead': {
+            'symbol': ['SOL-PERP'],
+            'open': {
+                '4h': {
+                    'supertrend': {
+                        'check': ['check_signal_side'],
+                        'look_back': 1,
+                        'atr_range': 10,
+                        'multiplier': 3,
+                        'revert': False
+                    }
+                }
+            },
+            'close': {
+            }
+        },
+        'tp': {
+            'stop_percent': 50,
+            'price_percent': 2,
+            'signal': None
+        },
+        'sl': {
+            'stop_percent': 100,
+            'price_percent': 2,
+            'signal': None
+        },
+        'action_percent': 50,
+        'leverage': 2,
+        'taker_fee_percent': 0.07
+    }
+}
+
+
+def gen_synthetic_ohlcv_array(bar_count, interval, seed=0, start_ms=1577836800000):
+    '''
+    Deterministic random walk candles of interval minutes in raw ohlcv layout (time as epoch ms).
+    '''
+    random_state = np.random.RandomState(seed)
+    scale = 0.001 * np.sqrt(interval)
+
+    close_array = 100 * np.exp(np.cumsum(random_state.normal(0, scale, bar_count)))
+    open_array = np.append(100, close_array[:-1])
+    high_array = np.maximum(open_array, close_array) * (1 + np.abs(random_state.normal(0, scale / 2, bar_count)))
+    low_array = np.minimum(open_array, close_array) * (1 - np.abs(random_state.normal(0, scale / 2, bar_count)))
+    volume_array = random_state.lognormal(5, 1, bar_count)
+    time_array = start_ms + np.arange(bar_count, dtype=np.float64) * interval * 60 * 1000
+
+    ohlcv_array = np.column_stack([time_array, open_array, high_array, low_array, close_array, volume_array])
+
+    return ohlcv_array
+
+
+def gen_synthetic_ohlcv_df_dict(config_params, bar_count, interval_dict=bench_interval_dict, seed=0):
+    '''
+    ohlcv_df_dict like get_data with bar_count candles of action timeframe.
+    Each symbol is generated once at its fetch timeframe and grouped to all its timeframes.
+    Intrabar timeframe covers the whole range here, so its bars are grouped from the same walk.
+    '''
+    ohlcv_df_dict = {
+        'base': {},
+        'lead': {}
+    }
+
+    symbol_timeframe_dict = func_get.get_symbol_timeframe_dict(config_params)
+    action_interval = interval_dict[config_params['action_timeframe']]
+    intrabar_timeframe = func_get.get_intrabar_timeframe(config_params)
+    intrabar_timeframe_list = [intrabar_timeframe] if intrabar_timeframe != None else []
+
+    for symbol in config_params['base']['symbol']:
+        symbol_timeframe_dict[symbol].update(intrabar_timeframe_list)
+
+    for i, symbol in enumerate(symbol_timeframe_dict):
+        fetch_timeframe = func_get.get_symbol_fetch_timeframe(symbol_timeframe_dict[symbol], interval_dict)
+        fetch_bar_count = bar_count * action_interval // interval_dict[fetch_timeframe]
+        ohlcv_array = gen_synthetic_ohlcv_array(fetch_bar_count, interval_dict[fetch_timeframe], seed + i)
+
+        for symbol_type in ['base', 'lead']:
+            if symbol in config_params[symbol_type]['symbol']:
+                timeframe_list = func_get.get_timeframe_list(symbol_type, config_params) + (intrabar_timeframe_list if symbol_type == 'base' else [])
+
+                for timeframe in timeframe_list:
+                    if timeframe not in ohlcv_df_dict[symbol_type]:
+                        ohlcv_df_dict[symbol_type][timeframe] = {}
+
+                    grouped_ohlcv_array = func_get.group_ohlcv_array(ohlcv_array, interval_dict[timeframe] * 60 * 1000)
+                    ohlcv_df_dict[symbol_type][timeframe][symbol] = func_get.gen_ohlcv_df(grouped_ohlcv_array, 'UTC')
+
+    return ohlcv_df_dict
+
+
+def measure_call(func, *args, memory_flag=True, **kwargs):
+    '''
+    Return result, second and peak traced memory in bytes of func(*args, **kwargs).
+    Memory is traced in a second call so tracing does not slow the timed call, nan if not memory_flag.
+    '''
+    start_ts = time.perf_counter()
+    result = func(*args, **kwargs)
+    second = time.perf_counter() - start_ts
+
+    if memory_flag:
+        tracemalloc.start()
+
+        try:
+            func(*args, **kwargs)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    else:
+        peak_bytes = np.nan
+
+    return result, second, peak_bytes
+
+
+def add_bench_result(case, bar_count, second, peak_bytes, bench_result_list):
+    bench_result_list.append({
+        'case': case,
+        'bar': bar_count,
+        'second': second,
+        'bar_per_second': bar_count / second if second > 0 else np.nan,
+        'peak_mb': peak_bytes / 1024 / 1024
+    })
+
+    return bench_result_list
+
+
+def bench_indicator(bar_count_list, timeframe='15m', signal_list=None, memory_flag=True, seed=0):
+    '''
+    Throughput of each indicator of func_signal.get_func_add_dict on bar_count candles, without indicator cache.
+    '''
+    func_add_dict = func_signal.get_func_add_dict()
+    signal_list = list(func_add_dict) if signal_list == None else signal_list
+    bench_result_list = []
+
+    for bar_count in bar_count_list:
+        ohlcv_df = func_get.gen_ohlcv_df(gen_synthetic_ohlcv_array(bar_count, bench_interval_dict[timeframe], seed), 'UTC')
+
+        for signal in signal_list:
+            config_params = {'base': {'open': {timeframe: {signal: bench_signal_dict[signal]}}}}
+            _, second, peak_bytes = measure_call(lambda: func_add_dict[signal]('open', ohlcv_df.copy(), timeframe, config_params), memory_flag=memory_flag)
+            bench_result_list = add_bench_result(f'add_{signal}', bar_count, second, peak_bytes, bench_result_list)
+
+    bench_result_df = pd.DataFrame(bench_result_list)
+
+    return bench_result_df
+
+
+def bench_group_timeframe(bar_count_list, interval=15, memory_flag=True, seed=0):
+    '''
+    Throughput of func_get.group_timeframe from bar_count 1m candles to interval minutes.
+    '''
+    bench_result_list = []
+
+    for bar_count in bar_count_list:
+        ohlcv_df = func_get.gen_ohlcv_df(gen_synthetic_ohlcv_array(bar_count, 1, seed), 'UTC')
+        _, second, peak_bytes = measure_call(func_get.group_timeframe, ohlcv_df, interval_minute=interval, memory_flag=memory_flag)
+        bench_result_list = add_bench_result(f'group_timeframe_{interval}', bar_count, second, peak_bytes, bench_result_list)
+
+    bench_result_df = pd.DataFrame(bench_result_list)
+
+    return bench_result_df
+
+
+def get_bench_start_date(config_params, ohlcv_df_dict, interval_dict=bench_interval_dict):
+    '''
+    First action time after safety_ohlcv_range candles of the longest timeframe.
+    '''
+    timeframe_list = [timeframe for symbol_type in ['base', 'lead'] for timeframe in ohlcv_df_dict[symbol_type]]
+    max_interval = max(interval_dict[timeframe] for timeframe in timeframe_list)
+
+    first_time = ohlcv_df_dict['base'][config_params['action_timeframe']][config_params['base']['symbol'][0]].loc[0, 'time']
+    start_date = first_time + dt.timedelta(minutes=max_interval * config_params['safety_ohlcv_range'])
+
+    return start_date
+
+
+def get_empty_frame_list(config_params, ohlcv_df_dict):
+    '''
+    (symbol_type, timeframe, symbol) of frames left without candles by add_signal.
+    Action timeframe needs 2 rows as the first row is not an action time.
+    '''
+    empty_frame_list = []
+
+    for symbol_type in ['base', 'lead']:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            min_row = 2 if (symbol_type == 'base') and (timeframe == config_params['action_timeframe']) else 1
+
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                if len(ohlcv_df_dict[symbol_type][timeframe][symbol]) < min_row:
+                    empty_frame_list.append((symbol_type, timeframe, symbol))
+
+    return empty_frame_list
+
+
+def bench_backtest(bar_count_list, config_name_list=None, memory_flag=True, seed=0):
+    '''
+    Throughput of add_signal and run_backtest (and vectorized mode when allowed) of bench_config_dict strategies
+    on bar_count candles of action timeframe.
+    Cases with no candle left after warm-up are skipped with a warning, a backtest without trade raises ValueError.
+    '''
+    config_name_list = list(bench_config_dict) if config_name_list == None else config_name_list
+    bench_result_list = []
+
+    for bar_count in bar_count_list:
+        for config_name in config_name_list:
+            config_params = bench_config_dict[config_name]
+            raw_df_dict = gen_synthetic_ohlcv_df_dict(config_params, bar_count, seed=seed)
+            start_date = get_bench_start_date(config_params, raw_df_dict)
+
+            def run_add_signal():
+                func_cache.clear_indicator_cache()
+                ohlcv_df_dict = {symbol_type: {timeframe: dict(raw_df_dict[symbol_type][timeframe]) for timeframe in raw_df_dict[symbol_type]} for symbol_type in raw_df_dict}
+
+                return func_signal.add_signal(start_date, ohlcv_df_dict, bench_interval_dict, copy.deepcopy(config_params))
+
+            ohlcv_df_dict, second, peak_bytes = measure_call(run_add_signal, memory_flag=memory_flag)
+            empty_frame_list = get_empty_frame_list(config_params, ohlcv_df_dict)
+
+            if len(empty_frame_list) > 0:
+                logger.warning("Skip %s at %s bars, no candle after warm-up from %s in %s", config_name, bar_count, start_date, empty_frame_list)
+                continue
+
+            bench_result_list = add_bench_result(f'add_signal {config_name}', bar_count, second, peak_bytes, bench_result_list)
+
+            vectorize_flag_list = [False, True] if func_backtest.get_vectorize_flag(config_params) else [False]
+
+            for vectorize_flag in vectorize_flag_list:
+                backtest_result, second, peak_bytes = measure_call(func_backtest.run_backtest, 100, True, config_params, ohlcv_df_dict, bench_interval_dict, vectorize_flag=vectorize_flag, memory_flag=memory_flag)
+                case = f"{'vectorized' if vectorize_flag else 'backtest'} {config_name}"
+
+                if len(backtest_result[2]['symbol']) == 0:
+                    raise ValueError(f"No trade in {case} at {bar_count} bars.")
+
+                bench_result_list = add_bench_result(case, bar_count, second, peak_bytes, bench_result_list)
+
+    bench_result_df = pd.DataFrame(bench_result_list)
+    func_cache.clear_indicator_cache()
+
+    return bench_result_df
+
+
+def run_benchmark(bar_count_list=(10**4, 10**5, 10**6, 10**7), backtest_bar_count_list=(10**4, 10**5, 10**6), memory_flag=True, seed=0):
+    '''
+    Offline benchmark of indicators, timeframe grouping and backtests on synthetic candles.
+    Backtests loop over every action time, so they scale to fewer bars by default.
+    '''
+    bench_result_df = pd.concat([
+        bench_indicator(bar_count_list, memory_flag=memory_flag, seed=seed),
+        bench_group_timeframe(bar_count_list, memory_flag=memory_flag, seed=seed),
+        bench_backtest(backtest_bar_count_list, memory_flag=memory_flag, seed=seed)
+    ]).reset_index(drop=True)
+
+    return bench_result_df
@@ -0,0 +1,472 @@
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import hashlib
+import json
+import time
+import os
+
+
+ohlcv_column_list = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+indicator_cache_params = {
+    'max_bytes': 512 * 1024 * 1024,
+    'cache_dir': None
+}
+
+# Least recently used indicator first
+indicator_cache_dict = OrderedDict()
+
+indicator_cache_state = {
+    'bytes': 0,
+    'hit': 0,
+    'disk_hit': 0,
+    'miss': 0
+}
+
+
+def get_empty_ohlcv_array():
+    empty_array = np.empty((0, len(ohlcv_column_list)), dtype=np.float64)
+
+    return empty_array
+
+
+def get_cache_path(cache_dir, exchange_id, symbol, timeframe):
+    '''
+    Cache file for one exchange, symbol and fetch timeframe.
+    Raw candles are kept in exchange time (epoch ms) so cache files are portable between hosts.
+    '''
+    symbol_name = symbol.replace('/', '_').replace(':', '_')
+    cache_path = os.path.join(cache_dir, exchange_id, timeframe, f'{symbol_name}.npy')
+
+    return cache_path
+
+
+def read_cache(cache_dir, exchange_id, symbol, timeframe, mmap_flag=False):
+    cache_path = get_cache_path(cache_dir, exchange_id, symbol, timeframe)
+
+    if os.path.exists(cache_path):
+        mmap_mode = 'r' if mmap_flag else None
+        cache_array = np.load(cache_path, mmap_mode=mmap_mode)
+    else:
+        cache_array = get_empty_ohlcv_array()
+
+    return cache_array
+
+
+def merge_ohlcv_array(ohlcv_array_list):
+    '''
+    Concat raw ohlcv arrays, sort by time and drop duplicated candles.
+    Later arrays in the list overwrite earlier ones on the same time.
+    '''
+    ohlcv_array_list = [x for x in ohlcv_array_list if len(x) > 0]
+
+    if len(ohlcv_array_list) == 0:
+        return get_empty_ohlcv_array()
+
+    ohlcv_array = np.concatenate(ohlcv_array_list)
+    ohlcv_array = ohlcv_array[np.argsort(ohlcv_array[:, 0], kind='stable')]
+
+    # Keep last candle of each time
+    keep_mask = np.append(ohlcv_array[1:, 0] != ohlcv_array[:-1, 0], True)
+    ohlcv_array = ohlcv_array[keep_mask]
+
+    return ohlcv_array
+
+
+def write_cache(cache_dir, exchange_id, symbol, timeframe, ohlcv_array, interval_ms, now_ms):
+    '''
+    Merge candles to cache file. Unclosed candles are not written.
+    '''
+    cache_path = get_cache_path(cache_dir, exchange_id, symbol, timeframe)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    cache_array = read_cache(cache_dir, exchange_id, symbol, timeframe)
+    ohlcv_array = ohlcv_array[ohlcv_array[:, 0] + interval_ms <= now_ms]
+    cache_array = merge_ohlcv_array([cache_array, ohlcv_array])
+
+    # Write to temp file then replace to not leave broken cache
+    temp_path = f'{cache_path}.tmp'
+    with open(temp_path, 'wb') as cache_file:
+        np.save(cache_file, cache_array)
+    os.replace(temp_path, cache_path)
+
+    return cache_array
+
+
+def get_gap_list(time_array, start_ms, end_ms, interval_ms):
+    '''
+    Return list of missing candle ranges [gap_start, gap_end) between start_ms and end_ms.
+    '''
+    first_ms = start_ms + (-start_ms % interval_ms)
+    last_ms = end_ms + (-end_ms % interval_ms)
+
+    time_array = np.asarray(time_array)
+    time_array = time_array[(time_array >= first_ms) & (time_array < last_ms)]
+    bound_array = np.concatenate([[first_ms - interval_ms], time_array, [last_ms]])
+
+    gap_index = np.flatnonzero(np.diff(bound_array) > interval_ms)
+    gap_list = [(bound_array[i] + interval_ms, bound_array[i + 1]) for i in gap_index]
+
+    return gap_list
+
+
+def get_span_path(cache_dir, exchange_id, symbol, timeframe):
+    '''
+    Sidecar of cache file listing closed windows [since, until) already fetched from exchange.
+    '''
+    span_path = get_cache_path(cache_dir, exchange_id, symbol, timeframe).replace('.npy', '.span.json')
+
+    return span_path
+
+
+def get_empty_span_array():
+    empty_array = np.empty((0, 2), dtype=np.int64)
+
+    return empty_array
+
+
+def read_cache_span(cache_dir, exchange_id, symbol, timeframe):
+    span_path = get_span_path(cache_dir, exchange_id, symbol, timeframe)
+
+    if os.path.exists(span_path):
+        with open(span_path) as span_file:
+            span_array = np.array(json.load(span_file), dtype=np.int64).reshape(-1, 2)
+    else:
+        span_array = get_empty_span_array()
+
+    return span_array
+
+
+def merge_span_array(span_array_list):
+    '''
+    Union of [start, end) spans as sorted spans without overlap, touching spans are joined.
+    '''
+    span_array = np.concatenate([get_empty_span_array()] + [np.asarray(x, dtype=np.int64).reshape(-1, 2) for x in span_array_list])
+
+    if len(span_array) == 0:
+        return span_array
+
+    span_array = span_array[np.argsort(span_array[:, 0], kind='stable')]
+    merge_list = [span_array[0].tolist()]
+
+    for start, end in span_array[1:].tolist():
+        if start <= merge_list[-1][1]:
+            merge_list[-1][1] = max(merge_list[-1][1], end)
+        else:
+            merge_list.append([start, end])
+
+    return np.array(merge_list, dtype=np.int64)
+
+
+def write_cache_span(cache_dir, exchange_id, symbol, timeframe, span_array):
+    '''
+    Merge fetched windows to span sidecar.
+    '''
+    span_path = get_span_path(cache_dir, exchange_id, symbol, timeframe)
+    os.makedirs(os.path.dirname(span_path), exist_ok=True)
+
+    span_array = merge_span_array([read_cache_span(cache_dir, exchange_id, symbol, timeframe), span_array])
+
+    temp_path = f'{span_path}.tmp'
+    with open(temp_path, 'w') as span_file:
+        json.dump(span_array.tolist(), span_file)
+    os.replace(temp_path, span_path)
+
+    return span_array
+
+
+def check_cache_coverage(time_array, since, until, interval_ms, now_ms, span_array=None):
+    '''
+    Window is served from cache only if it is fully closed and either has no missing candle or was already fetched.
+    Missing candles in a fetched window (exchange gap, before listing) are not on exchange, so they are not fetched again.
+    '''
+    closed_ms = now_ms - (now_ms % interval_ms)
+
+    if until > closed_ms:
+        cache_flag = False
+    elif len(get_gap_list(time_array, since, until, interval_ms)) == 0:
+        cache_flag = True
+    elif span_array is None:
+        cache_flag = False
+    else:
+        span_index = np.searchsorted(span_array[:, 0], since, side='right') - 1
+        cache_flag = bool((span_index >= 0) and (span_array[span_index, 1] >= until))
+
+    return cache_flag
+
+
+def get_cache_info(cache_dir, interval_dict):
+    '''
+    Inspect all cached series with their range, candle count, missing candles and file size.
+    Only <exchange>/<timeframe>/*.npy is read, so other files in cache_dir (e.g. indicator pickles) are skipped.
+    '''
+    cache_info_dict = {
+        'exchange': [],
+        'timeframe': [],
+        'symbol': [],
+        'first_time': [],
+        'last_time': [],
+        'candle': [],
+        'gap': [],
+        'missing_candle': [],
+        'bytes': []
+    }
+
+    for exchange_id in sorted(x for x in os.listdir(cache_dir) if os.path.isdir(os.path.join(cache_dir, x))):
+        exchange_dir = os.path.join(cache_dir, exchange_id)
+
+        for timeframe in sorted(x for x in os.listdir(exchange_dir) if (x in interval_dict) and os.path.isdir(os.path.join(exchange_dir, x))):
+            timeframe_dir = os.path.join(exchange_dir, timeframe)
+            interval_ms = interval_dict[timeframe] * 60 * 1000
+
+            for file_name in sorted(x for x in os.listdir(timeframe_dir) if x.endswith('.npy')):
+                cache_path = os.path.join(timeframe_dir, file_name)
+                cache_array = np.load(cache_path, mmap_mode='r')
+                time_array = np.array(cache_array[:, 0])
+
+                if len(time_array) > 0:
+                    gap_list = get_gap_list(time_array, time_array[0], time_array[-1] + interval_ms, interval_ms)
+                    first_time = pd.to_datetime(time_array[0], unit='ms')
+                    last_time = pd.to_datetime(time_array[-1], unit='ms')
+                else:
+                    gap_list = []
+                    first_time = None
+                    last_time = None
+
+                cache_info_dict['exchange'].append(exchange_id)
+                cache_info_dict['timeframe'].append(timeframe)
+                cache_info_dict['symbol'].append(file_name[:-len('.npy')])
+                cache_info_dict['first_time'].append(first_time)
+                cache_info_dict['last_time'].append(last_time)
+                cache_info_dict['candle'].append(len(time_array))
+                cache_info_dict['gap'].append(len(gap_list))
+                cache_info_dict['missing_candle'].append(int(sum((x[1] - x[0]) // interval_ms for x in gap_list)))
+                cache_info_dict['bytes'].append(os.path.getsize(cache_path))
+
+    cache_info_df = pd.DataFrame(cache_info_dict)
+
+    return cache_info_df
+
+
+def set_indicator_cache(max_bytes=None, cache_dir=None):
+    '''
+    Set memory bound of indicator cache and directory to persist indicators (None to keep in memory only).
+    '''
+    if max_bytes != None:
+        indicator_cache_params['max_bytes'] = max_bytes
+
+    indicator_cache_params['cache_dir'] = cache_dir
+    evict_indicator_cache()
+
+
+def clear_indicator_cache():
+    indicator_cache_dict.clear()
+
+    for key in indicator_cache_state:
+        indicator_cache_state[key] = 0
+
+
+def get_indicator_key(ohlcv_df, signal, param_dict):
+    '''
+    Hash of ohlcv content, indicator name and its params.
+    '''
+    column_list = [x for x in ohlcv_column_list if x in ohlcv_df.columns]
+    content_hash = pd.util.hash_pandas_object(ohlcv_df[column_list], index=False).values
+
+    key_hash = hashlib.sha1(content_hash.tobytes())
+    key_hash.update(json.dumps([signal, param_dict], sort_keys=True, default=str).encode())
+    indicator_key = key_hash.hexdigest()
+
+    return indicator_key
+
+
+def get_indicator_path(indicator_key):
+    indicator_path = os.path.join(indicator_cache_params['cache_dir'], 'indicator', f'{indicator_key}.pkl')
+
+    return indicator_path
+
+
+def evict_indicator_cache():
+    while (indicator_cache_state['bytes'] > indicator_cache_params['max_bytes']) & (len(indicator_cache_dict) > 0):
+        _, indicator_df = indicator_cache_dict.popitem(last=False)
+        indicator_cache_state['bytes'] -= int(indicator_df.memory_usage(deep=True).sum())
+
+
+def add_memory_indicator_cache(indicator_key, indicator_df):
+    if indicator_key not in indicator_cache_dict:
+        indicator_cache_dict[indicator_key] = indicator_df
+        indicator_cache_state['bytes'] += int(indicator_df.memory_usage(deep=True).sum())
+        evict_indicator_cache()
+
+
+def read_indicator_cache(indicator_key):
+    '''
+    Return copy of cached indicator columns, None if not cached in memory or on disk.
+    '''
+    if indicator_key in indicator_cache_dict:
+        indicator_cache_dict.move_to_end(indicator_key)
+        indicator_cache_state['hit'] += 1
+        indicator_df = indicator_cache_dict[indicator_key].copy()
+    elif (indicator_cache_params['cache_dir'] != None) and os.path.exists(get_indicator_path(indicator_key)):
+        indicator_df = pd.read_pickle(get_indicator_path(indicator_key))
+        indicator_cache_state['disk_hit'] += 1
+        add_memory_indicator_cache(indicator_key, indicator_df.copy())
+    else:
+        indicator_cache_state['miss'] += 1
+        indicator_df = None
+
+    return indicator_df
+
+
+def write_indicator_cache(indicator_key, indicator_df):
+    add_memory_indicator_cache(indicator_key, indicator_df.copy())
+
+    if indicator_cache_params['cache_dir'] != None:
+        indicator_path = get_indicator_path(indicator_key)
+        os.makedirs(os.path.dirname(indicator_path), exist_ok=True)
+
+        temp_path = f'{indicator_path}.{os.getpid()}.tmp'
+        indicator_df.to_pickle(temp_path)
+        os.replace(temp_path, indicator_path)
+
+
+def get_indicator_cache_info():
+    cache_info_dict = {
+        'indicator': len(indicator_cache_dict),
+        **indicator_cache_state,
+        'max_bytes': indicator_cache_params['max_bytes']
+    }
+
+    return cache_info_dict
+
+
+def get_panel_path(panel_dir, symbol_type, timeframe, name):
+    panel_path = os.path.join(panel_dir, symbol_type, timeframe, f'{name}.npy')
+
+    return panel_path
+
+
+def write_ohlcv_panel(panel_dir, ohlcv_df_dict):
+    '''
+    Export raw ohlcv of ohlcv_df_dict to panel_dir as one (symbol, time, field) array per symbol type and timeframe.
+    Time axis is the union of all symbols, missing candles are nan. Time unit of each symbol is kept in meta.
+    '''
+    panel_meta = {}
+    field_list = ohlcv_column_list[1:]
+
+    for symbol_type in ohlcv_df_dict:
+        panel_meta[symbol_type] = {}
+
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            symbol_list = list(ohlcv_df_dict[symbol_type][timeframe])
+            df_list = [ohlcv_df_dict[symbol_type][timeframe][symbol] for symbol in symbol_list]
+
+            time_list = [x['time'].values.astype('datetime64[ns]').astype(np.int64) for x in df_list]
+            time_array = np.unique(np.concatenate(time_list)) if len(time_list) > 0 else np.empty(0, dtype=np.int64)
+            dtype = np.result_type(*[x[field].dtype for x in df_list for field in field_list]) if len(df_list) > 0 else np.float64
+
+            os.makedirs(os.path.dirname(get_panel_path(panel_dir, symbol_type, timeframe, 'time')), exist_ok=True)
+
+            # Write to temp files then replace to not leave broken panel
+            time_path = get_panel_path(panel_dir, symbol_type, timeframe, 'time')
+            with open(f'{time_path}.tmp', 'wb') as time_file:
+                np.save(time_file, time_array)
+
+            value_path = get_panel_path(panel_dir, symbol_type, timeframe, 'value')
+            value_array = np.lib.format.open_memmap(f'{value_path}.tmp', mode='w+', dtype=dtype, shape=(len(symbol_list), len(time_array), len(field_list)))
+            range_list = []
+
+            for i, ohlcv_df in enumerate(df_list):
+                index_array = np.searchsorted(time_array, time_list[i])
+                value_array[i] = np.nan
+                value_array[i, index_array] = ohlcv_df[field_list].to_numpy(dtype=dtype)
+
+                if len(index_array) > 0:
+                    range_list.append([int(index_array[0]), int(index_array[-1]) + 1])
+                else:
+                    range_list.append([0, 0])
+
+            value_array.flush()
+            del value_array
+
+            os.replace(f'{time_path}.tmp', time_path)
+            os.replace(f'{value_path}.tmp', value_path)
+
+            panel_meta[symbol_type][timeframe] = {
+                'symbol': symbol_list,
+                'range': range_list,
+                'time_unit': [np.datetime_data(x['time'].values.dtype)[0] for x in df_list]
+            }
+
+    meta_path = os.path.join(panel_dir, 'meta.json')
+    with open(f'{meta_path}.tmp', 'w') as meta_file:
+        json.dump(panel_meta, meta_file)
+    os.replace(f'{meta_path}.tmp', meta_path)
+
+    return panel_meta
+
+
+def read_ohlcv_panel(panel_dir):
+    '''
+    Map panel of write_ohlcv_panel read-only and return ohlcv_df_dict.
+    Prices are zero-copy views of the page cache, shared by all processes reading the same panel,
+    except for symbols with missing candles inside their range. Time is cast back to the unit of the written frame.
+    '''
+    with open(os.path.join(panel_dir, 'meta.json')) as meta_file:
+        panel_meta = json.load(meta_file)
+
+    field_list = ohlcv_column_list[1:]
+    ohlcv_df_dict = {}
+
+    for symbol_type in panel_meta:
+        ohlcv_df_dict[symbol_type] = {}
+
+        for timeframe in panel_meta[symbol_type]:
+            ohlcv_df_dict[symbol_type][timeframe] = {}
+
+            time_array = np.load(get_panel_path(panel_dir, symbol_type, timeframe, 'time'), mmap_mode='r')
+            value_array = np.load(get_panel_path(panel_dir, symbol_type, timeframe, 'value'), mmap_mode='r')
+
+            symbol_list = panel_meta[symbol_type][timeframe]['symbol']
+            time_unit_list = panel_meta[symbol_type][timeframe].get('time_unit', ['ns'] * len(symbol_list))
+
+            for i, symbol in enumerate(symbol_list):
+                start_index, end_index = panel_meta[symbol_type][timeframe]['range'][i]
+                symbol_value_array = value_array[i, start_index:end_index]
+                symbol_time_array = time_array[start_index:end_index]
+
+                # Copy only if symbol has missing candle inside its range
+                keep_mask = ~np.isnan(symbol_value_array[:, 0])
+                if not keep_mask.all():
+                    symbol_value_array = symbol_value_array[keep_mask]
+                    symbol_time_array = symbol_time_array[keep_mask]
+
+                ohlcv_df = pd.DataFrame(symbol_value_array, columns=field_list, copy=False)
+                ohlcv_df.insert(0, 'time', np.asarray(symbol_time_array).view('datetime64[ns]').astype(f'datetime64[{time_unit_list[i]}]'))
+
+                ohlcv_df_dict[symbol_type][timeframe][symbol] = ohlcv_df
+
+    return ohlcv_df_dict
+
+
+class CacheExchange:
+    '''
+    Exchange stand-in serving fetch_ohlcv from cache files for offline backtest.
+    '''
+    def __init__(self, cache_dir, exchange_id):
+        self.cache_dir = cache_dir
+        self.id = exchange_id
+
+    @staticmethod
+    def milliseconds():
+        return int(time.time() * 1000)
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        cache_array = read_cache(self.cache_dir, self.id, symbol, timeframe, mmap_flag=True)
+
+        start_index = 0 if since == None else np.searchsorted(cache_array[:, 0], since, side='left')
+        end_index = len(cache_array) if limit == None else start_index + limit
+        ohlcv = np.array(cache_array[start_index:end_index]).tolist()
+
+        return ohlcv
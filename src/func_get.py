@@ -1,6 +1,27 @@
+import numpy as np
 import pandas as pd
 import datetime as dt
 from dateutil import tz
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import ccxt
+
+import func_cache
+import func_log
+import func_profile
+
+
+logger = func_log.get_logger(__name__)
+
+
+default_fetch_params = {
+    'max_workers': 8,
+    'rate_limit': 10,
+    'max_retry': 3,
+    'backoff_second': 1,
+    'retry_exception': (ccxt.NetworkError, ccxt.RateLimitExceeded, ccxt.ExchangeNotAvailable)
+}
 
 
 def convert_tz(utc):
@@ -14,6 +35,17 @@ def convert_tz(utc):
     return base_ts
 
 
+def convert_tz_series(utc_series, timezone=None):
+    '''
+    Transform utc time series in exchange to timezone at once and remove timezone info.
+    Use local timezone if timezone is None.
+    '''
+    to_zone = tz.tzlocal() if timezone == None else timezone
+    local_series = utc_series.dt.tz_localize(tz.tzutc()).dt.tz_convert(to_zone).dt.tz_localize(None)
+
+    return local_series
+
+
 def floor_dt(timestamp, round_minute):
     '''
     Round timestamp to previous minute interval.
@@ -24,8 +56,12 @@ def floor_dt(timestamp, round_minute):
     return round_timestamp
 
 
-def get_unix_datetime(dt_date, start_hour):
+def get_unix_datetime(dt_date, start_hour, timezone=None):
     dt_datetime = dt.datetime(dt_date.year, dt_date.month, dt_date.day, start_hour)
+
+    if timezone != None:
+        dt_datetime = pd.Timestamp(dt_datetime).tz_localize(timezone)
+
     unix_datetime = dt_datetime.timestamp() * 1000
     
     return unix_datetime
@@ -56,35 +92,364 @@ def get_fetch_timeframe(action_timeframe, interval_dict):
     return fetch_timeframe, step
 
     
-def get_ohlcv_df(exchange, symbol, timeframe, since, limit):
-    ohlcv = pd.DataFrame(exchange.fetch_ohlcv(symbol, timeframe, since, limit))
+def get_ohlcv_array(exchange, symbol, timeframe, since, limit):
+    ohlcv = exchange.fetch_ohlcv(symbol, timeframe, since, limit)
+    ohlcv_array = np.array(ohlcv, dtype=np.float64).reshape(-1, len(func_cache.ohlcv_column_list))
+
+    return ohlcv_array
 
-    if len(ohlcv) > 0:
-        ohlcv_df = pd.DataFrame(ohlcv)
-        ohlcv_df.columns = ['time', 'open', 'high', 'low', 'close', 'volume']
-        ohlcv_df['time'] = pd.to_datetime(ohlcv_df['time'], unit='ms')
-        ohlcv_df['time'] = ohlcv_df['time'].apply(lambda x: convert_tz(x))
 
-        # Remove timezone after offset timezone
-        ohlcv_df['time'] = ohlcv_df['time'].dt.tz_localize(None)
+def gen_ohlcv_df(ohlcv_array, timezone=None):
+    if len(ohlcv_array) > 0:
+        ohlcv_df = pd.DataFrame(ohlcv_array, columns=func_cache.ohlcv_column_list)
+        ohlcv_df['time'] = pd.to_datetime(ohlcv_df['time'].astype(np.int64), unit='ms')
+        ohlcv_df['time'] = convert_tz_series(ohlcv_df['time'], timezone)
     else:
         ohlcv_df = pd.DataFrame()
+
+    return ohlcv_df
+
+
+def compact_ohlcv_df(ohlcv_df):
+    '''
+    Low memory frame with float32 prices, volume and indicators.
+    Time stays datetime64 (int64 epoch) and sides int8.
+    '''
+    float_column_list = [x for x in ohlcv_df.columns if ohlcv_df[x].dtype == np.float64]
+    ohlcv_df = ohlcv_df.astype({x: np.float32 for x in float_column_list})
+
+    return ohlcv_df
+
+
+def compact_ohlcv_df_dict(ohlcv_df_dict):
+    for symbol_type in ohlcv_df_dict:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                ohlcv_df_dict[symbol_type][timeframe][symbol] = compact_ohlcv_df(ohlcv_df_dict[symbol_type][timeframe][symbol])
+
+    return ohlcv_df_dict
+
+
+def get_memory_info(ohlcv_df_dict):
+    '''
+    Rows, columns and bytes used by each series of ohlcv_df_dict.
+    '''
+    memory_info_dict = {
+        'symbol_type': [],
+        'timeframe': [],
+        'symbol': [],
+        'row': [],
+        'column': [],
+        'bytes': []
+    }
+
+    for symbol_type in ohlcv_df_dict:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
+
+                memory_info_dict['symbol_type'].append(symbol_type)
+                memory_info_dict['timeframe'].append(timeframe)
+                memory_info_dict['symbol'].append(symbol)
+                memory_info_dict['row'].append(len(ohlcv_df))
+                memory_info_dict['column'].append(len(ohlcv_df.columns))
+                memory_info_dict['bytes'].append(int(ohlcv_df.memory_usage(index=True, deep=True).sum()))
+
+    memory_info_df = pd.DataFrame(memory_info_dict)
+
+    return memory_info_df
+
+
+def get_ohlcv_df(exchange, symbol, timeframe, since, limit, timezone=None):
+    ohlcv_array = get_ohlcv_array(exchange, symbol, timeframe, since, limit)
+    ohlcv_df = gen_ohlcv_df(ohlcv_array, timezone)
         
     return ohlcv_df
 
 
-def group_timeframe(ohlcv_df, step):
-    ohlcv_dict = {'time':[], 'open':[], 'high':[], 'low':[], 'close':[]}
-            
-    for i in [x for x in range(0, len(ohlcv_df), step)]:
-        temp_df = ohlcv_df.iloc[i:min(i + step, len(ohlcv_df)), :].reset_index(drop=True)
-        ohlcv_dict['time'].append(temp_df['time'][0])
-        ohlcv_dict['open'].append(temp_df['open'][0])
-        ohlcv_dict['high'].append(max(temp_df['high']))
-        ohlcv_dict['low'].append(min(temp_df['low']))
-        ohlcv_dict['close'].append(temp_df['close'][len(temp_df) - 1])
+def gen_rate_limiter(rate_limit):
+    limiter_dict = {
+        'lock': threading.Lock(),
+        'interval': 1 / rate_limit,
+        'next_ts': 0
+    }
+
+    return limiter_dict
+
+
+def wait_rate_limit(limiter_dict):
+    '''
+    Space requests from all threads at least 1 / rate_limit second apart.
+    '''
+    with limiter_dict['lock']:
+        now_ts = time.monotonic()
+        request_ts = max(now_ts, limiter_dict['next_ts'])
+        limiter_dict['next_ts'] = request_ts + limiter_dict['interval']
+
+    time.sleep(request_ts - now_ts)
+
+
+def fetch_ohlcv_retry(exchange, symbol, timeframe, since, limit, limiter_dict, fetch_params):
+    for retry_count in range(fetch_params['max_retry'] + 1):
+        wait_rate_limit(limiter_dict)
+
+        try:
+            return get_ohlcv_array(exchange, symbol, timeframe, since, limit)
+        except fetch_params['retry_exception'] as error:
+            if retry_count == fetch_params['max_retry']:
+                raise
+
+            backoff_second = fetch_params['backoff_second'] * (2 ** retry_count)
+            logger.warning("Retry %s %s %s in %ss: %s", symbol, timeframe, since, backoff_second, error)
+            time.sleep(backoff_second)
+
+
+@func_profile.profile_func
+def fetch_ohlcv_array_dict(exchange, task_list, fetch_params):
+    '''
+    Fetch all (symbol, timeframe, since, limit) tasks concurrently under rate limit.
+    '''
+    limiter_dict = gen_rate_limiter(fetch_params['rate_limit'])
+
+    with ThreadPoolExecutor(max_workers=fetch_params['max_workers']) as executor:
+        future_dict = {task: executor.submit(fetch_ohlcv_retry, exchange, *task, limiter_dict, fetch_params) for task in task_list}
+        ohlcv_array_dict = {task: future_dict[task].result() for task in task_list}
+
+    return ohlcv_array_dict
+
+
+def get_fetch_task_list(exchange, series_list, interval_dict, cache_dir, now_ms):
+    '''
+    Read cache of each series and list windows not covered by cache or fetched before.
+    '''
+    cache_array_dict = {}
+    span_array_dict = {}
+    task_list = []
+    task_set = set()
+
+    for series_dict in series_list:
+        symbol = series_dict['symbol']
+        fetch_timeframe = series_dict['fetch_timeframe']
+        interval_ms = interval_dict[fetch_timeframe] * 60 * 1000
+
+        if (symbol, fetch_timeframe) not in cache_array_dict:
+            if cache_dir != None:
+                cache_array = func_cache.read_cache(cache_dir, exchange.id, symbol, fetch_timeframe)
+                span_array = func_cache.read_cache_span(cache_dir, exchange.id, symbol, fetch_timeframe)
+            else:
+                cache_array = func_cache.get_empty_ohlcv_array()
+                span_array = func_cache.get_empty_span_array()
+
+            cache_array_dict[(symbol, fetch_timeframe)] = cache_array
+            span_array_dict[(symbol, fetch_timeframe)] = span_array
+
+        cache_array = cache_array_dict[(symbol, fetch_timeframe)]
+        span_array = span_array_dict[(symbol, fetch_timeframe)]
+
+        for since in series_dict['since_list']:
+            until = since + (series_dict['limit'] * interval_ms)
+            task = (symbol, fetch_timeframe, since, series_dict['limit'])
+
+            if (task not in task_set) and (not func_cache.check_cache_coverage(cache_array[:, 0], since, until, interval_ms, now_ms, span_array)):
+                task_list.append(task)
+                task_set.add(task)
+
+    return cache_array_dict, task_list
+
+
+def get_symbol_timeframe_dict(config_params):
+    '''
+    All timeframes needed by each symbol, over base and lead.
+    '''
+    symbol_timeframe_dict = {}
+
+    for symbol_type in ['base', 'lead']:
+        timeframe_list = get_timeframe_list(symbol_type, config_params)
+
+        for symbol in config_params[symbol_type]['symbol']:
+            if symbol not in symbol_timeframe_dict:
+                symbol_timeframe_dict[symbol] = set()
+
+            symbol_timeframe_dict[symbol].update(timeframe_list)
+
+    return symbol_timeframe_dict
+
+
+def get_symbol_fetch_timeframe(timeframe_list, interval_dict):
+    '''
+    Finest fetch timeframe of all timeframes.
+    Fetch intervals divide each other, so every timeframe can be grouped from the finest one.
+    '''
+    fetch_timeframe_list = [get_fetch_timeframe(timeframe, interval_dict)[0] for timeframe in timeframe_list]
+    fetch_timeframe = min(fetch_timeframe_list, key=lambda x: interval_dict[x])
 
-    grouped_ohlcv_df = pd.DataFrame(ohlcv_dict)
+    return fetch_timeframe
+
+
+def get_series_range(start_dt, end_date, start_hour, timeframe, interval_dict, timezone=None):
+    '''
+    Daily since of fetch windows from start_dt to end_date, and full candle range [start_ms, end_ms) of timeframe.
+    '''
+    date_list = pd.date_range(start_dt, end_date, freq='d').to_list()
+    since_list = [get_unix_datetime(date, start_hour, timezone) for date in date_list]
+
+    # Same range as fetching timeframe directly: full candles from first since for each date
+    timeframe_ms = interval_dict[timeframe] * 60 * 1000
+    day_ms = 24 * 60 * 60 * 1000
+    start_ms = since_list[0] + (-since_list[0] % timeframe_ms)
+    end_ms = since_list[-1] + (-since_list[-1] % timeframe_ms) + day_ms
+
+    while since_list[-1] + day_ms < end_ms:
+        since_list = since_list + [since_list[-1] + day_ms]
+
+    return since_list, start_ms, end_ms
+
+
+def get_intrabar_timeframe(config_params):
+    '''
+    intrabar_timeframe if it needs its own series, None if not set or already a base timeframe.
+    '''
+    intrabar_timeframe = config_params.get('intrabar_timeframe')
+
+    if intrabar_timeframe in get_timeframe_list('base', config_params):
+        intrabar_timeframe = None
+
+    return intrabar_timeframe
+
+
+def gen_series_list(start_date, end_date, start_hour, interval_dict, config_params, timezone=None):
+    '''
+    Plan one fetch timeframe per symbol. Each symbol is fetched once and all its timeframes are grouped from it.
+    intrabar_timeframe is fetched as its own series over action time only, it does not refine the fetch timeframe.
+    '''
+    series_list = []
+    symbol_timeframe_dict = get_symbol_timeframe_dict(config_params)
+    symbol_fetch_timeframe_dict = {symbol: get_symbol_fetch_timeframe(symbol_timeframe_dict[symbol], interval_dict) for symbol in symbol_timeframe_dict}
+
+    for symbol_type in ['base', 'lead']:
+        for timeframe in get_timeframe_list(symbol_type, config_params):
+            _, safety_step = get_fetch_timeframe(timeframe, interval_dict)
+            safety_start_dt = start_date - dt.timedelta(minutes=(interval_dict[timeframe] * safety_step * config_params['safety_ohlcv_range']))
+            since_list, start_ms, end_ms = get_series_range(safety_start_dt, end_date, start_hour, timeframe, interval_dict, timezone)
+
+            for symbol in config_params[symbol_type]['symbol']:
+                fetch_timeframe = symbol_fetch_timeframe_dict[symbol]
+
+                series_dict = {
+                    'symbol_type': symbol_type,
+                    'timeframe': timeframe,
+                    'symbol': symbol,
+                    'fetch_timeframe': fetch_timeframe,
+                    'step': int(interval_dict[timeframe] / interval_dict[fetch_timeframe]),
+                    'limit': int((24 * 60) / interval_dict[fetch_timeframe]),
+                    'since_list': since_list,
+                    'start_ms': start_ms,
+                    'end_ms': end_ms
+                }
+                series_list.append(series_dict)
+
+    intrabar_timeframe = get_intrabar_timeframe(config_params)
+
+    if intrabar_timeframe != None:
+        # From the first signal check row, no warm-up
+        action_start_dt = start_date - dt.timedelta(minutes=interval_dict[config_params['action_timeframe']])
+        since_list, start_ms, end_ms = get_series_range(action_start_dt, end_date, start_hour, intrabar_timeframe, interval_dict, timezone)
+        fetch_timeframe, step = get_fetch_timeframe(intrabar_timeframe, interval_dict)
+
+        for symbol in config_params['base']['symbol']:
+            series_dict = {
+                'symbol_type': 'base',
+                'timeframe': intrabar_timeframe,
+                'symbol': symbol,
+                'fetch_timeframe': fetch_timeframe,
+                'step': step,
+                'limit': int((24 * 60) / interval_dict[fetch_timeframe]),
+                'since_list': since_list,
+                'start_ms': start_ms,
+                'end_ms': end_ms
+            }
+            series_list.append(series_dict)
+
+    return series_list
+
+
+def reduce_ohlcv_array(ohlcv_array, start_index, group_time_array):
+    '''
+    One candle of each group of rows starting at start_index, with time from group_time_array.
+    '''
+    end_index = np.append(start_index[1:], len(ohlcv_array)) - 1
+
+    grouped_ohlcv_array = np.column_stack([
+        group_time_array,
+        ohlcv_array[start_index, 1],
+        np.maximum.reduceat(ohlcv_array[:, 2], start_index),
+        np.minimum.reduceat(ohlcv_array[:, 3], start_index),
+        ohlcv_array[end_index, 4],
+        np.add.reduceat(ohlcv_array[:, 5], start_index)
+    ])
+
+    return grouped_ohlcv_array
+
+
+def group_ohlcv_array(ohlcv_array, timeframe_ms):
+    '''
+    Group sorted raw candles to timeframe_ms candles aligned to epoch, same as exchange candles.
+    Missing candles do not shift groups and partial groups are kept.
+    '''
+    if len(ohlcv_array) == 0:
+        return ohlcv_array
+
+    group_time_array = ohlcv_array[:, 0] - (ohlcv_array[:, 0] % timeframe_ms)
+    start_index = np.flatnonzero(np.append(True, group_time_array[1:] != group_time_array[:-1]))
+    grouped_ohlcv_array = reduce_ohlcv_array(ohlcv_array, start_index, group_time_array[start_index])
+
+    return grouped_ohlcv_array
+
+
+def group_ohlcv_array_step(ohlcv_array, step):
+    '''
+    Group every step rows from the first row, time of the first row of each group.
+    '''
+    if len(ohlcv_array) == 0:
+        return ohlcv_array
+
+    start_index = np.arange(0, len(ohlcv_array), step)
+    grouped_ohlcv_array = reduce_ohlcv_array(ohlcv_array, start_index, ohlcv_array[start_index, 0])
+
+    return grouped_ohlcv_array
+
+
+def group_timeframe(ohlcv_df, step=None, interval_minute=None):
+    '''
+    Group ohlcv_df with one of step or interval_minute.
+    step: every step rows from the first row, time of the first row, volume is dropped (same as before interval_minute).
+    interval_minute: candles of interval_minute floored from epoch, volume is summed if ohlcv_df has it.
+    '''
+    if (step == None) == (interval_minute == None):
+        raise ValueError("Set one of step or interval_minute.")
+
+    temp_df = ohlcv_df.reset_index(drop=True)
+
+    if 'volume' not in temp_df.columns:
+        temp_df = temp_df.assign(volume=np.nan)
+
+    ohlcv_array = temp_df[func_cache.ohlcv_column_list].to_numpy(dtype=np.float64)
+    ohlcv_array[:, 0] = temp_df['time'].values.astype('datetime64[ms]').astype(np.int64)
+
+    if interval_minute != None:
+        grouped_ohlcv_array = group_ohlcv_array(ohlcv_array, interval_minute * 60 * 1000)
+    else:
+        grouped_ohlcv_array = group_ohlcv_array_step(ohlcv_array, step)
+
+    grouped_ohlcv_df = pd.DataFrame(grouped_ohlcv_array, columns=func_cache.ohlcv_column_list)
+
+    if interval_minute != None:
+        grouped_ohlcv_df['time'] = pd.to_datetime(grouped_ohlcv_df['time'].astype(np.int64), unit='ms')
+    else:
+        grouped_ohlcv_df['time'] = temp_df['time'].iloc[np.arange(0, len(temp_df), step)].reset_index(drop=True)
+
+    if ('volume' not in ohlcv_df.columns) or (step != None):
+        grouped_ohlcv_df = grouped_ohlcv_df.drop(columns=['volume'])
     
     return grouped_ohlcv_df
 
@@ -111,44 +476,71 @@ def get_timeframe_list(symbol_type, config_params):
     return timeframe_list
 
 
-def get_data(exchange, start_date, end_date, start_hour, interval_dict, config_params):
+@func_profile.profile_func
+def get_data(exchange, start_date, end_date, start_hour, interval_dict, config_params, cache_dir=None, fetch_params=None, timezone=None, compact_flag=False):
+    '''
+    Get ohlcv of all symbols and timeframes in config_params, with time in timezone (local timezone if None).
+    If cache_dir is set, candles are read from local cache and only missing windows are fetched.
+    Missing windows of all series are fetched concurrently with fetch_params (see default_fetch_params).
+    If compact_flag, frames are stored as compact_ohlcv_df.
+    '''
+    fetch_params = {**default_fetch_params, **(fetch_params if fetch_params != None else {})}
+
     ohlcv_df_dict = {
         'base': {},
         'lead': {}
         }
-    
-    for symbol_type in ['base', 'lead']:
-        symbol_list = config_params[symbol_type]['symbol']
-        timeframe_list = get_timeframe_list(symbol_type, config_params)
 
-        timeframe_count = 1
-        for timeframe in timeframe_list:
+    now_ms = exchange.milliseconds()
+    series_list = gen_series_list(start_date, end_date, start_hour, interval_dict, config_params, timezone)
+    cache_array_dict, task_list = get_fetch_task_list(exchange, series_list, interval_dict, cache_dir, now_ms)
+
+    logger.info("Fetch %s windows of %s series", len(task_list), len(cache_array_dict))
+    fetch_array_dict = fetch_ohlcv_array_dict(exchange, task_list, fetch_params)
+
+    fetch_array_list_dict = {series_key: [] for series_key in cache_array_dict}
+    fetch_span_list_dict = {series_key: [] for series_key in cache_array_dict}
+    for task in task_list:
+        fetch_array_list_dict[task[:2]].append(fetch_array_dict[task])
+
+        # Record closed windows as fetched, even if exchange has no candle in them
+        interval_ms = interval_dict[task[1]] * 60 * 1000
+        until = task[2] + (task[3] * interval_ms)
+        if until <= now_ms - (now_ms % interval_ms):
+            fetch_span_list_dict[task[:2]].append([task[2], until])
+
+    # Merge cache and fetched windows of each series at once
+    for series_key in cache_array_dict:
+        fetch_array_list = fetch_array_list_dict[series_key]
+        ohlcv_array = func_cache.merge_ohlcv_array([cache_array_dict[series_key]] + fetch_array_list)
+
+        if (cache_dir != None) & (len(fetch_array_list) > 0):
+            interval_ms = interval_dict[series_key[1]] * 60 * 1000
+            func_cache.write_cache(cache_dir, exchange.id, series_key[0], series_key[1], ohlcv_array, interval_ms, now_ms)
+            func_cache.write_cache_span(cache_dir, exchange.id, series_key[0], series_key[1], fetch_span_list_dict[series_key])
+
+        cache_array_dict[series_key] = ohlcv_array
+
+    for series_dict in series_list:
+        symbol_type = series_dict['symbol_type']
+        timeframe = series_dict['timeframe']
+
+        ohlcv_array = cache_array_dict[(series_dict['symbol'], series_dict['fetch_timeframe'])]
+        time_array = ohlcv_array[:, 0]
+        ohlcv_array = ohlcv_array[(time_array >= series_dict['start_ms']) & (time_array < series_dict['end_ms'])]
+
+        # Group in exchange time before converting timezone
+        if series_dict['step'] > 1:
+            ohlcv_array = group_ohlcv_array(ohlcv_array, interval_dict[timeframe] * 60 * 1000)
+
+        ohlcv_df = gen_ohlcv_df(ohlcv_array, timezone)
+
+        if compact_flag:
+            ohlcv_df = compact_ohlcv_df(ohlcv_df)
+
+        if timeframe not in ohlcv_df_dict[symbol_type]:
             ohlcv_df_dict[symbol_type][timeframe] = {}
-            fetch_timeframe, step = get_fetch_timeframe(timeframe, interval_dict)
-            limit = int((24 * 60) / interval_dict[fetch_timeframe])
-            
-            safety_start_dt = start_date - dt.timedelta(minutes=(interval_dict[timeframe] * step * config_params['safety_ohlcv_range']))
-            date_list = pd.date_range(safety_start_dt, end_date, freq='d').to_list()
-            
-            symbol_count = 1
-            for symbol in symbol_list:
-                ohlcv_df = pd.DataFrame()
-                
-                date_count = 1
-                for date in date_list:
-                    since = get_unix_datetime(date, start_hour)
-                    temp_df = get_ohlcv_df(exchange, symbol, fetch_timeframe, since, limit)
-                    ohlcv_df = pd.concat([ohlcv_df, temp_df])
-                    
-                    print(f"{symbol_type}: timeframe {timeframe_count}/{len(timeframe_list)} symbol {symbol_count}/{len(symbol_list)} date {date_count}/{len(date_list)}")
-                    date_count += 1
-                
-                if step > 1:
-                    ohlcv_df = group_timeframe(ohlcv_df, step)
-                    
-                ohlcv_df_dict[symbol_type][timeframe][symbol] = ohlcv_df.reset_index(drop=True)
-                symbol_count += 1
-                
-            timeframe_count += 1
-
-    return ohlcv_df_dict
\ No newline at end of file
+
+        ohlcv_df_dict[symbol_type][timeframe][series_dict['symbol']] = ohlcv_df.reset_index(drop=True)
+
+    return ohlcv_df_dict
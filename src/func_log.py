@@ -0,0 +1,104 @@
+import numpy as np
+import logging
+import json
+import sys
+
+
+module_list = ['func_get', 'func_cache', 'func_signal', 'func_backtest', 'func_sweep', 'func_stream', 'func_bench']
+
+# Quiet by default, records below warning are dropped before formatting
+log_state = {
+    'stream_level': logging.WARNING,
+    'trace_level': None
+}
+
+
+class EventFormatter(logging.Formatter):
+    '''
+    One compact json line per record with time, module, level, message template and args.
+    '''
+    def format(self, record):
+        arg_list = [x.item() if isinstance(x, np.generic) else x if isinstance(x, (int, float, str, bool, type(None))) else str(x) for x in record.args]
+        event_dict = {
+            't': round(record.created, 6),
+            'm': record.name,
+            'l': record.levelname,
+            'msg': record.msg.strip(),
+            'args': arg_list
+        }
+
+        return json.dumps(event_dict, separators=(',', ':'))
+
+
+def get_level(level):
+    level = level if isinstance(level, int) else logging.getLevelName(level.upper())
+
+    return level
+
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+    update_logger_level(logger)
+
+    return logger
+
+
+def get_handler(logger, handler_name):
+    handler_list = [x for x in logger.handlers if x.get_name() == handler_name]
+    handler = handler_list[0] if len(handler_list) > 0 else None
+
+    return handler
+
+
+def update_logger_level(logger):
+    level_list = [x for x in [log_state['stream_level'], log_state['trace_level']] if x != None]
+    logger.setLevel(min(level_list))
+
+
+def set_log_level(level, stream=None):
+    '''
+    Print records of func_* modules at level or above to stream (stdout if None).
+    'DEBUG' prints every check of every bar, 'INFO' positions and added signals, 'WARNING' is the quiet default.
+    '''
+    log_state['stream_level'] = get_level(level)
+
+    for name in module_list:
+        logger = logging.getLogger(name)
+        handler = get_handler(logger, 'func_log_stream')
+
+        if handler != None:
+            logger.removeHandler(handler)
+
+        if log_state['stream_level'] < logging.WARNING:
+            handler = logging.StreamHandler(sys.stdout if stream == None else stream)
+            handler.set_name('func_log_stream')
+            handler.setLevel(log_state['stream_level'])
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+
+        update_logger_level(logger)
+
+
+def set_event_trace(trace_path, level='DEBUG'):
+    '''
+    Write records of func_* modules at level or above to trace_path as json lines (see EventFormatter).
+    None to stop the trace.
+    '''
+    log_state['trace_level'] = get_level(level) if trace_path != None else None
+
+    for name in module_list:
+        logger = logging.getLogger(name)
+        handler = get_handler(logger, 'func_log_trace')
+
+        if handler != None:
+            logger.removeHandler(handler)
+            handler.close()
+
+        if trace_path != None:
+            handler = logging.FileHandler(trace_path, mode='a', delay=True)
+            handler.set_name('func_log_trace')
+            handler.setLevel(log_state['trace_level'])
+            handler.setFormatter(EventFormatter())
+            logger.addHandler(handler)
+
+        update_logger_level(logger)
@@ -0,0 +1,96 @@
+import pandas as pd
+import contextlib
+import functools
+import cProfile
+import time
+
+
+profile_state = {
+    'enable_flag': False
+}
+
+# Cumulative call count and second of each stage or function
+profile_dict = {}
+
+
+def set_profile(enable_flag):
+    '''
+    Start or stop timing of stages and functions, timing is skipped while disabled.
+    '''
+    profile_state['enable_flag'] = enable_flag
+
+
+def clear_profile():
+    profile_dict.clear()
+
+
+def add_profile(name, second):
+    if name not in profile_dict:
+        profile_dict[name] = {'call': 0, 'second': 0.0}
+
+    profile_dict[name]['call'] += 1
+    profile_dict[name]['second'] += second
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    if not profile_state['enable_flag']:
+        yield
+        return
+
+    start_ts = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        add_profile(name, time.perf_counter() - start_ts)
+
+
+def profile_func(func):
+    '''
+    Time every call of func as module.func while profile is enabled.
+    '''
+    name = f'{func.__module__}.{func.__name__}'
+
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        if not profile_state['enable_flag']:
+            return func(*args, **kwargs)
+
+        start_ts = time.perf_counter()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add_profile(name, time.perf_counter() - start_ts)
+
+    return inner
+
+
+def get_profile_df():
+    '''
+    Summary of profiled stages and functions sorted by cumulative time.
+    Time of nested stages and functions is included in their callers.
+    '''
+    profile_df = pd.DataFrame(
+        [[name, profile_dict[name]['call'], profile_dict[name]['second']] for name in profile_dict],
+        columns=['name', 'call', 'second']
+    )
+    profile_df['ms_per_call'] = profile_df['second'] / profile_df['call'] * 1000
+    profile_df = profile_df.sort_values('second', ascending=False).reset_index(drop=True)
+
+    return profile_df
+
+
+def run_cprofile(dump_path, func, *args, **kwargs):
+    '''
+    Return func(*args, **kwargs) run under cProfile, stats are dumped to dump_path in pstats format (snakeviz, pstats, gprof2dot).
+    '''
+    profiler = cProfile.Profile()
+
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(dump_path)
+
+    return result
@@ -2,64 +2,121 @@ import numpy as np
 import pandas as pd
 import math
 import datetime as dt
+import func_cache
+import func_log
+import func_profile
 
+try:
+    import numba
+except ImportError:
+    numba = None
 
-def get_signal_dict(signal, objective, timeframe, config_params):
+
+logger = func_log.get_logger(__name__)
+
+
+def get_signal_dict(signal, objective, timeframe, config_params, symbol_type='base'):
     if objective in ['open', 'close']:
-        signal_dict = config_params['base'][objective][timeframe][signal]
+        signal_dict = config_params[symbol_type][objective][timeframe][signal]
     elif objective in ['tp', 'sl']:
         signal_dict = config_params[objective]['signal']['signal'][signal]
 
     return signal_dict
 
 
+# Params which change indicator values, others only change how the signal is checked
+signal_param_dict = {
+    'sma': ['windows'],
+    'ema': ['windows'],
+    'tma': ['windows'],
+    'cross_sma': ['short_windows', 'long_windows'],
+    'cross_ema': ['short_windows', 'long_windows'],
+    'cross_tma': ['short_windows', 'long_windows'],
+    'bollinger': ['windows', 'std'],
+    'supertrend': ['atr_range', 'multiplier'],
+    'wt': ['channel_range', 'average_range'],
+    'rsi': ['average_range'],
+    'donchian': ['windows'],
+    'hull': ['windows']
+}
+
+
+def get_signal_key(signal, signal_dict):
+    '''
+    Column prefix of signal with its indicator params, e.g. tma_50, so each parameterisation has its own columns.
+    Columns were named by signal only before (tma_side, short_sma, bollinger_upper), see rename_legacy_column.
+    '''
+    signal_key = '_'.join([signal] + [str(signal_dict[x]) for x in signal_param_dict[signal]])
+
+    return signal_key
+
+
+def rename_legacy_column(ohlcv_df, signal, signal_dict):
+    '''
+    Copy of ohlcv_df with columns of signal_dict renamed to names before get_signal_key,
+    e.g. tma_50_side to tma_side and short_sma_15_200 to short_sma, for code reading the old names.
+    '''
+    signal_key = get_signal_key(signal, signal_dict)
+    rename_dict = {x: signal + x[len(signal_key):] for x in ohlcv_df.columns if (x == signal_key) | x.startswith(f'{signal_key}_')}
+
+    # Lines of cross signals are prefixed by short and long
+    if signal.startswith('cross_'):
+        for line in ['short', 'long']:
+            line_key = f"{line}_{signal[len('cross_'):]}"
+            if line_key + signal_key[len(signal):] in ohlcv_df.columns:
+                rename_dict[line_key + signal_key[len(signal):]] = line_key
+
+    legacy_df = ohlcv_df.rename(columns=rename_dict)
+
+    return legacy_df
+
+
+# Sides are kept as int8 code, 0 is no side
+side_code_dict = {
+    'buy': 1,
+    'sell': -1,
+    'no_action': 2
+}
+
+side_name_dict = {v: k for k, v in side_code_dict.items()}
+
+
+def get_side_name(side_code):
+    '''
+    Side string of side code for print and report, None if no side.
+    '''
+    side_name = side_name_dict.get(side_code)
+
+    return side_name
+
+
 def get_signal_side(ohlcv_df, signal):
-    if ohlcv_df['close'] > ohlcv_df[signal]:
-        signal_side = 'buy'
-    elif ohlcv_df['close'] < ohlcv_df[signal]:
-        signal_side = 'sell'
-    else:
-        signal_side = None
+    signal_side_array = np.select([ohlcv_df['close'] > ohlcv_df[signal], ohlcv_df['close'] < ohlcv_df[signal]], [side_code_dict['buy'], side_code_dict['sell']], 0).astype(np.int8)
         
-    return signal_side
+    return signal_side_array
 
 
 def get_signal_cross_side(ohlcv_df, signal):
-    if ohlcv_df[f'short_{signal}'] > ohlcv_df[f'long_{signal}']:
-        signal_side = 'buy'
-    elif ohlcv_df[f'short_{signal}'] < ohlcv_df[f'long_{signal}']:
-        signal_side = 'sell'
-    else:
-        signal_side = None
+    signal_side_array = np.select([ohlcv_df[f'short_{signal}'] > ohlcv_df[f'long_{signal}'], ohlcv_df[f'short_{signal}'] < ohlcv_df[f'long_{signal}']], [side_code_dict['buy'], side_code_dict['sell']], 0).astype(np.int8)
         
-    return signal_side
+    return signal_side_array
 
 
 def get_signal_bound_side(ohlcv_df):
-    if ohlcv_df['close'] > ohlcv_df['max_high']:
-        signal_side = 'buy'
-    elif ohlcv_df['close'] < ohlcv_df['min_low']:
-        signal_side = 'sell'
-    else:
-        signal_side = np.nan
+    signal_side_array = np.select([ohlcv_df['close'] > ohlcv_df['max_high'], ohlcv_df['close'] < ohlcv_df['min_low']], [side_code_dict['buy'], side_code_dict['sell']], 0).astype(np.int8)
 
-    return signal_side
+    return signal_side_array
 
 
 def get_signal_equence_side(ohlcv_df, signal):
-    if ohlcv_df[signal] > ohlcv_df[f'{signal}_prev']:
-        signal_side = 'buy'
-    else:
-        signal_side = 'sell'
+    signal_side_array = np.where(ohlcv_df[signal] > ohlcv_df[f'{signal}_prev'], side_code_dict['buy'], side_code_dict['sell']).astype(np.int8)
 
-    return signal_side
+    return signal_side_array
 
 
 def revert_signal(action_side):
-    if action_side == 'buy':
-        action_side = 'sell'
-    elif action_side == 'sell':
-        action_side = 'buy'
+    if action_side in [side_code_dict['buy'], side_code_dict['sell']]:
+        action_side = -action_side
 
     return action_side
 
@@ -74,11 +131,143 @@ def check_dependent_signal(func):
     return inner
 
 
+def get_asof_index(time_array, time):
+    '''
+    Index of the last row at or before time, None if time is before the first row.
+    '''
+    index = int(np.searchsorted(time_array, time, side='right')) - 1
+
+    if index < 0:
+        index = None
+
+    return index
+
+
+def get_asof_index_array(time_array, action_time_array):
+    '''
+    get_asof_index of each time in action_time_array, -1 where the time is before the first row.
+    '''
+    index_array = np.searchsorted(time_array, action_time_array, side='right') - 1
+
+    return index_array
+
+
+def get_side_change_key(signal, signal_dict):
+    side_change_key = f"{get_signal_key(signal, signal_dict)}_change_{signal_dict['look_back']}"
+
+    return side_change_key
+
+
+def cal_side_change(side_array, look_back):
+    '''
+    True where the last look_back sides are the same and differ from the side before them.
+    '''
+    side_array = np.asarray(side_array)
+    row_array = np.arange(len(side_array))
+
+    # Length of the run of same side ending at each row
+    new_run_array = np.ones(len(side_array), dtype=bool)
+    new_run_array[1:] = side_array[1:] != side_array[:-1]
+    run_length_array = row_array - np.maximum.accumulate(np.where(new_run_array, row_array, 0)) + 1
+
+    side_change_array = (run_length_array == look_back) & (look_back > 0)
+
+    return side_change_array
+
+
+def get_side_change(objective, index, look_back, side_array, side_change_array):
+    if (index == None) or (index < look_back):
+        action_side = side_code_dict['no_action']
+    elif (objective == 'open') & (not side_change_array[index]):
+        action_side = side_code_dict['no_action']
+    else:
+        action_side = side_array[index]
+
+    return int(action_side)
+
+
+def cal_outer_band(indicator_array, upperband_array, lowerband_array):
+    action_side_array = np.select([indicator_array <= lowerband_array, indicator_array >= upperband_array], [side_code_dict['buy'], side_code_dict['sell']], side_code_dict['no_action']).astype(np.int8)
+
+    return action_side_array
+
+
+@check_dependent_signal
+def cal_inner_band(action_list, indicator, upperband, lowerband):
+    if (action_list[-1] == side_code_dict['buy']) & (indicator < upperband):
+        action_side = side_code_dict['buy']
+    elif (action_list[-1] == side_code_dict['buy']) & (indicator >= upperband):
+        action_side = side_code_dict['sell']
+    elif (action_list[-1] == side_code_dict['sell']) & (indicator > lowerband):
+        action_side = side_code_dict['sell']
+    elif (action_list[-1] == side_code_dict['sell']) & (indicator <= lowerband):
+        action_side = side_code_dict['buy']
+    else:
+        action_side = side_code_dict['no_action']
+
+    return action_side
+
+
+band_type_dict = {
+    'signal': ['rsi', 'wt'],
+    'price': ['bollinger']
+}
+
+
+def get_band_outer_key(signal, signal_dict):
+    signal_key = get_signal_key(signal, signal_dict)
+
+    if signal in band_type_dict['signal']:
+        band_outer_key = f"{signal_key}_outer_{signal_dict['oversold']}_{signal_dict['overbought']}"
+    elif signal in band_type_dict['price']:
+        band_outer_key = f'{signal_key}_outer'
+
+    return band_outer_key
+
+
+def get_band_column_list(signal, signal_dict):
+    signal_key = get_signal_key(signal, signal_dict)
+
+    if signal_dict['trigger'] == 'outer':
+        column_list = [get_band_outer_key(signal, signal_dict)]
+    elif signal in band_type_dict['signal']:
+        column_list = [signal_key]
+    elif signal in band_type_dict['price']:
+        column_list = ['close', f'{signal_key}_upper', f'{signal_key}_lower']
+
+    return column_list
+
+
+def get_band_side(objective, symbol_type, signal, action_list, check_series, timeframe, config_params):
+    signal_dict = config_params[symbol_type][objective][timeframe][signal]
+    signal_key = get_signal_key(signal, signal_dict)
+
+    if signal_dict['trigger'] == 'outer':
+        action_side = int(check_series[get_band_outer_key(signal, signal_dict)])
+    elif signal_dict['trigger'] == 'inner':
+        if signal in band_type_dict['signal']:
+            indicator = check_series[signal_key]
+            upperband = signal_dict['overbought']
+            lowerband = signal_dict['oversold']
+        elif signal in band_type_dict['price']:
+            indicator = check_series['close']
+            upperband = check_series[f'{signal_key}_upper']
+            lowerband = check_series[f'{signal_key}_lower']
+
+        action_side = cal_inner_band(action_list, indicator, upperband, lowerband)
+
+    return action_side
+
+
 def check_signal_side(objective, symbol_type, time, signal, action_list, ohlcv_df, timeframe, config_params):
-    check_df = ohlcv_df[ohlcv_df['time'] <= time].reset_index(drop=True)
-    check_series = check_df.loc[len(check_df) - 1, :]
+    signal_key = get_signal_key(signal, config_params[symbol_type][objective][timeframe][signal])
+    index = get_asof_index(ohlcv_df['time'], time)
     
-    action_side = check_series[f'{signal}_side']
+    # No data at or before signal time
+    if index == None:
+        action_side = side_code_dict['no_action']
+    else:
+        action_side = int(ohlcv_df[f'{signal_key}_side'].to_numpy()[index])
 
     if config_params[symbol_type][objective][timeframe][signal]['revert']:
         action_side = revert_signal(action_side)
@@ -88,21 +277,13 @@ def check_signal_side(objective, symbol_type, time, signal, action_list, ohlcv_d
 
 
 def check_signal_side_change(objective, symbol_type, time, signal, action_list, ohlcv_df, timeframe, config_params):
-    look_back = config_params[symbol_type][objective][timeframe][signal]['look_back']
-    check_df = ohlcv_df[ohlcv_df['time'] <= time]
-    check_df = check_df.loc[len(check_df) - look_back - 1:].reset_index(drop=True)
+    signal_dict = config_params[symbol_type][objective][timeframe][signal]
+    signal_key = get_signal_key(signal, signal_dict)
+    index = get_asof_index(ohlcv_df['time'], time)
     
-    if len(check_df) < look_back + 1:
-        action_side = 'no_action'
-    else:
-        action_side_first = check_df.loc[0, f'{signal}_side']
-        action_side_unique = check_df.loc[1:len(check_df) - 1, f'{signal}_side'].unique()
-        if (len(action_side_unique) == 1) & (action_side_first != action_side_unique[0]):
-            action_side = action_side_unique[0]
-        else:
-            action_side = 'no_action' if objective == 'open' else check_df.loc[len(check_df) - 1, f'{signal}_side']
+    action_side = get_side_change(objective, index, signal_dict['look_back'], ohlcv_df[f'{signal_key}_side'].to_numpy(), ohlcv_df[get_side_change_key(signal, signal_dict)].to_numpy())
         
-    if config_params[symbol_type][objective][timeframe][signal]['revert']:
+    if signal_dict['revert']:
         action_side = revert_signal(action_side)
 
     action_list.append(action_side)
@@ -110,67 +291,164 @@ def check_signal_side_change(objective, symbol_type, time, signal, action_list,
 
 
 def check_signal_band(objective, symbol_type, time, signal, action_list, ohlcv_df, timeframe, config_params):
-    def cal_outer_band(indicator, upperband, lowerband):
-        if indicator <= lowerband:
-            action_side = 'buy'
-        elif indicator >= upperband:
-            action_side = 'sell'
-        else:
-            action_side = 'no_action'
+    signal_dict = config_params[symbol_type][objective][timeframe][signal]
+    index = get_asof_index(ohlcv_df['time'], time)
 
-        return action_side
+    # No data at or before signal time
+    if index == None:
+        action_side = side_code_dict['no_action']
+    else:
+        check_series = {column: ohlcv_df[column].to_numpy()[index] for column in get_band_column_list(signal, signal_dict)}
+        action_side = get_band_side(objective, symbol_type, signal, action_list, check_series, timeframe, config_params)
 
+    if signal_dict['revert']:
+        action_side = revert_signal(action_side)
+        
+    action_list.append(action_side)
+    return action_side
 
-    @check_dependent_signal
-    def cal_inner_band(action_list, indicator, upperband, lowerband):
-        if (action_list[-1] == 'buy') & (indicator < upperband):
-            action_side = 'buy'
-        elif (action_list[-1] == 'buy') & (indicator >= upperband):
-            action_side = 'sell'
-        elif (action_list[-1] == 'sell') & (indicator > lowerband):
-            action_side = 'sell'
-        elif (action_list[-1] == 'sell') & (indicator <= lowerband):
-            action_side = 'buy'
-        else:
-            action_side = 'no_action'
 
-        return action_side
+def call_check_signal_func(func_name):
+    check_func_dict = {
+        'check_signal_side': check_signal_side,
+        'check_signal_side_change': check_signal_side_change,
+        'check_signal_band': check_signal_band
+    }
 
+    return check_func_dict[func_name]
 
-    check_df = ohlcv_df[ohlcv_df['time'] <= time].reset_index(drop=True)
-    check_series = check_df.loc[len(check_df) - 1, :]
 
-    band_type_dict = {
-        'signal': ['rsi', 'wt'],
-        'price': ['bollinger']
-    }
+def check_signal_side_array(objective, symbol_type, index, signal, action_list, array_dict, timeframe, config_params):
+    '''
+    Same as check_signal_side on array_dict of gen_backtest_dict, index is the row to check.
+    '''
+    signal_key = get_signal_key(signal, config_params[symbol_type][objective][timeframe][signal])
 
-    if signal in band_type_dict['signal']:
-        indicator = check_series[signal]
-        upperband = config_params[symbol_type][objective][timeframe][signal]['overbought']
-        lowerband = config_params[symbol_type][objective][timeframe][signal]['oversold']
-    elif signal in band_type_dict['price']:
-        indicator = check_series['close']
-        upperband = check_series[f'{signal}_upper']
-        lowerband = check_series[f'{signal}_lower']
-    
-    if config_params[symbol_type][objective][timeframe][signal]['trigger'] == 'outer':
-        action_side = cal_outer_band(indicator, upperband, lowerband)
-    elif config_params[symbol_type][objective][timeframe][signal]['trigger'] == 'inner':
-        action_side = cal_inner_band(action_list, indicator, upperband, lowerband)
+    # No data at or before signal time
+    if index == None:
+        action_side = side_code_dict['no_action']
+    else:
+        action_side = int(array_dict[f'{signal_key}_side'][index])
 
     if config_params[symbol_type][objective][timeframe][signal]['revert']:
         action_side = revert_signal(action_side)
-        
+
     action_list.append(action_side)
     return action_side
 
 
-def call_check_signal_func(func_name):
+def check_signal_side_change_array(objective, symbol_type, index, signal, action_list, array_dict, timeframe, config_params):
+    signal_dict = config_params[symbol_type][objective][timeframe][signal]
+    signal_key = get_signal_key(signal, signal_dict)
+
+    action_side = get_side_change(objective, index, signal_dict['look_back'], array_dict[f'{signal_key}_side'], array_dict[get_side_change_key(signal, signal_dict)])
+
+    if signal_dict['revert']:
+        action_side = revert_signal(action_side)
+
+    action_list.append(action_side)
+    return action_side
+
+
+def check_signal_band_array(objective, symbol_type, index, signal, action_list, array_dict, timeframe, config_params):
+    if index == None:
+        action_side = side_code_dict['no_action']
+    else:
+        check_series = {column: array_dict[column][index] for column in get_band_column_list(signal, config_params[symbol_type][objective][timeframe][signal])}
+        action_side = get_band_side(objective, symbol_type, signal, action_list, check_series, timeframe, config_params)
+
+    if config_params[symbol_type][objective][timeframe][signal]['revert']:
+        action_side = revert_signal(action_side)
+
+    action_list.append(action_side)
+    return action_side
+
+
+def call_check_signal_array_func(func_name):
     check_func_dict = {
-        'check_signal_side': check_signal_side,
-        'check_signal_side_change': check_signal_side_change,
-        'check_signal_band': check_signal_band
+        'check_signal_side': check_signal_side_array,
+        'check_signal_side_change': check_signal_side_change_array,
+        'check_signal_band': check_signal_band_array
+    }
+
+    return check_func_dict[func_name]
+
+
+def decode_side_array(code_array):
+    '''
+    Side string of each code for report, 0 is None.
+    '''
+    side_array = np.full(len(code_array), None, dtype=object)
+
+    for side in side_code_dict:
+        side_array[code_array == side_code_dict[side]] = side
+
+    return side_array
+
+
+def revert_code_array(code_array):
+    code_array = np.where(np.abs(code_array) == 1, -code_array, code_array).astype(np.int8)
+
+    return code_array
+
+
+def check_signal_side_vector(objective, symbol_type, index_array, signal, array_dict, timeframe, config_params):
+    '''
+    Side code of check_signal_side at each row in index_array, no_action where index is -1 (no data).
+    '''
+    signal_key = get_signal_key(signal, config_params[symbol_type][objective][timeframe][signal])
+    code_array = array_dict[f'{signal_key}_side'][index_array].astype(np.int8)
+    code_array = np.where(index_array < 0, side_code_dict['no_action'], code_array).astype(np.int8)
+
+    if config_params[symbol_type][objective][timeframe][signal]['revert']:
+        code_array = revert_code_array(code_array)
+
+    return code_array
+
+
+def check_signal_side_change_vector(objective, symbol_type, index_array, signal, array_dict, timeframe, config_params):
+    signal_dict = config_params[symbol_type][objective][timeframe][signal]
+    signal_key = get_signal_key(signal, signal_dict)
+
+    last_code_array = array_dict[f'{signal_key}_side'][index_array].astype(np.int8)
+    side_change_array = array_dict[get_side_change_key(signal, signal_dict)][index_array]
+
+    if objective == 'open':
+        code_array = np.where(side_change_array, last_code_array, side_code_dict['no_action'])
+    else:
+        code_array = last_code_array
+
+    code_array = np.where((index_array < 0) | (index_array < signal_dict['look_back']), side_code_dict['no_action'], code_array).astype(np.int8)
+
+    if signal_dict['revert']:
+        code_array = revert_code_array(code_array)
+
+    return code_array
+
+
+def check_signal_band_vector(objective, symbol_type, index_array, signal, array_dict, timeframe, config_params):
+    '''
+    Side code of check_signal_band at each row in index_array, only outer trigger.
+    '''
+    signal_dict = config_params[symbol_type][objective][timeframe][signal]
+
+    if signal_dict['trigger'] != 'outer':
+        raise ValueError("Only outer trigger can be vectorized.")
+
+    code_array = array_dict[get_band_outer_key(signal, signal_dict)][index_array].astype(np.int8)
+    code_array = np.where(index_array < 0, side_code_dict['no_action'], code_array).astype(np.int8)
+
+    if signal_dict['revert']:
+        code_array = revert_code_array(code_array)
+
+    return code_array
+
+
+def call_check_signal_vector_func(func_name):
+    check_func_dict = {
+        'check_signal_side': check_signal_side_vector,
+        'check_signal_side_change': check_signal_side_change_vector,
+        'check_signal_band': check_signal_band_vector
     }
 
     return check_func_dict[func_name]
@@ -201,22 +479,37 @@ def cal_tma(ohlcv_df, windows):
 
 
 def cal_wma(ohlcv_df, input_col, windows):
-    def weight_ma(series):
-        weight_list = list(range(1, len(series) + 1))
-        weighted_average_list = [i * j for i, j in zip(series, weight_list)]
+    '''
+    Weighted moving average with weight 1 to windows from oldest to newest, first windows - 1 values are None.
+    Window with nan value is nan.
+    '''
+    input_array = ohlcv_df[input_col].to_numpy(dtype=np.float64)
+    weight_array = np.arange(1, windows + 1, dtype=np.float64)
+
+    if len(input_array) >= windows:
+        wma_array = np.convolve(input_array, weight_array[::-1], mode='valid') / weight_array.sum()
+    else:
+        wma_array = np.empty(0)
+
+    wma_list = [None] * (windows - 1) + wma_array.tolist()
 
-        wma = sum(weighted_average_list) / sum(weight_list)
+    return wma_list
 
-        return wma
+
+def cal_wilder_average(series, windows):
+    '''
+    Wilder's smoothing: SMA of the first windows values then avg = (prev_avg * (windows - 1) + value) / windows,
+    same as ewm(alpha=1 / windows) started from the SMA.
+    '''
+    seed_series = series.rolling(window=windows, min_periods=windows).mean()
     
-    wma_list = [None] * (windows - 1)
+    wilder_series = series.where(np.arange(len(series)) > windows)
+    if len(series) > windows:
+        wilder_series.iloc[windows] = seed_series.iloc[windows]
 
-    for i in range(len(ohlcv_df) - (windows - 1)):
-        close_series = ohlcv_df.loc[i:i + (windows - 1), input_col]
-        wma = weight_ma(close_series)
-        wma_list.append(wma)
+    wilder_series = wilder_series.ewm(alpha=1 / windows, adjust=False).mean()
 
-    return wma_list
+    return wilder_series
 
 
 def cal_atr(ohlcv_df, atr_range):
@@ -301,65 +594,106 @@ def cal_supertrend(ohlcv_df, index, final_upperband, final_lowerband, supertrend
     return supertrend, supertrend_side
 
 
-def add_sma(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('sma', objective, timeframe, config_params)
+def cal_supertrend_array(high_array, low_array, close_array, atr_array, multiplier):
+    '''
+    Single pass of cal_basic_band, cal_final_band and cal_supertrend over float64 arrays.
+    Return supertrend and side code (1 buy, -1 sell, 0 no trend yet).
+    '''
+    supertrend_array = np.empty(len(close_array), dtype=np.float64)
+    supertrend_code_array = np.zeros(len(close_array), dtype=np.int8)
+
+    final_upperband = np.nan
+    final_lowerband = np.nan
+    supertrend_code = 0
+
+    for i in range(len(close_array)):
+        mid_price = (high_array[i] + low_array[i]) / 2
+        basic_upperband = mid_price + multiplier * atr_array[i]
+        basic_lowerband = mid_price - multiplier * atr_array[i]
+
+        if i == 0:
+            final_upperband = basic_upperband
+            final_lowerband = basic_lowerband
+        else:
+            if (basic_upperband < final_upperband) or (close_array[i - 1] > final_upperband):
+                final_upperband = basic_upperband
+            if (basic_lowerband > final_lowerband) or (close_array[i - 1] < final_lowerband):
+                final_lowerband = basic_lowerband
+
+        if close_array[i] > final_upperband:
+            supertrend_code = 1
+        elif close_array[i] < final_lowerband:
+            supertrend_code = -1
+
+        supertrend_array[i] = final_lowerband if supertrend_code == 1 else final_upperband
+        supertrend_code_array[i] = supertrend_code
+
+    return supertrend_array, supertrend_code_array
+
+
+if numba != None:
+    cal_supertrend_array = numba.njit(cache=True)(cal_supertrend_array)
+
+
+def add_sma(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('sma', objective, timeframe, config_params, symbol_type)
     
     ohlcv_df['sma'] = cal_sma(ohlcv_df, signal_dict['windows'])
-    ohlcv_df[f'sma_side'] = ohlcv_df.apply(get_signal_side, signal='sma', axis=1)
+    ohlcv_df[f'sma_side'] = get_signal_side(ohlcv_df, 'sma')
     
     return ohlcv_df
 
 
-def add_ema(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('ema', objective, timeframe, config_params)
+def add_ema(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('ema', objective, timeframe, config_params, symbol_type)
     
     ohlcv_df['ema'] = cal_ema(ohlcv_df, signal_dict['windows'])
-    ohlcv_df['ema_side'] = ohlcv_df.apply(get_signal_side, signal='ema', axis=1)
+    ohlcv_df['ema_side'] = get_signal_side(ohlcv_df, 'ema')
     
     return ohlcv_df
 
 
-def add_tma(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('tma', objective, timeframe, config_params)
+def add_tma(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('tma', objective, timeframe, config_params, symbol_type)
 
     ohlcv_df['tma'] = cal_tma(ohlcv_df, signal_dict['windows'])
-    ohlcv_df['tma_side'] = ohlcv_df.apply(get_signal_side, signal='tma', axis=1)
+    ohlcv_df['tma_side'] = get_signal_side(ohlcv_df, 'tma')
     
     return ohlcv_df
 
 
-def add_cross_sma(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('cross_sma', objective, timeframe, config_params)
+def add_cross_sma(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('cross_sma', objective, timeframe, config_params, symbol_type)
     
     ohlcv_df['short_sma'] = cal_sma(ohlcv_df, signal_dict['short_windows'])
     ohlcv_df['long_sma'] = cal_sma(ohlcv_df, signal_dict['long_windows'])
-    ohlcv_df['cross_sma_side'] = ohlcv_df.apply(get_signal_cross_side, signal='sma', axis=1)
+    ohlcv_df['cross_sma_side'] = get_signal_cross_side(ohlcv_df, 'sma')
     
     return ohlcv_df
 
 
-def add_cross_ema(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('cross_ema', objective, timeframe, config_params)
+def add_cross_ema(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('cross_ema', objective, timeframe, config_params, symbol_type)
 
     ohlcv_df['short_ema'] = cal_ema(ohlcv_df, signal_dict['short_windows'])
     ohlcv_df['long_ema'] = cal_ema(ohlcv_df, signal_dict['long_windows'])
-    ohlcv_df['cross_ema_side'] = ohlcv_df.apply(get_signal_cross_side, signal='ema', axis=1)
+    ohlcv_df['cross_ema_side'] = get_signal_cross_side(ohlcv_df, 'ema')
     
     return ohlcv_df
 
 
-def add_cross_tma(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('cross_tma', objective, timeframe, config_params)
+def add_cross_tma(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('cross_tma', objective, timeframe, config_params, symbol_type)
     
     ohlcv_df['short_tma'] = cal_tma(ohlcv_df, signal_dict['short_windows'])
     ohlcv_df['long_tma'] = cal_tma(ohlcv_df, signal_dict['long_windows'])
-    ohlcv_df['cross_tma_side'] = ohlcv_df.apply(get_signal_cross_side, signal='tma', axis=1)
+    ohlcv_df['cross_tma_side'] = get_signal_cross_side(ohlcv_df, 'tma')
     
     return ohlcv_df
 
 
-def add_bollinger(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('bollinger', objective, timeframe, config_params)
+def add_bollinger(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('bollinger', objective, timeframe, config_params, symbol_type)
     
     temp_df = ohlcv_df.copy()
 
@@ -375,8 +709,8 @@ def add_bollinger(objective, ohlcv_df, timeframe, config_params):
     return ohlcv_df
 
 
-def add_wt(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('wt', objective, timeframe, config_params)
+def add_wt(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('wt', objective, timeframe, config_params, symbol_type)
     
     temp_df = ohlcv_df.copy()
     
@@ -392,34 +726,50 @@ def add_wt(objective, ohlcv_df, timeframe, config_params):
     return ohlcv_df
 
 
-def add_rsi(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('rsi', objective, timeframe, config_params)
+def add_rsi(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('rsi', objective, timeframe, config_params, symbol_type)
 
-    temp_df = ohlcv_df.copy()
+    diff_series = ohlcv_df['close'].diff(1)
+    gain_series = diff_series.clip(lower=0)
+    loss_series = diff_series.clip(upper=0).abs()
+
+    avg_gain_series = cal_wilder_average(gain_series, signal_dict['average_range'])
+    avg_loss_series = cal_wilder_average(loss_series, signal_dict['average_range'])
+    rs_series = avg_gain_series / avg_loss_series
     
-    temp_df['diff'] = temp_df['close'].diff(1)
-    temp_df['gain'] = temp_df['diff'].clip(lower=0)
-    temp_df['loss'] = temp_df['diff'].clip(upper=0).abs()
+    rsi_list = 100 - (100 / (1.0 + rs_series))
+    ohlcv_df['rsi'] = rsi_list
+  
+    return ohlcv_df
+
+
+def add_supertrend(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('supertrend', objective, timeframe, config_params, symbol_type)
 
-    temp_df['avg_gain'] = temp_df['gain'].rolling(window=signal_dict['average_range'], min_periods=signal_dict['average_range']).mean()[:signal_dict['average_range']+1]
-    temp_df['avg_loss'] = temp_df['loss'].rolling(window=signal_dict['average_range'], min_periods=signal_dict['average_range']).mean()[:signal_dict['average_range']+1]
+    temp_df = ohlcv_df.copy()
 
-    for i, _ in enumerate(temp_df.loc[signal_dict['average_range'] + 1:, 'avg_gain']):
-        temp_df.loc[i + signal_dict['average_range'] + 1, 'avg_gain'] = (temp_df.loc[i + signal_dict['average_range'], 'avg_gain'] * (signal_dict['average_range'] - 1) + temp_df.loc[i + signal_dict['average_range'] + 1, 'gain']) / signal_dict['average_range']
+    temp_df['atr'] = cal_atr(ohlcv_df, signal_dict['atr_range'])
+    temp_df = temp_df.dropna().reset_index(drop=True)
 
-    for i, _ in enumerate(temp_df.loc[signal_dict['average_range'] + 1:, 'avg_loss']):
-        temp_df.loc[i + signal_dict['average_range'] + 1, 'avg_loss'] = (temp_df.loc[i + signal_dict['average_range'], 'avg_loss'] * (signal_dict['average_range'] - 1) + temp_df.loc[i + signal_dict['average_range'] + 1, 'loss']) / signal_dict['average_range']
+    supertrend_array, supertrend_code_array = cal_supertrend_array(
+        temp_df['high'].to_numpy(dtype=np.float64),
+        temp_df['low'].to_numpy(dtype=np.float64),
+        temp_df['close'].to_numpy(dtype=np.float64),
+        temp_df['atr'].to_numpy(dtype=np.float64),
+        float(signal_dict['multiplier'])
+    )
 
-    temp_df['rs'] = temp_df['avg_gain'] / temp_df['avg_loss']
+    ohlcv_df['supertrend'] = np.concatenate([np.full(signal_dict['atr_range'] - 1, np.nan), supertrend_array])
+    ohlcv_df['supertrend_side'] = np.concatenate([np.zeros(signal_dict['atr_range'] - 1, dtype=np.int8), supertrend_code_array])
     
-    rsi_list = 100 - (100 / (1.0 + temp_df['rs']))
-    ohlcv_df['rsi'] = rsi_list
-  
     return ohlcv_df
 
 
-def add_supertrend(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('supertrend', objective, timeframe, config_params)
+def add_supertrend_reference(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    '''
+    Row by row supertrend kept as reference of add_supertrend.
+    '''
+    signal_dict = get_signal_dict('supertrend', objective, timeframe, config_params, symbol_type)
 
     temp_df = ohlcv_df.copy()
 
@@ -449,8 +799,8 @@ def add_supertrend(objective, ohlcv_df, timeframe, config_params):
     return ohlcv_df
 
 
-def add_donchian(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('donchian', objective, timeframe, config_params)
+def add_donchian(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('donchian', objective, timeframe, config_params, symbol_type)
     
     temp_df = ohlcv_df.copy()
 
@@ -462,16 +812,17 @@ def add_donchian(objective, ohlcv_df, timeframe, config_params):
     
     temp_df['max_high'] = temp_df['max_high'].shift(periods=1)
     temp_df['min_low'] = temp_df['min_low'].shift(periods=1)
-    temp_df['donchian_side'] = temp_df.apply(get_signal_bound_side, axis=1)
+    temp_df['donchian_side'] = get_signal_bound_side(temp_df)
     
-    donchian_list = temp_df['donchian_side'].fillna(method='ffill')
+    # Keep last breakout side
+    donchian_list = temp_df['donchian_side'].replace(0, np.nan).ffill().fillna(0).astype(np.int8)
     ohlcv_df['donchian_side'] = donchian_list
     
     return ohlcv_df
 
 
-def add_hull(objective, ohlcv_df, timeframe, config_params):
-    signal_dict = get_signal_dict('hull', objective, timeframe, config_params)
+def add_hull(objective, ohlcv_df, timeframe, config_params, symbol_type='base'):
+    signal_dict = get_signal_dict('hull', objective, timeframe, config_params, symbol_type)
     
     temp_df = ohlcv_df.copy()
 
@@ -482,7 +833,7 @@ def add_hull(objective, ohlcv_df, timeframe, config_params):
     
     temp_df['hull'] = hull_list
     temp_df['hull_prev'] = temp_df['hull'].shift(periods=2)
-    hull_side_list = temp_df.apply(get_signal_equence_side, signal='hull', axis=1)
+    hull_side_list = get_signal_equence_side(temp_df, 'hull')
     
     ohlcv_df['hull'] = hull_list
     ohlcv_df['hull_side'] = hull_side_list
@@ -490,22 +841,81 @@ def add_hull(objective, ohlcv_df, timeframe, config_params):
     return ohlcv_df
 
 
+def check_signal_column(ohlcv_df, signal_key):
+    column_flag = any((x == signal_key) | x.startswith(f'{signal_key}_') for x in ohlcv_df.columns)
+
+    return column_flag
+
+
+def get_indicator_df(signal, objective, symbol_type, ohlcv_df, timeframe, func_add_dict, config_params):
+    '''
+    Indicator columns of signal named by get_signal_key, from indicator cache if the same ohlcv and params were computed before.
+    '''
+    signal_dict = get_signal_dict(signal, objective, timeframe, config_params, symbol_type)
+    signal_key = get_signal_key(signal, signal_dict)
+    param_dict = {x: signal_dict[x] for x in signal_param_dict[signal]}
+
+    column_list = [x for x in func_cache.ohlcv_column_list if x in ohlcv_df.columns]
+    indicator_key = func_cache.get_indicator_key(ohlcv_df, signal, param_dict)
+    indicator_df = func_cache.read_indicator_cache(indicator_key)
+
+    if indicator_df is None:
+        # Compute in float64 also for compact frame
+        temp_df = ohlcv_df[column_list].astype({x: np.float64 for x in column_list if x != 'time'})
+        temp_df = func_add_dict[signal](objective, temp_df, timeframe, config_params, symbol_type)
+
+        # Rename e.g. tma_side to tma_50_side and short_sma to short_sma_15_200
+        rename_dict = {}
+        for column in temp_df.columns.drop(column_list):
+            if column.startswith(signal):
+                rename_dict[column] = signal_key + column[len(signal):]
+            else:
+                rename_dict[column] = column + signal_key[len(signal):]
+
+        indicator_df = temp_df[list(rename_dict)].rename(columns=rename_dict).reset_index(drop=True)
+        func_cache.write_indicator_cache(indicator_key, indicator_df)
+
+    return indicator_df
+
+
+def add_indicator(signal, objective, symbol_type, ohlcv_df, timeframe, func_add_dict, config_params):
+    indicator_df = get_indicator_df(signal, objective, symbol_type, ohlcv_df, timeframe, func_add_dict, config_params)
+
+    for column in indicator_df.columns:
+        indicator_array = indicator_df[column].to_numpy()
+
+        # Keep compact frame in float32
+        if (ohlcv_df['close'].dtype == np.float32) & (indicator_array.dtype == np.float64):
+            indicator_array = indicator_array.astype(np.float32)
+
+        ohlcv_df[column] = indicator_array
+
+    return ohlcv_df
+
+
 def add_action_signal(objective, ohlcv_df, symbol_type, timeframe, symbol, func_add_dict, config_params):
     if timeframe in config_params[symbol_type][objective]:
         for signal in config_params[symbol_type][objective][timeframe]:
-            if signal not in ohlcv_df.columns:
-                print(f"{symbol_type} add {signal} to {symbol} {timeframe}")
-                ohlcv_df = func_add_dict[signal](objective, ohlcv_df, timeframe, config_params)
+            signal_key = get_signal_key(signal, config_params[symbol_type][objective][timeframe][signal])
+
+            if not check_signal_column(ohlcv_df, signal_key):
+                logger.info("%s add %s to %s %s", symbol_type, signal_key, symbol, timeframe)
+
+                with func_profile.profile_stage(f'add_{signal} {symbol_type} {timeframe} {symbol}'):
+                    ohlcv_df = add_indicator(signal, objective, symbol_type, ohlcv_df, timeframe, func_add_dict, config_params)
 
     return ohlcv_df
 
 
 def add_stop_signal(objective, ohlcv_df, timeframe, symbol, func_add_dict, config_params):
     signal = list(config_params[objective]['signal']['signal'])[0]
+    signal_key = get_signal_key(signal, config_params[objective]['signal']['signal'][signal])
 
-    if signal not in ohlcv_df.columns:
-        print(f"{objective} add {signal} to {symbol} {timeframe}")
-        ohlcv_df = func_add_dict[signal](objective, ohlcv_df, timeframe, config_params)
+    if not check_signal_column(ohlcv_df, signal_key):
+        logger.info("%s add %s to %s %s", objective, signal_key, symbol, timeframe)
+
+        with func_profile.profile_stage(f'add_{signal} base {timeframe} {symbol}'):
+            ohlcv_df = add_indicator(signal, objective, 'base', ohlcv_df, timeframe, func_add_dict, config_params)
 
     return ohlcv_df
 
@@ -536,6 +946,7 @@ def get_stop_signal(ohlcv_df_dict, func_add_dict, config_params):
     return ohlcv_df_dict
 
 
+@func_profile.profile_func
 def filter_start_time(start_date, ohlcv_df_dict, interval_dict):
     for symbol_type in ['base', 'lead']:
         for timeframe in ohlcv_df_dict[symbol_type]:
@@ -543,13 +954,56 @@ def filter_start_time(start_date, ohlcv_df_dict, interval_dict):
                 ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
                 
                 first_signal_time = start_date - dt.timedelta(minutes=interval_dict[timeframe])
-                ohlcv_df = ohlcv_df[ohlcv_df['time'] >= first_signal_time].dropna().reset_index(drop=True)
+                # Rows without side are dropped as nan rows
+                side_column_list = [x for x in ohlcv_df.columns if x.endswith('_side')]
+                side_flag = (ohlcv_df[side_column_list] != 0).all(axis=1)
+                ohlcv_df = ohlcv_df[(ohlcv_df['time'] >= first_signal_time) & side_flag].dropna().reset_index(drop=True)
                 ohlcv_df_dict[symbol_type][timeframe][symbol] = ohlcv_df
 
     return ohlcv_df_dict
 
 
-def add_signal(start_date, ohlcv_df_dict, interval_dict, config_params):
+def add_check_column(objective, ohlcv_df, symbol_type, timeframe, config_params):
+    '''
+    Precompute side change and outer band side of each row so checks are array lookups.
+    '''
+    for signal in config_params[symbol_type][objective].get(timeframe, {}):
+        signal_dict = config_params[symbol_type][objective][timeframe][signal]
+        signal_key = get_signal_key(signal, signal_dict)
+
+        if 'check_signal_side_change' in signal_dict['check']:
+            ohlcv_df[get_side_change_key(signal, signal_dict)] = cal_side_change(ohlcv_df[f'{signal_key}_side'].to_numpy(), signal_dict['look_back'])
+
+        if ('check_signal_band' in signal_dict['check']) and (signal_dict['trigger'] == 'outer'):
+            if signal in band_type_dict['signal']:
+                indicator_array = ohlcv_df[signal_key].to_numpy(dtype=np.float64)
+                upperband_array = signal_dict['overbought']
+                lowerband_array = signal_dict['oversold']
+            elif signal in band_type_dict['price']:
+                indicator_array = ohlcv_df['close'].to_numpy(dtype=np.float64)
+                upperband_array = ohlcv_df[f'{signal_key}_upper'].to_numpy(dtype=np.float64)
+                lowerband_array = ohlcv_df[f'{signal_key}_lower'].to_numpy(dtype=np.float64)
+
+            ohlcv_df[get_band_outer_key(signal, signal_dict)] = cal_outer_band(indicator_array, upperband_array, lowerband_array)
+
+    return ohlcv_df
+
+
+@func_profile.profile_func
+def get_check_signal(ohlcv_df_dict, config_params):
+    for symbol_type in ['base', 'lead']:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
+                ohlcv_df = add_check_column('open', ohlcv_df, symbol_type, timeframe, config_params)
+                ohlcv_df = add_check_column('close', ohlcv_df, symbol_type, timeframe, config_params)
+
+                ohlcv_df_dict[symbol_type][timeframe][symbol] = ohlcv_df
+
+    return ohlcv_df_dict
+
+
+def get_func_add_dict():
     func_add_dict = {
         'sma': add_sma,
         'ema': add_ema,
@@ -565,8 +1019,16 @@ def add_signal(start_date, ohlcv_df_dict, interval_dict, config_params):
         'hull': add_hull
     }
 
+    return func_add_dict
+
+
+@func_profile.profile_func
+def add_signal(start_date, ohlcv_df_dict, interval_dict, config_params):
+    func_add_dict = get_func_add_dict()
+
     ohlcv_df_dict = get_action_signal(ohlcv_df_dict, func_add_dict, config_params)
     ohlcv_df_dict = get_stop_signal(ohlcv_df_dict, func_add_dict, config_params)
     ohlcv_df_dict = filter_start_time(start_date, ohlcv_df_dict, interval_dict)
+    ohlcv_df_dict = get_check_signal(ohlcv_df_dict, config_params)
 
     return ohlcv_df_dict
\ No newline at end of file
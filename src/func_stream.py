@@ -0,0 +1,482 @@
+import numpy as np
+import pandas as pd
+import math
+from collections import deque
+
+from func_signal import side_code_dict
+
+
+def get_price_side(price, indicator):
+    if price > indicator:
+        signal_side = side_code_dict['buy']
+    elif price < indicator:
+        signal_side = side_code_dict['sell']
+    else:
+        signal_side = 0
+
+    return signal_side
+
+
+def divide(numerator, denominator):
+    '''
+    Float division as pandas does, x / 0 is inf and 0 / 0 is nan.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quotient = float(np.float64(numerator) / np.float64(denominator))
+
+    return quotient
+
+
+class StreamRolling:
+    '''
+    Rolling mean and std (ddof=0) of the last windows values, nan while the window is not full or has nan.
+    Values are added and removed with the same updates as pandas rolling mean (compensated sum) and var (Welford),
+    a window of the same value is exactly that value with 0 std.
+    '''
+    def __init__(self, windows):
+        self.windows = windows
+        self.value_deque = deque()
+        self.nan_count = 0
+        self.same_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.compensation_dict = {'add': 0.0, 'remove': 0.0}
+        self.mean = 0.0
+        self.ssqdm = 0.0
+
+    def add_sum(self, value, compensation_key):
+        y = value - self.compensation_dict[compensation_key]
+        t = self.sum + y
+        self.compensation_dict[compensation_key] = t - self.sum - y
+        self.sum = t
+
+    def add(self, value):
+        self.same_count = self.same_count + 1 if (self.count > 0) and (value == self.value_deque[-2]) else 1
+        self.count += 1
+        self.add_sum(value, 'add')
+
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.ssqdm += ((self.count - 1) * delta ** 2) / self.count
+
+    def remove(self, value):
+        self.count -= 1
+        self.add_sum(-value, 'remove')
+
+        if self.count > 0:
+            delta = value - self.mean
+            self.mean -= delta / self.count
+            self.ssqdm -= ((self.count + 1) * delta ** 2) / self.count
+        else:
+            self.mean = 0.0
+            self.ssqdm = 0.0
+
+    def update(self, value):
+        if len(self.value_deque) == self.windows:
+            old_value = self.value_deque.popleft()
+
+            if math.isnan(old_value):
+                self.nan_count -= 1
+            else:
+                self.remove(old_value)
+
+        self.value_deque.append(value)
+
+        if math.isnan(value):
+            self.nan_count += 1
+            self.same_count = 0
+        else:
+            self.add(value)
+
+        return self.get_mean()
+
+    def check_full(self):
+        full_flag = (len(self.value_deque) == self.windows) & (self.nan_count == 0)
+
+        return full_flag
+
+    def get_mean(self):
+        if not self.check_full():
+            mean = np.nan
+        elif self.same_count >= self.count:
+            mean = self.value_deque[-1]
+        else:
+            mean = self.sum / self.count
+
+        return mean
+
+    def get_std(self):
+        if not self.check_full():
+            std = np.nan
+        elif self.same_count >= self.count:
+            std = 0.0
+        else:
+            std = math.sqrt(max(self.ssqdm / self.count, 0))
+
+        return std
+
+
+class StreamEWM:
+    '''
+    Same recurrence as pandas ewm(alpha, adjust, min_periods) with ignore_na=False.
+    '''
+    def __init__(self, alpha, adjust=True, min_periods=0):
+        self.old_wt_factor = 1 - alpha
+        self.new_wt = 1 if adjust else alpha
+        self.adjust = adjust
+        self.min_periods = max(min_periods, 1)
+        self.weighted_avg = np.nan
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, value):
+        observation_flag = not math.isnan(value)
+        self.nobs += observation_flag
+
+        if not math.isnan(self.weighted_avg):
+            self.old_wt *= self.old_wt_factor
+
+            if observation_flag:
+                if self.weighted_avg != value:
+                    self.weighted_avg = ((self.old_wt * self.weighted_avg) + (self.new_wt * value)) / (self.old_wt + self.new_wt)
+
+                self.old_wt = self.old_wt + self.new_wt if self.adjust else 1.0
+        elif observation_flag:
+            self.weighted_avg = value
+
+        ewm = self.weighted_avg if self.nobs >= self.min_periods else np.nan
+
+        return ewm
+
+
+class StreamWMA:
+    '''
+    Same as func_signal.cal_wma, nan until windows values.
+    Sum and weighted sum are updated in O(1) per value and recomputed once every windows values so rounding does not drift,
+    a window of the same value is exactly that value.
+    '''
+    def __init__(self, windows):
+        self.windows = windows
+        self.value_deque = deque()
+        self.weight_array = np.arange(1, windows + 1, dtype=np.float64)
+        self.weight_sum = windows * (windows + 1) / 2
+        self.nan_count = 0
+        self.same_count = 0
+        self.sum = 0.0
+        self.weighted_sum = 0.0
+        self.update_count = 0
+
+    def update(self, value):
+        old_value = 0.0
+
+        if len(self.value_deque) == self.windows:
+            old_value = self.value_deque.popleft()
+
+            if math.isnan(old_value):
+                self.nan_count -= 1
+                old_value = 0.0
+
+        if math.isnan(value):
+            self.nan_count += 1
+            self.same_count = 0
+            new_value = 0.0
+        else:
+            self.same_count = self.same_count + 1 if (len(self.value_deque) > 0) and (value == self.value_deque[-1]) else 1
+            new_value = value
+
+        self.value_deque.append(value)
+
+        # Each value in window loses one weight and the new value gets windows
+        self.weighted_sum += (self.windows * new_value) - self.sum
+        self.sum += new_value - old_value
+        self.update_count += 1
+
+        if self.update_count % self.windows == 0:
+            value_array = np.nan_to_num(np.array(self.value_deque), nan=0.0)
+            self.sum = float(value_array.sum())
+            self.weighted_sum = float(np.dot(value_array, self.weight_array[-len(value_array):]))
+
+        if (len(self.value_deque) < self.windows) or (self.nan_count > 0):
+            wma = np.nan
+        elif self.same_count >= self.windows:
+            wma = value
+        else:
+            wma = self.weighted_sum / self.weight_sum
+
+        return wma
+
+
+class StreamSMA:
+    def __init__(self, windows):
+        self.sma_rolling = StreamRolling(windows)
+
+    def update(self, bar):
+        sma = self.sma_rolling.update(bar['close'])
+        indicator_dict = {'sma': sma, 'sma_side': get_price_side(bar['close'], sma)}
+
+        return indicator_dict
+
+
+class StreamEMA:
+    def __init__(self, windows):
+        self.ema_ewm = StreamEWM(2 / (windows + 1), adjust=False)
+
+    def update(self, bar):
+        ema = self.ema_ewm.update(bar['close'])
+        indicator_dict = {'ema': ema, 'ema_side': get_price_side(bar['close'], ema)}
+
+        return indicator_dict
+
+
+class StreamTMA:
+    def __init__(self, windows):
+        sub_interval = (windows + 1) / 2
+        self.ma_rolling = StreamRolling(math.trunc(sub_interval))
+        self.tma_rolling = StreamRolling(int(np.round(sub_interval)))
+
+    def update(self, bar):
+        tma = self.tma_rolling.update(self.ma_rolling.update(bar['close']))
+        indicator_dict = {'tma': tma, 'tma_side': get_price_side(bar['close'], tma)}
+
+        return indicator_dict
+
+
+class StreamBollinger:
+    def __init__(self, windows, std):
+        self.close_rolling = StreamRolling(windows)
+        self.std = std
+
+    def update(self, bar):
+        sma = self.close_rolling.update(bar['close'])
+        std = self.close_rolling.get_std()
+
+        indicator_dict = {
+            'bollinger_upper': sma + (std * self.std),
+            'bollinger_lower': sma - (std * self.std)
+        }
+
+        return indicator_dict
+
+
+class StreamRSI:
+    '''
+    Same as func_signal.add_rsi: average gain and loss start with SMA at bar average_range then Wilder's smoothing.
+    '''
+    def __init__(self, average_range):
+        self.average_range = average_range
+        self.index = 0
+        self.prev_close = np.nan
+        self.gain_rolling = StreamRolling(average_range)
+        self.loss_rolling = StreamRolling(average_range)
+        self.gain_ewm = StreamEWM(1 / average_range, adjust=False)
+        self.loss_ewm = StreamEWM(1 / average_range, adjust=False)
+
+    def update_average(self, value, value_rolling, value_ewm):
+        seed = value_rolling.update(value)
+
+        if self.index < self.average_range:
+            average = value_ewm.update(np.nan)
+        elif self.index == self.average_range:
+            average = value_ewm.update(seed)
+        else:
+            average = value_ewm.update(value)
+
+        return average
+
+    def update(self, bar):
+        diff = bar['close'] - self.prev_close
+        gain = max(diff, 0) if not math.isnan(diff) else np.nan
+        loss = abs(min(diff, 0)) if not math.isnan(diff) else np.nan
+
+        avg_gain = self.update_average(gain, self.gain_rolling, self.gain_ewm)
+        avg_loss = self.update_average(loss, self.loss_rolling, self.loss_ewm)
+        rs = divide(avg_gain, avg_loss)
+
+        self.prev_close = bar['close']
+        self.index += 1
+
+        indicator_dict = {'rsi': 100 - (100 / (1.0 + rs))}
+
+        return indicator_dict
+
+
+class StreamWT:
+    def __init__(self, channel_range, average_range):
+        self.esa_ewm = StreamEWM(2 / (channel_range + 1))
+        self.d_ewm = StreamEWM(2 / (channel_range + 1))
+        self.wt_ewm = StreamEWM(2 / (average_range + 1))
+
+    def update(self, bar):
+        average_price = (bar['high'] + bar['low'] + bar['close']) / 3
+        esa = self.esa_ewm.update(average_price)
+        d = self.d_ewm.update(abs(average_price - esa))
+        ci = divide(average_price - esa, 0.015 * d)
+
+        indicator_dict = {'wt': self.wt_ewm.update(ci)}
+
+        return indicator_dict
+
+
+class StreamATR:
+    def __init__(self, atr_range):
+        self.prev_close = np.nan
+        self.atr_ewm = StreamEWM(1 / atr_range, min_periods=atr_range)
+
+    def update(self, bar):
+        range_list = [bar['high'] - bar['low'], abs(bar['high'] - self.prev_close), abs(bar['low'] - self.prev_close)]
+        true_range = max(x for x in range_list if not math.isnan(x))
+
+        self.prev_close = bar['close']
+        indicator_dict = {'atr': self.atr_ewm.update(true_range)}
+
+        return indicator_dict
+
+
+class StreamSupertrend:
+    '''
+    Same steps as func_signal.cal_supertrend_array, starting from the first bar with atr.
+    '''
+    def __init__(self, atr_range, multiplier):
+        self.atr_stream = StreamATR(atr_range)
+        self.multiplier = multiplier
+        self.final_upperband = np.nan
+        self.final_lowerband = np.nan
+        self.prev_close = np.nan
+        self.supertrend_code = 0
+
+    def update(self, bar):
+        atr = self.atr_stream.update(bar)['atr']
+
+        if math.isnan(atr):
+            return {'supertrend': np.nan, 'supertrend_side': 0}
+
+        mid_price = (bar['high'] + bar['low']) / 2
+        basic_upperband = mid_price + self.multiplier * atr
+        basic_lowerband = mid_price - self.multiplier * atr
+
+        if math.isnan(self.prev_close):
+            self.final_upperband = basic_upperband
+            self.final_lowerband = basic_lowerband
+        else:
+            if (basic_upperband < self.final_upperband) or (self.prev_close > self.final_upperband):
+                self.final_upperband = basic_upperband
+            if (basic_lowerband > self.final_lowerband) or (self.prev_close < self.final_lowerband):
+                self.final_lowerband = basic_lowerband
+
+        if bar['close'] > self.final_upperband:
+            self.supertrend_code = side_code_dict['buy']
+        elif bar['close'] < self.final_lowerband:
+            self.supertrend_code = side_code_dict['sell']
+
+        self.prev_close = bar['close']
+
+        indicator_dict = {
+            'supertrend': self.final_lowerband if self.supertrend_code == side_code_dict['buy'] else self.final_upperband,
+            'supertrend_side': self.supertrend_code
+        }
+
+        return indicator_dict
+
+
+class StreamDonchian:
+    '''
+    Breakout of the previous windows bars, side is kept until the next breakout.
+    '''
+    def __init__(self, windows):
+        self.windows = windows
+        self.index = 0
+        # (index, price) with decreasing high and increasing low
+        self.high_deque = deque()
+        self.low_deque = deque()
+        self.donchian_code = 0
+
+    def update(self, bar):
+        if self.index >= self.windows:
+            max_high = self.high_deque[0][1]
+            min_low = self.low_deque[0][1]
+
+            if bar['close'] > max_high:
+                self.donchian_code = side_code_dict['buy']
+            elif bar['close'] < min_low:
+                self.donchian_code = side_code_dict['sell']
+
+        while (len(self.high_deque) > 0) and (self.high_deque[-1][1] <= bar['high']):
+            self.high_deque.pop()
+        while (len(self.low_deque) > 0) and (self.low_deque[-1][1] >= bar['low']):
+            self.low_deque.pop()
+
+        self.high_deque.append((self.index, bar['high']))
+        self.low_deque.append((self.index, bar['low']))
+
+        while self.high_deque[0][0] <= self.index - self.windows:
+            self.high_deque.popleft()
+        while self.low_deque[0][0] <= self.index - self.windows:
+            self.low_deque.popleft()
+
+        self.index += 1
+
+        indicator_dict = {'donchian_side': self.donchian_code}
+
+        return indicator_dict
+
+
+class StreamHull:
+    def __init__(self, windows):
+        self.hwma_stream = StreamWMA(int(round(windows / 2)))
+        self.wma_stream = StreamWMA(windows)
+        self.hull_stream = StreamWMA(int(round(windows ** (1 / 2))))
+        self.hull_deque = deque([np.nan, np.nan], maxlen=2)
+
+    def update(self, bar):
+        twma = (2 * self.hwma_stream.update(bar['close'])) - self.wma_stream.update(bar['close'])
+        hull = self.hull_stream.update(twma)
+        hull_prev = self.hull_deque[0]
+        self.hull_deque.append(hull)
+
+        indicator_dict = {
+            'hull': hull,
+            'hull_side': side_code_dict['buy'] if hull > hull_prev else side_code_dict['sell']
+        }
+
+        return indicator_dict
+
+
+def gen_stream_indicator(signal, signal_dict):
+    '''
+    Incremental indicator of signal with params in signal_dict, update(bar) returns the columns of the add_* function.
+    '''
+    if signal == 'sma':
+        stream_indicator = StreamSMA(signal_dict['windows'])
+    elif signal == 'ema':
+        stream_indicator = StreamEMA(signal_dict['windows'])
+    elif signal == 'tma':
+        stream_indicator = StreamTMA(signal_dict['windows'])
+    elif signal == 'bollinger':
+        stream_indicator = StreamBollinger(signal_dict['windows'], signal_dict['std'])
+    elif signal == 'rsi':
+        stream_indicator = StreamRSI(signal_dict['average_range'])
+    elif signal == 'wt':
+        stream_indicator = StreamWT(signal_dict['channel_range'], signal_dict['average_range'])
+    elif signal == 'atr':
+        stream_indicator = StreamATR(signal_dict['atr_range'])
+    elif signal == 'supertrend':
+        stream_indicator = StreamSupertrend(signal_dict['atr_range'], signal_dict['multiplier'])
+    elif signal == 'donchian':
+        stream_indicator = StreamDonchian(signal_dict['windows'])
+    elif signal == 'hull':
+        stream_indicator = StreamHull(signal_dict['windows'])
+    else:
+        raise ValueError(f"No stream indicator for {signal}.")
+
+    return stream_indicator
+
+
+def update_stream_df(stream_indicator, ohlcv_df):
+    '''
+    Feed every bar of ohlcv_df to stream_indicator, e.g. to warm up state from history before live bars.
+    Return indicator columns of each bar.
+    '''
+    indicator_list = [stream_indicator.update(bar) for bar in ohlcv_df[['open', 'high', 'low', 'close']].to_dict('records')]
+    indicator_df = pd.DataFrame(indicator_list, index=ohlcv_df.index)
+
+    return indicator_df
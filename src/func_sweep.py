@@ -0,0 +1,327 @@
+import numpy as np
+import pandas as pd
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+import functools
+import itertools
+import copy
+import os
+
+import func_signal
+import func_backtest
+import func_cache
+from func_cache import ohlcv_column_list
+
+
+# Shared ohlcv attached once per worker process
+worker_dict = {}
+
+
+def gen_grid_param_list(param_dict):
+    '''
+    All combinations of param 'value' lists.
+    param_dict = {name: {'path': [path tuple in config_params, ...], 'value': [...]}}
+    '''
+    name_list = list(param_dict)
+    value_product = itertools.product(*[param_dict[name]['value'] for name in name_list])
+    param_list = [dict(zip(name_list, value_tuple)) for value_tuple in value_product]
+
+    return param_list
+
+
+def get_param_sample_value(param_dict, name, unit):
+    '''
+    Map unit value in [0, 1) to param 'value' list or 'range' [low, high].
+    '''
+    if 'value' in param_dict[name]:
+        value_list = param_dict[name]['value']
+        value = value_list[min(int(unit * len(value_list)), len(value_list) - 1)]
+    else:
+        low, high = param_dict[name]['range']
+        value = float(low + unit * (high - low))
+
+        if isinstance(low, int) & isinstance(high, int):
+            value = int(round(value))
+
+    return value
+
+
+def gen_random_param_list(param_dict, sample_count, seed=None):
+    random_state = np.random.RandomState(seed)
+    unit_array = random_state.random_sample((sample_count, len(param_dict)))
+    param_list = [{name: get_param_sample_value(param_dict, name, unit_array[i, j]) for j, name in enumerate(param_dict)} for i in range(sample_count)]
+
+    return param_list
+
+
+def gen_latin_hypercube_param_list(param_dict, sample_count, seed=None):
+    '''
+    Each param range is split to sample_count strata and every stratum is sampled once.
+    '''
+    random_state = np.random.RandomState(seed)
+    unit_array = np.empty((sample_count, len(param_dict)))
+
+    for j in range(len(param_dict)):
+        strata_array = random_state.permutation(sample_count)
+        unit_array[:, j] = (strata_array + random_state.random_sample(sample_count)) / sample_count
+
+    param_list = [{name: get_param_sample_value(param_dict, name, unit_array[i, j]) for j, name in enumerate(param_dict)} for i in range(sample_count)]
+
+    return param_list
+
+
+def set_config_params(config_params, param_dict, param_value_dict):
+    sweep_config_params = copy.deepcopy(config_params)
+
+    for name in param_value_dict:
+        for path in param_dict[name]['path']:
+            target_dict = sweep_config_params
+            for key in path[:-1]:
+                target_dict = target_dict[key]
+
+            target_dict[path[-1]] = param_value_dict[name]
+
+    return sweep_config_params
+
+
+def gen_shared_ohlcv(ohlcv_df_dict):
+    '''
+    Copy raw ohlcv columns of all series to one shared memory block, time as epoch ms.
+    Return shared memory and picklable meta to attach from workers.
+    '''
+    series_list = []
+    row_count = 0
+
+    for symbol_type in ohlcv_df_dict:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
+                column_list = [x for x in ohlcv_column_list if x in ohlcv_df.columns]
+                series_list.append((symbol_type, timeframe, symbol, row_count, len(ohlcv_df), column_list))
+                row_count += len(ohlcv_df)
+
+    shared_ohlcv = shared_memory.SharedMemory(create=True, size=max(row_count * len(ohlcv_column_list) * 8, 1))
+    shared_array = np.ndarray((row_count, len(ohlcv_column_list)), dtype=np.float64, buffer=shared_ohlcv.buf)
+
+    for symbol_type, timeframe, symbol, start_row, length, column_list in series_list:
+        ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
+
+        for i, column in enumerate(column_list):
+            if column == 'time':
+                shared_array[start_row:start_row + length, i] = ohlcv_df['time'].values.astype('datetime64[ms]').astype(np.int64)
+            else:
+                shared_array[start_row:start_row + length, i] = ohlcv_df[column].to_numpy(dtype=np.float64)
+
+    shared_meta = {
+        'name': shared_ohlcv.name,
+        'timeframe_dict': {symbol_type: list(ohlcv_df_dict[symbol_type]) for symbol_type in ohlcv_df_dict},
+        'shape': (row_count, len(ohlcv_column_list)),
+        'series_list': series_list
+    }
+
+    return shared_ohlcv, shared_meta
+
+
+def gen_shared_ohlcv_df_dict(shared_array, shared_meta):
+    ohlcv_df_dict = {symbol_type: {timeframe: {} for timeframe in shared_meta['timeframe_dict'][symbol_type]} for symbol_type in shared_meta['timeframe_dict']}
+
+    for symbol_type, timeframe, symbol, start_row, length, column_list in shared_meta['series_list']:
+        ohlcv_df = pd.DataFrame(shared_array[start_row:start_row + length, :len(column_list)], columns=column_list)
+        ohlcv_df['time'] = pd.to_datetime(ohlcv_df['time'].astype(np.int64), unit='ms')
+
+        ohlcv_df_dict[symbol_type][timeframe][symbol] = ohlcv_df
+
+    return ohlcv_df_dict
+
+
+def init_sweep_worker(shared_meta, indicator_cache_params):
+    '''
+    Attach shared ohlcv of gen_shared_ohlcv, closed by close_sweep_worker when the worker exits.
+    '''
+    func_cache.set_indicator_cache(**indicator_cache_params)
+    shared_ohlcv = shared_memory.SharedMemory(name=shared_meta['name'])
+
+    worker_dict['shared_ohlcv'] = shared_ohlcv
+    worker_dict['shared_array'] = np.ndarray(shared_meta['shape'], dtype=np.float64, buffer=shared_ohlcv.buf)
+    worker_dict['shared_meta'] = shared_meta
+
+    # Pool workers exit without atexit, multiprocessing finalizers still run
+    util.Finalize(None, close_sweep_worker, exitpriority=10)
+
+
+def close_sweep_worker():
+    # Array on the buffer must be released before close
+    worker_dict.pop('shared_array', None)
+    worker_dict.pop('shared_meta', None)
+    shared_ohlcv = worker_dict.pop('shared_ohlcv', None)
+
+    if shared_ohlcv != None:
+        shared_ohlcv.close()
+
+
+def run_sweep_backtest(start_date, budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict):
+    ohlcv_df_dict = func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, config_params)
+    final_budget, max_drawdown, transaction_dict, _ = func_backtest.run_backtest(budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict, vectorize_flag=True)
+
+    result_dict = func_backtest.get_backtest_result(budget, final_budget, max_drawdown, transaction_dict)
+
+    return result_dict
+
+
+def run_sweep_task(task_func, config_params):
+    ohlcv_df_dict = gen_shared_ohlcv_df_dict(worker_dict['shared_array'], worker_dict['shared_meta'])
+    result = task_func(config_params, ohlcv_df_dict)
+
+    return result
+
+
+def get_raw_ohlcv_df_dict(ohlcv_df_dict):
+    raw_df_dict = {symbol_type: {timeframe: {symbol: ohlcv_df_dict[symbol_type][timeframe][symbol][[x for x in ohlcv_column_list if x in ohlcv_df_dict[symbol_type][timeframe][symbol].columns]].copy() for symbol in ohlcv_df_dict[symbol_type][timeframe]} for timeframe in ohlcv_df_dict[symbol_type]} for symbol_type in ohlcv_df_dict}
+
+    return raw_df_dict
+
+
+def run_task_list(task_func, config_params_list, ohlcv_df_dict, max_workers=None):
+    '''
+    Return task_func(config_params, ohlcv_df_dict) of each config_params.
+    Tasks run in worker processes sharing raw ohlcv of ohlcv_df_dict, or in this process if max_workers is 1.
+    '''
+    if max_workers == 1:
+        result_list = [task_func(config_params, get_raw_ohlcv_df_dict(ohlcv_df_dict)) for config_params in config_params_list]
+    else:
+        shared_ohlcv, shared_meta = gen_shared_ohlcv(ohlcv_df_dict)
+
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers if max_workers != None else os.cpu_count(), initializer=init_sweep_worker, initargs=(shared_meta, dict(func_cache.indicator_cache_params))) as executor:
+                future_list = [executor.submit(run_sweep_task, task_func, config_params) for config_params in config_params_list]
+                result_list = [future.result() for future in future_list]
+        finally:
+            shared_ohlcv.close()
+            shared_ohlcv.unlink()
+
+    return result_list
+
+
+def run_sweep(start_date, budget, reinvest_profit_flag, config_params, param_dict, param_list, ohlcv_df_dict, interval_dict, max_workers=None):
+    '''
+    Backtest config_params with every param value dict in param_list (see gen_*_param_list).
+    ohlcv_df_dict from get_data is shared to worker processes through shared memory, indicators are added in each run
+    and reused between runs with the same indicator params through the indicator cache (see func_cache.set_indicator_cache).
+    Return result of each run with its params.
+    '''
+    config_params_list = [set_config_params(config_params, param_dict, param_value_dict) for param_value_dict in param_list]
+    task_func = functools.partial(run_sweep_backtest, start_date, budget, reinvest_profit_flag, interval_dict=interval_dict)
+    result_list = run_task_list(task_func, config_params_list, ohlcv_df_dict, max_workers)
+
+    result_df = pd.concat([pd.DataFrame(param_list), pd.DataFrame(result_list)], axis=1)
+
+    return result_df
+
+
+def gen_walk_forward_window_list(start_date, end_date, train_day, test_day, step_day=None, anchor_flag=False):
+    '''
+    Train window followed by test window, moved by step_day (test_day if None) until end_date. Windows are [start, end).
+    If anchor_flag, every train window starts at start_date.
+    '''
+    step_day = test_day if step_day == None else step_day
+    window_list = []
+    i = 0
+
+    while True:
+        train_end = start_date + dt.timedelta(days=train_day + i * step_day)
+        test_end = train_end + dt.timedelta(days=test_day)
+
+        if test_end > end_date:
+            break
+
+        window_dict = {
+            'train_start': start_date if anchor_flag else train_end - dt.timedelta(days=train_day),
+            'train_end': train_end,
+            'test_start': train_end,
+            'test_end': test_end
+        }
+        window_list.append(window_dict)
+        i += 1
+
+    return window_list
+
+
+def slice_ohlcv_df_dict(start_date, end_date, config_params, ohlcv_df_dict, interval_dict):
+    '''
+    Limit action time of ohlcv_df_dict to [start_date, end_date), first row is kept for signal check.
+    Other timeframes are only read as of action time so they are not sliced.
+    '''
+    action_timeframe = config_params['action_timeframe']
+    first_signal_time = start_date - dt.timedelta(minutes=interval_dict[action_timeframe])
+    window_df_dict = {symbol_type: dict(ohlcv_df_dict[symbol_type]) for symbol_type in ohlcv_df_dict}
+    window_df_dict['base'][action_timeframe] = {}
+
+    for symbol in ohlcv_df_dict['base'][action_timeframe]:
+        ohlcv_df = ohlcv_df_dict['base'][action_timeframe][symbol]
+        window_df_dict['base'][action_timeframe][symbol] = ohlcv_df[(ohlcv_df['time'] >= first_signal_time) & (ohlcv_df['time'] < end_date)].reset_index(drop=True)
+
+    return window_df_dict
+
+
+def run_walk_forward_backtest(window_list, budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict):
+    '''
+    Add signal once from the first window, then backtest train and test of every window on its slice.
+    '''
+    window_result_list = []
+
+    ohlcv_df_dict = func_signal.add_signal(window_list[0]['train_start'], ohlcv_df_dict, interval_dict, config_params)
+
+    for window_dict in window_list:
+        window_result_dict = {}
+
+        for key in ['train', 'test']:
+            window_df_dict = slice_ohlcv_df_dict(window_dict[f'{key}_start'], window_dict[f'{key}_end'], config_params, ohlcv_df_dict, interval_dict)
+            final_budget, max_drawdown, transaction_dict, budget_dict = func_backtest.run_backtest(budget, reinvest_profit_flag, config_params, window_df_dict, interval_dict, vectorize_flag=True)
+
+            window_result_dict[key] = func_backtest.get_backtest_result(budget, final_budget, max_drawdown, transaction_dict)
+
+        # Last budget includes the clear of open position at the end of test window, so stitched windows are continuous
+        test_budget_array = np.array(budget_dict['budget'], dtype=np.float64)
+        test_budget_array[-1:] = final_budget
+        window_result_dict['test_budget'] = pd.Series(test_budget_array, index=pd.DatetimeIndex(budget_dict['time']))
+        window_result_list.append(window_result_dict)
+
+    return window_result_list
+
+
+def run_walk_forward(budget, reinvest_profit_flag, config_params, param_dict, param_list, window_list, ohlcv_df_dict, interval_dict, metric='return_percent', max_workers=None):
+    '''
+    Pick params of param_list with the highest metric on each train window of window_list (see gen_walk_forward_window_list)
+    and evaluate them on the following test window.
+    Each params run in its own task with signals added once for all windows, tasks run in parallel as in run_sweep.
+    Return result of each window with its params, and out of sample budget stitched over test windows.
+    '''
+    config_params_list = [set_config_params(config_params, param_dict, param_value_dict) for param_value_dict in param_list]
+    task_func = functools.partial(run_walk_forward_backtest, window_list, budget, reinvest_profit_flag, interval_dict=interval_dict)
+    param_result_list = run_task_list(task_func, config_params_list, ohlcv_df_dict, max_workers)
+
+    window_result_list = []
+    budget_series_list = []
+    current_budget = budget
+
+    for i, window_dict in enumerate(window_list):
+        metric_array = np.array([param_result_list[j][i]['train'][metric] for j in range(len(param_list))], dtype=np.float64)
+        best_index = int(np.nanargmax(metric_array)) if not np.isnan(metric_array).all() else 0
+        best_result_dict = param_result_list[best_index][i]
+
+        window_result_list.append({
+            **window_dict,
+            **param_list[best_index],
+            **{f'train_{x}': best_result_dict['train'][x] for x in best_result_dict['train']},
+            **{f'test_{x}': best_result_dict['test'][x] for x in best_result_dict['test']}
+        })
+
+        # Each test window continues from the budget at the end of the previous one
+        budget_series_list.append(best_result_dict['test_budget'] * (current_budget / budget))
+        current_budget = current_budget * best_result_dict['test']['final_budget'] / budget
+
+    window_result_df = pd.DataFrame(window_result_list)
+    budget_series = pd.concat(budget_series_list) if len(budget_series_list) > 0 else pd.Series(dtype=np.float64)
+
+    return window_result_df, budget_series
@@ -0,0 +1,6 @@
+import sys
+import os
+
+
+# Modules in src import each other by name, as in the notebooks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,449 @@
+import numpy as np
+import pandas as pd
+import datetime as dt
+import copy
+import pytest
+
+import func_bench
+import func_get
+import func_signal
+import func_backtest
+from func_signal import side_code_dict
+
+
+interval_dict = func_bench.bench_interval_dict
+
+
+def get_lead_config():
+    config_params = copy.deepcopy(func_bench.bench_config_dict['cryptoris'])
+    config_params['safety_ohlcv_range'] = 50
+
+    return config_params
+
+
+def get_short_lead_df_dict(config_params, bar_count=4000):
+    '''
+    Signal added ohlcv_df_dict whose lead series starts in the middle of the action frame.
+    '''
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, bar_count)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+
+    for timeframe in ohlcv_df_dict['lead']:
+        for symbol in ohlcv_df_dict['lead'][timeframe]:
+            lead_df = ohlcv_df_dict['lead'][timeframe][symbol]
+            ohlcv_df_dict['lead'][timeframe][symbol] = lead_df.iloc[len(lead_df) // 2:].reset_index(drop=True)
+
+    ohlcv_df_dict = func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, copy.deepcopy(config_params))
+
+    return ohlcv_df_dict
+
+
+def get_lead_start_ns(config_params, ohlcv_df_dict):
+    lead_start_list = [ohlcv_df_dict['lead'][timeframe][symbol]['time'].values.astype('datetime64[ns]').astype(np.int64)[0] for timeframe in ohlcv_df_dict['lead'] for symbol in ohlcv_df_dict['lead'][timeframe]]
+
+    return max(lead_start_list)
+
+
+def test_action_array_before_lead_data():
+    config_params = get_lead_config()
+    ohlcv_df_dict = get_short_lead_df_dict(config_params)
+    backtest_dict = func_backtest.gen_backtest_dict(ohlcv_df_dict)
+    lead_start_ns = get_lead_start_ns(config_params, ohlcv_df_dict)
+
+    symbol = config_params['base']['symbol'][0]
+    action_time_array = backtest_dict['base'][config_params['action_timeframe']][symbol]['time'][1:]
+    early_time_array = action_time_array[action_time_array < lead_start_ns]
+    assert len(early_time_array) > 0
+
+    # Lead open has one check, appended after base checks
+    for signal_time in early_time_array[::50]:
+        action_list = func_backtest.get_action_array(symbol, 'open', [], signal_time, config_params, backtest_dict)
+        assert action_list[-1] == side_code_dict['no_action']
+
+    action_list = func_backtest.get_action_array(symbol, 'open', [], action_time_array[-1], config_params, backtest_dict)
+    assert action_list[-1] in [side_code_dict['buy'], side_code_dict['sell']]
+
+
+def test_no_open_before_lead_data():
+    config_params = get_lead_config()
+    ohlcv_df_dict = get_short_lead_df_dict(config_params)
+    lead_start_ns = get_lead_start_ns(config_params, ohlcv_df_dict)
+
+    for backtest_func in [func_backtest.run_backtest, func_backtest.run_portfolio_backtest]:
+        _, _, transaction_dict, _ = backtest_func(100, True, config_params, ohlcv_df_dict, interval_dict)
+        open_time_array = np.array([x.value for x in transaction_dict['open_time']], dtype=np.int64)
+
+        assert len(open_time_array) > 0
+        assert (open_time_array >= lead_start_ns).all()
+
+
+def get_portfolio_config(symbol_list, action_percent):
+    config_params = copy.deepcopy(func_bench.bench_config_dict['messi'])
+    config_params['base']['symbol'] = symbol_list
+    config_params['action_percent'] = action_percent
+
+    return config_params
+
+
+def get_portfolio_df_dict(config_params, bar_count=3000):
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, bar_count)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+
+    # Fixed rank per symbol, reverse of config order
+    for i, symbol in enumerate(config_params['base']['symbol']):
+        ohlcv_df = ohlcv_df_dict['base'][config_params['action_timeframe']][symbol]
+        ohlcv_df_dict['base'][config_params['action_timeframe']][symbol] = ohlcv_df.assign(rank=float(i))
+
+    ohlcv_df_dict = func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, copy.deepcopy(config_params))
+
+    return ohlcv_df_dict
+
+
+def get_open_count_list(transaction_dict):
+    '''
+    Number of positions held right after each open.
+    '''
+    open_count_list = []
+
+    for open_time in transaction_dict['open_time']:
+        open_count = sum((x <= open_time) & (open_time < y) for x, y in zip(transaction_dict['open_time'], transaction_dict['close_time']))
+        open_count_list.append(open_count)
+
+    return open_count_list
+
+
+def test_portfolio_same_as_backtest_within_slot():
+    config_params = get_portfolio_config(['BTC-PERP', 'ETH-PERP'], 50)
+    ohlcv_df_dict = get_portfolio_df_dict(config_params)
+
+    budget, _, transaction_dict, _ = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+    portfolio_budget, _, portfolio_transaction_dict, _ = func_backtest.run_portfolio_backtest(100, True, config_params, ohlcv_df_dict, interval_dict, margin_flag=False)
+
+    assert len(transaction_dict['symbol']) > 0
+    assert np.isclose(portfolio_budget, budget)
+    assert sorted(zip(portfolio_transaction_dict['open_time'], portfolio_transaction_dict['symbol'])) == sorted(zip(transaction_dict['open_time'], transaction_dict['symbol']))
+
+
+def test_portfolio_rank_column():
+    symbol_list = ['BTC-PERP', 'ETH-PERP', 'SOL-PERP', 'XRP-PERP']
+    config_params = get_portfolio_config(symbol_list, 100)
+    ohlcv_df_dict = get_portfolio_df_dict(config_params)
+
+    backtest_dict = func_backtest.gen_backtest_dict(ohlcv_df_dict)
+    action_time_array = backtest_dict['base'][config_params['action_timeframe']][symbol_list[0]]['time'][1:]
+    backtest_dict = func_backtest.add_align_index(action_time_array, backtest_dict)
+    backtest_dict = func_backtest.add_lead_consensus(action_time_array, config_params, backtest_dict)
+    max_open_timeframe = func_backtest.get_max_open_timeframe(config_params, interval_dict)
+    open_code_matrix = func_backtest.get_open_code_matrix(action_time_array, max_open_timeframe, config_params, backtest_dict)
+
+    for rank_column in [None, 'rank']:
+        _, _, transaction_dict, _ = func_backtest.run_portfolio_backtest(100, True, config_params, ohlcv_df_dict, interval_dict, rank_column=rank_column, margin_flag=False)
+        assert len(transaction_dict['symbol']) > 0
+        assert max(get_open_count_list(transaction_dict)) == 1
+
+        # One slot, so every open takes the slot from all symbols signalling at its signal time
+        for open_time, symbol in zip(transaction_dict['open_time'], transaction_dict['symbol']):
+            signal_time = open_time - dt.timedelta(minutes=interval_dict[config_params['action_timeframe']])
+            i = np.searchsorted(action_time_array, signal_time.value)
+            assert action_time_array[i] == signal_time.value
+
+            signal_index_array = np.flatnonzero(open_code_matrix[i])
+            expect_index = signal_index_array[-1] if rank_column == 'rank' else signal_index_array[0]
+            assert symbol == symbol_list[expect_index]
+
+    # Some opens must be decided by rank for the test to discriminate
+    assert (np.count_nonzero(open_code_matrix, axis=1) > 1).any()
+
+
+def test_portfolio_margin():
+    symbol_list = ['BTC-PERP', 'ETH-PERP', 'SOL-PERP', 'XRP-PERP']
+    config_params = get_portfolio_config(symbol_list, 50)
+    ohlcv_df_dict = get_portfolio_df_dict(config_params)
+
+    # Four slots, but margin of 50 percent positions only fits two
+    _, _, transaction_dict, _ = func_backtest.run_portfolio_backtest(100, True, config_params, ohlcv_df_dict, interval_dict, max_position=4)
+    assert len(transaction_dict['symbol']) > 0
+    assert max(get_open_count_list(transaction_dict)) == 2
+
+    _, _, transaction_dict, _ = func_backtest.run_portfolio_backtest(100, True, config_params, ohlcv_df_dict, interval_dict, max_position=4, margin_flag=False)
+    assert max(get_open_count_list(transaction_dict)) > 2
+
+
+def check_same_result(result, other_result):
+    budget, max_drawdown, transaction_dict, budget_dict = result
+    other_budget, other_max_drawdown, other_transaction_dict, other_budget_dict = other_result
+
+    assert np.isclose(budget, other_budget)
+    assert np.isclose(max_drawdown, other_max_drawdown)
+    # Time unit follows the source frame in pandas >= 2
+    pd.testing.assert_frame_equal(pd.DataFrame(transaction_dict), pd.DataFrame(other_transaction_dict), check_dtype=False)
+    pd.testing.assert_frame_equal(pd.DataFrame(budget_dict), pd.DataFrame(other_budget_dict), check_dtype=False)
+
+
+def get_vectorize_config(config_name, stop_flag, intrabar_timeframe=None):
+    config_params = copy.deepcopy(func_bench.bench_config_dict[config_name])
+
+    if stop_flag:
+        config_params['tp']['price_percent'] = 2
+        config_params['sl']['price_percent'] = 1
+
+    if intrabar_timeframe != None:
+        config_params['intrabar_timeframe'] = intrabar_timeframe
+
+    return config_params
+
+
+def get_signal_df_dict(config_params, bar_count=3000):
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, bar_count)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+    ohlcv_df_dict = func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, copy.deepcopy(config_params))
+
+    return ohlcv_df_dict
+
+
+@pytest.mark.parametrize('config_name, stop_flag, intrabar_timeframe', [
+    ('messi', False, None),
+    ('messi', True, None),
+    ('cross', False, None),
+    ('cross', True, None),
+    ('messi', True, '15m')
+])
+def test_vectorized_same_as_backtest(config_name, stop_flag, intrabar_timeframe):
+    config_params = get_vectorize_config(config_name, stop_flag, intrabar_timeframe)
+    ohlcv_df_dict = get_signal_df_dict(config_params)
+    assert func_backtest.get_vectorize_flag(config_params)
+
+    result = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+    vectorized_result = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict, vectorize_flag=True)
+
+    assert len(result[2]['symbol']) > 0
+    check_same_result(result, vectorized_result)
+
+    if stop_flag:
+        close_price_array = np.array(result[2]['close_price'])
+        stop_price_array = np.concatenate([np.array(result[2]['open_price']) * (1 + x / 100) for x in [-2, -1, 1, 2]])
+        assert np.isin(close_price_array, stop_price_array).any()
+
+
+def test_vectorize_flag_fall_back(monkeypatch):
+    config_params = copy.deepcopy(func_bench.bench_config_dict['cryptoris'])
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = get_signal_df_dict(config_params)
+    assert not func_backtest.get_vectorize_flag(config_params)
+
+    result = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+
+    def raise_vectorized(*args, **kwargs):
+        raise AssertionError("run_vectorized_backtest is called")
+
+    monkeypatch.setattr(func_backtest, 'run_vectorized_backtest', raise_vectorized)
+    check_same_result(result, func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict, vectorize_flag=True))
+
+
+def run_backtest_loop(budget, reinvest_profit_flag, config_params, ohlcv_df_dict, interval_dict):
+    '''
+    Notebook loop of close_position and open_position over gen_action_time_list, replaced by run_backtest.
+    '''
+    action_time_list = func_get.gen_action_time_list(config_params, ohlcv_df_dict)
+    max_open_timeframe = func_backtest.get_max_open_timeframe(config_params, interval_dict)
+    max_position = int(1 / (config_params['action_percent'] / 100))
+
+    transaction_dict = func_backtest.gen_transaction_dict()
+    budget_dict = {
+        'time': [],
+        'budget': []
+    }
+    position_dict = {}
+    max_drawdown = 0
+
+    for signal_time in action_time_list:
+        for symbol in list(position_dict):
+            budget, max_drawdown, position_dict, transaction_dict = func_backtest.close_position(symbol, signal_time, max_drawdown, config_params, budget, reinvest_profit_flag, ohlcv_df_dict, position_dict, transaction_dict, interval_dict)
+
+        for symbol in [x for x in config_params['base']['symbol'] if x not in position_dict][:max_position]:
+            position_dict = func_backtest.open_position(symbol, signal_time, max_open_timeframe, config_params, budget, ohlcv_df_dict, position_dict, interval_dict)
+
+        budget_dict['time'].append(signal_time)
+        budget_dict['budget'].append(budget)
+
+        if budget <= 0:
+            break
+
+    for symbol in list(position_dict):
+        ohlcv_df = ohlcv_df_dict['base'][config_params['action_timeframe']][symbol]
+        close_price = float(ohlcv_df.loc[ohlcv_df['time'] == signal_time, 'close'].iloc[0])
+        budget, position_dict, transaction_dict = func_backtest.update_close_position(symbol, position_dict[symbol]['side'], close_price, 100, signal_time, config_params, budget, reinvest_profit_flag, position_dict, transaction_dict, interval_dict)
+
+    return budget, max_drawdown, transaction_dict, budget_dict
+
+
+@pytest.mark.parametrize('config_name, bar_count', [('messi', 2000), ('cryptoris', 2000)])
+def test_backtest_same_as_loop(config_name, bar_count):
+    config_params = get_vectorize_config(config_name, True)
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = get_signal_df_dict(config_params, bar_count)
+
+    result = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+    loop_result = run_backtest_loop(100, True, config_params, ohlcv_df_dict, interval_dict)
+
+    assert len(result[2]['symbol']) > 0
+    check_same_result(result, loop_result)
+
+
+def test_current_bar_missing():
+    config_params = get_vectorize_config('cryptoris', True)
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = get_signal_df_dict(config_params)
+
+    # Second symbol misses one bar and ends 200 bars early
+    action_timeframe = config_params['action_timeframe']
+    symbol = config_params['base']['symbol'][1]
+    ohlcv_df = ohlcv_df_dict['base'][action_timeframe][symbol]
+    missing_time = ohlcv_df['time'].iloc[500]
+    ohlcv_df_dict['base'][action_timeframe][symbol] = ohlcv_df.drop(index=[500]).iloc[:-200].reset_index(drop=True)
+    last_time = ohlcv_df_dict['base'][action_timeframe][symbol]['time'].iloc[-1]
+
+    backtest_dict = func_backtest.gen_backtest_dict(ohlcv_df_dict)
+    time_array = backtest_dict['base'][action_timeframe][config_params['base']['symbol'][0]]['time']
+    missing_ns = missing_time.value
+    assert func_backtest.get_current_bar(symbol, missing_ns, config_params, backtest_dict) == None
+    assert func_backtest.get_current_bar(symbol, time_array[-1], config_params, backtest_dict) == None
+    assert func_backtest.get_current_bar(symbol, time_array[1], config_params, backtest_dict) != None
+
+    _, _, transaction_dict, _ = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+    transaction_df = pd.DataFrame(transaction_dict)
+    symbol_df = transaction_df[transaction_df['symbol'] == symbol]
+    action_delta = dt.timedelta(minutes=interval_dict[action_timeframe])
+
+    assert len(symbol_df) > 0
+    assert (symbol_df['open_time'] != missing_time + action_delta).all()
+    assert (symbol_df['close_time'] != missing_time + action_delta).all()
+    assert (symbol_df['open_time'] <= last_time + action_delta).all()
+
+
+def get_intrabar_case(side, sl_first_flag):
+    '''
+    Action bar touching tp 102 and sl 98 of a position opened at 100, with 3 intrabar bars.
+    '''
+    position_dict = {'BTC-PERP': {'side': side, 'open_price': 100, 'tp': 102, 'sl': 98, 'stop_count': 0}}
+
+    if side == side_code_dict['sell']:
+        position_dict['BTC-PERP'].update({'tp': 98, 'sl': 102})
+
+    # Buy hits upper price first when tp is first, sell hits lower price first
+    upper_first_flag = (side == side_code_dict['buy']) != sl_first_flag
+    if upper_first_flag:
+        high_array = np.array([101, 102.5, 101])
+        low_array = np.array([99.5, 99, 97.5])
+    else:
+        high_array = np.array([101, 101, 102.5])
+        low_array = np.array([99.5, 97.5, 99])
+
+    current_bar = {'open': 100, 'high': 102.5, 'low': 97.5, 'close': 100}
+    current_bar = func_backtest.add_intrabar(current_bar, 0, 3, high_array, low_array)
+
+    return position_dict, current_bar
+
+
+@pytest.mark.parametrize('side', [side_code_dict['buy'], side_code_dict['sell']])
+@pytest.mark.parametrize('sl_first_flag', [False, True])
+def test_intrabar_tp_sl_order(side, sl_first_flag):
+    config_params = get_vectorize_config('messi', True)
+    position_dict, current_bar = get_intrabar_case(side, sl_first_flag)
+    tp_price = position_dict['BTC-PERP']['tp']
+    sl_price = position_dict['BTC-PERP']['sl']
+
+    assert func_backtest.get_sl_first_flag(side, tp_price, sl_price, current_bar['intrabar_high'], current_bar['intrabar_low']) == sl_first_flag
+    assert func_backtest.get_intrabar_sl_flag('BTC-PERP', side, current_bar, position_dict) == sl_first_flag
+
+    close_position_flag, close_price, _ = func_backtest.get_stop_close_flag('BTC-PERP', side, config_params, current_bar, position_dict)
+    assert close_position_flag
+    assert close_price == (sl_price if sl_first_flag else tp_price)
+
+    # Without intrabar bars tp is checked first
+    current_bar = {x: current_bar[x] for x in ['open', 'high', 'low', 'close']}
+    assert not func_backtest.get_intrabar_sl_flag('BTC-PERP', side, current_bar, position_dict)
+    assert func_backtest.get_stop_close_flag('BTC-PERP', side, config_params, current_bar, position_dict)[1] == tp_price
+
+
+def test_intrabar_same_bar_sl_first():
+    high_array = np.array([101, 102.5])
+    low_array = np.array([99.5, 97.5])
+
+    assert func_backtest.get_sl_first_flag(side_code_dict['buy'], 102, 98, high_array, low_array)
+    assert not func_backtest.get_sl_first_flag(side_code_dict['buy'], 102, 98, high_array[:1], low_array[:1])
+
+
+@pytest.mark.parametrize('config_name', ['messi', 'cryptoris'])
+def test_compact_backtest_close_to_float64(config_name):
+    config_params = copy.deepcopy(func_bench.bench_config_dict[config_name])
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, 3000)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+
+    compact_df_dict = func_get.compact_ohlcv_df_dict(copy.deepcopy(ohlcv_df_dict))
+    ohlcv_df_dict = func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, copy.deepcopy(config_params))
+    compact_df_dict = func_signal.add_signal(start_date, compact_df_dict, interval_dict, copy.deepcopy(config_params))
+
+    budget, max_drawdown, transaction_dict, _ = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+    compact_budget, compact_max_drawdown, compact_transaction_dict, _ = func_backtest.run_backtest(100, True, config_params, compact_df_dict, interval_dict)
+
+    assert len(transaction_dict['symbol']) > 0
+    assert compact_transaction_dict['open_time'] == transaction_dict['open_time']
+    assert compact_transaction_dict['close_time'] == transaction_dict['close_time']
+    np.testing.assert_allclose(compact_transaction_dict['open_price'], transaction_dict['open_price'], rtol=1e-6)
+    np.testing.assert_allclose([compact_budget, compact_max_drawdown], [budget, max_drawdown], rtol=1e-5)
+
+
+def get_consensus_config(multi_lead_flag):
+    config_params = get_lead_config()
+
+    if multi_lead_flag:
+        config_params['lead']['symbol'] = ['SOL-PERP', 'ADA-PERP']
+        config_params['lead']['open']['1h'] = {'tma': {'check': ['check_signal_side'], 'look_back': 1, 'windows': 20, 'revert': False}}
+        config_params['lead']['close']['4h'] = copy.deepcopy(config_params['lead']['open']['4h'])
+
+    return config_params
+
+
+def get_decision_list(symbol, signal_time, config_params, backtest_dict):
+    '''
+    Open side (None if not open) and close flag of each side at signal_time, as decided in open_position_array and close_position_array.
+    '''
+    target_code_list = func_backtest.get_target_code_list(config_params)
+    action_list = func_backtest.get_action_array(symbol, 'open', [], signal_time, config_params, backtest_dict)
+    open_side = action_list[0] if (len(set(action_list)) == 1) & (action_list[0] in target_code_list) else None
+    decision_list = [open_side]
+
+    for side in target_code_list:
+        action_list = func_backtest.get_action_array(symbol, 'close', [side], signal_time, config_params, backtest_dict)
+        decision_list.append((len(set(action_list)) != 1) | (action_list[0] != side))
+
+    return decision_list
+
+
+@pytest.mark.parametrize('multi_lead_flag', [False, True])
+def test_lead_consensus_same_as_per_symbol(monkeypatch, multi_lead_flag):
+    config_params = get_consensus_config(multi_lead_flag)
+    ohlcv_df_dict = get_signal_df_dict(config_params, 2000)
+
+    backtest_dict = func_backtest.gen_backtest_dict(ohlcv_df_dict)
+    action_time_array = backtest_dict['base'][config_params['action_timeframe']][config_params['base']['symbol'][0]]['time'][1:]
+    backtest_dict = func_backtest.add_align_index(action_time_array, backtest_dict)
+    consensus_dict = func_backtest.add_lead_consensus(action_time_array, config_params, dict(backtest_dict))
+    assert 'open' in consensus_dict['lead_consensus']
+    assert ('close' in consensus_dict['lead_consensus']) == multi_lead_flag
+
+    open_count = 0
+
+    for symbol in config_params['base']['symbol']:
+        for signal_time in action_time_array:
+            decision_list = get_decision_list(symbol, signal_time, config_params, consensus_dict)
+            assert decision_list == get_decision_list(symbol, signal_time, config_params, backtest_dict)
+            open_count += decision_list[0] != None
+
+    assert open_count > 0
+
+    result = func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+    monkeypatch.setattr(func_backtest, 'add_lead_consensus', lambda action_time_array, config_params, backtest_dict: backtest_dict)
+    check_same_result(result, func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict))
@@ -0,0 +1,22 @@
+import logging
+import pytest
+
+import func_backtest
+import func_bench
+
+
+def test_bench_backtest_skip_empty_after_warm_up(caplog):
+    # cryptoris warms up 200 4h candles, more than 3000 15m candles
+    with caplog.at_level(logging.WARNING, logger='func_bench'):
+        bench_result_df = func_bench.bench_backtest([3000], ['messi', 'cryptoris'], memory_flag=False)
+
+    assert not bench_result_df['case'].str.endswith('cryptoris').any()
+    assert bench_result_df['case'].tolist() == ['add_signal messi', 'backtest messi', 'vectorized messi']
+    assert any('Skip cryptoris' in x.getMessage() for x in caplog.records)
+
+
+def test_bench_backtest_raise_without_trade(monkeypatch):
+    monkeypatch.setattr(func_backtest, 'run_backtest', lambda budget, *args, **kwargs: (budget, 0, func_backtest.gen_transaction_dict(), {}))
+
+    with pytest.raises(ValueError):
+        func_bench.bench_backtest([3000], ['messi'], memory_flag=False)
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import func_bench
+import func_cache
+import func_get
+import func_signal
+
+
+@pytest.fixture
+def indicator_cache():
+    indicator_cache_params = dict(func_cache.indicator_cache_params)
+    func_cache.clear_indicator_cache()
+
+    yield func_cache
+
+    func_cache.indicator_cache_params.update(indicator_cache_params)
+    func_cache.clear_indicator_cache()
+
+
+def add_tma(ohlcv_df, windows_list):
+    func_add_dict = func_signal.get_func_add_dict()
+
+    for objective, windows in zip(['open', 'close'], windows_list):
+        config_params = {'base': {objective: {'15m': {'tma': {'windows': windows}}}}}
+        ohlcv_df = func_signal.add_action_signal(objective, ohlcv_df, 'base', '15m', 'BTC-PERP', func_add_dict, config_params)
+
+    return ohlcv_df
+
+
+def test_cache_info_with_indicator_cache(tmp_path):
+    cache_dir = str(tmp_path)
+    ohlcv_array = func_bench.gen_synthetic_ohlcv_array(500, 15)
+    func_cache.write_cache(cache_dir, 'fake', 'BTC-PERP', '15m', ohlcv_array, 15 * 60 * 1000, int(ohlcv_array[-1, 0]) + 10**9)
+
+    # Indicator pickles share cache_dir with ohlcv cache
+    func_cache.clear_indicator_cache()
+    func_cache.set_indicator_cache(cache_dir=cache_dir)
+
+    try:
+        signal_dict = {'windows': 20}
+        config_params = {'base': {'open': {'15m': {'sma': signal_dict}}}}
+        ohlcv_df = func_get.gen_ohlcv_df(ohlcv_array, 'UTC')
+        func_signal.add_action_signal('open', ohlcv_df, 'base', '15m', 'BTC-PERP', func_signal.get_func_add_dict(), config_params)
+    finally:
+        func_cache.set_indicator_cache(cache_dir=None)
+        func_cache.clear_indicator_cache()
+
+    assert len(list((tmp_path / 'indicator').glob('*.pkl'))) == 1
+
+    cache_info_df = func_cache.get_cache_info(cache_dir, func_bench.bench_interval_dict)
+
+    assert cache_info_df[['exchange', 'timeframe', 'symbol']].values.tolist() == [['fake', '15m', 'BTC-PERP']]
+    assert cache_info_df.loc[0, 'candle'] == 500
+
+
+def test_indicator_params_not_collide(indicator_cache):
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(500, 15), 'UTC')
+    ohlcv_df = add_tma(ohlcv_df.copy(), [20, 50])
+
+    for windows in [20, 50]:
+        single_df = add_tma(func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(500, 15), 'UTC'), [windows])
+        np.testing.assert_array_equal(ohlcv_df[f'tma_{windows}'], func_signal.cal_tma(single_df, windows))
+        np.testing.assert_array_equal(ohlcv_df[f'tma_{windows}_side'], single_df[f'tma_{windows}_side'])
+
+    assert not np.allclose(ohlcv_df['tma_20'].iloc[100:], ohlcv_df['tma_50'].iloc[100:])
+    assert indicator_cache.get_indicator_cache_info()['indicator'] == 2
+
+
+def test_indicator_cache_lru_eviction(indicator_cache):
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(500, 15), 'UTC')
+    add_tma(ohlcv_df.copy(), [20])
+    entry_bytes = indicator_cache.indicator_cache_state['bytes']
+
+    # Room for two entries of the same size
+    indicator_cache.set_indicator_cache(max_bytes=2 * entry_bytes)
+    add_tma(ohlcv_df.copy(), [30])
+    key_20, key_30 = list(indicator_cache.indicator_cache_dict)
+
+    # Reading tma 20 makes tma 30 the least recently used
+    add_tma(ohlcv_df.copy(), [20])
+    add_tma(ohlcv_df.copy(), [40])
+
+    info_dict = indicator_cache.get_indicator_cache_info()
+    assert info_dict['indicator'] == 2
+    assert info_dict['bytes'] <= 2 * entry_bytes
+    assert info_dict['hit'] == 1
+    assert key_20 in indicator_cache.indicator_cache_dict
+    assert key_30 not in indicator_cache.indicator_cache_dict
+
+    indicator_cache.set_indicator_cache(max_bytes=0)
+    assert indicator_cache.get_indicator_cache_info()['indicator'] == 0
+    assert indicator_cache.indicator_cache_state['bytes'] == 0
+
+
+def test_indicator_cache_read_from_disk(indicator_cache, tmp_path):
+    indicator_cache.set_indicator_cache(cache_dir=str(tmp_path))
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(500, 15), 'UTC')
+    first_df = add_tma(ohlcv_df.copy(), [20, 50])
+    assert len(list((tmp_path / 'indicator').glob('*.pkl'))) == 2
+
+    # Second run in a new process has only the pickles
+    indicator_cache.clear_indicator_cache()
+    second_df = add_tma(ohlcv_df.copy(), [20, 50])
+
+    info_dict = indicator_cache.get_indicator_cache_info()
+    assert (info_dict['disk_hit'], info_dict['hit'], info_dict['miss']) == (2, 0, 0)
+    pd.testing.assert_frame_equal(first_df, second_df)
+
+
+def test_ohlcv_panel_round_trip(tmp_path):
+    panel_dir = str(tmp_path)
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(500, 15), 'UTC')
+    ohlcv_df_dict = {
+        'base': {
+            '15m': {
+                'BTC-PERP': ohlcv_df,
+                'ETH-PERP': ohlcv_df.iloc[100:400].reset_index(drop=True),
+                'SOL-PERP': ohlcv_df.drop(index=range(200, 210)).reset_index(drop=True)
+            }
+        },
+        'lead': {}
+    }
+
+    func_cache.write_ohlcv_panel(panel_dir, ohlcv_df_dict)
+    panel_df_dict = func_cache.read_ohlcv_panel(panel_dir)
+
+    for symbol in ohlcv_df_dict['base']['15m']:
+        panel_df = panel_df_dict['base']['15m'][symbol]
+        pd.testing.assert_frame_equal(panel_df, ohlcv_df_dict['base']['15m'][symbol])
+
+    # Symbols without missing candles inside their range are read-only views of the panel
+    for symbol in ['BTC-PERP', 'ETH-PERP']:
+        close_array = panel_df_dict['base']['15m'][symbol]['close'].to_numpy()
+        base_array = close_array
+
+        while not isinstance(base_array, np.memmap) and base_array.base is not None:
+            base_array = base_array.base
+
+        assert isinstance(base_array, np.memmap)
+        assert not close_array.flags.writeable
@@ -0,0 +1,335 @@
+import numpy as np
+import pandas as pd
+import datetime as dt
+import threading
+import copy
+import pytest
+import ccxt
+
+import func_bench
+import func_get
+import func_signal
+
+
+class FakeExchange:
+    '''
+    Exchange stand-in serving candles grouped from synthetic 15m arrays, fetch_ohlcv raises fail_error on the calls in fail_call_set.
+    '''
+    def __init__(self, fail_call_set=(), fail_error=ccxt.NetworkError):
+        self.id = 'fake'
+        self.fail_call_set = set(fail_call_set)
+        self.fail_error = fail_error
+        self.call_count = 0
+        self.fail_count = 0
+        self.lock = threading.Lock()
+        self.ohlcv_array_dict = {}
+
+    @staticmethod
+    def milliseconds():
+        # 2020-06-01
+        return 1590969600000
+
+    def get_ohlcv_array(self, symbol, timeframe='15m'):
+        if (symbol, timeframe) not in self.ohlcv_array_dict:
+            ohlcv_array = func_bench.gen_synthetic_ohlcv_array(200 * 96, 15, len(symbol))
+            ohlcv_array = func_get.group_ohlcv_array(ohlcv_array, func_bench.bench_interval_dict[timeframe] * 60 * 1000)
+            self.ohlcv_array_dict[(symbol, timeframe)] = ohlcv_array[ohlcv_array[:, 0] < self.milliseconds()]
+
+        return self.ohlcv_array_dict[(symbol, timeframe)]
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        with self.lock:
+            self.call_count += 1
+
+            if self.call_count in self.fail_call_set:
+                self.fail_count += 1
+                raise self.fail_error("Injected error")
+
+        ohlcv_array = self.get_ohlcv_array(symbol, timeframe)
+        start_index = np.searchsorted(ohlcv_array[:, 0], since, side='left')
+
+        return ohlcv_array[start_index:start_index + limit].tolist()
+
+
+def get_fetch_params(**kwargs):
+    fetch_params = {**func_get.default_fetch_params, 'rate_limit': 1000, 'backoff_second': 0.001}
+    fetch_params.update(kwargs)
+
+    return fetch_params
+
+
+def test_fetch_retry_after_failure(monkeypatch):
+    sleep_list = []
+    monkeypatch.setattr(func_get.time, 'sleep', lambda second: sleep_list.append(second))
+
+    exchange = FakeExchange(fail_call_set={1, 2})
+    since = int(exchange.get_ohlcv_array('BTC-PERP')[10, 0])
+    limiter_dict = func_get.gen_rate_limiter(1000)
+
+    ohlcv_array = func_get.fetch_ohlcv_retry(exchange, 'BTC-PERP', '15m', since, 96, limiter_dict, get_fetch_params(backoff_second=1))
+
+    assert exchange.call_count == 3
+    np.testing.assert_array_equal(ohlcv_array, exchange.get_ohlcv_array('BTC-PERP')[10:106])
+
+    # Exponential backoff between the retries
+    backoff_list = [x for x in sleep_list if x >= 1]
+    assert backoff_list == [1, 2]
+
+
+def test_fetch_raise_after_max_retry(monkeypatch):
+    monkeypatch.setattr(func_get.time, 'sleep', lambda second: None)
+
+    exchange = FakeExchange(fail_call_set={1, 2, 3})
+    limiter_dict = func_get.gen_rate_limiter(1000)
+
+    with pytest.raises(ccxt.NetworkError):
+        func_get.fetch_ohlcv_retry(exchange, 'BTC-PERP', '15m', 0, 96, limiter_dict, get_fetch_params(max_retry=2))
+
+    assert exchange.call_count == 3
+
+
+@pytest.mark.parametrize('fail_error', [ccxt.BadSymbol, KeyError, TypeError])
+def test_fetch_fail_fast_on_non_transient_error(monkeypatch, fail_error):
+    sleep_list = []
+    monkeypatch.setattr(func_get.time, 'sleep', lambda second: sleep_list.append(second))
+
+    exchange = FakeExchange(fail_call_set={1}, fail_error=fail_error)
+    limiter_dict = func_get.gen_rate_limiter(1000)
+
+    with pytest.raises(fail_error):
+        func_get.fetch_ohlcv_retry(exchange, 'BTC-PERP', '15m', 0, 96, limiter_dict, get_fetch_params())
+
+    assert exchange.call_count == 1
+    assert [x for x in sleep_list if x >= 0.001] == []
+
+
+def test_rate_limit_spacing():
+    limiter_dict = func_get.gen_rate_limiter(100)
+    ts_list = []
+    ts_lock = threading.Lock()
+
+    def request():
+        func_get.wait_rate_limit(limiter_dict)
+
+        with ts_lock:
+            ts_list.append(func_get.time.monotonic())
+
+    thread_list = [threading.Thread(target=request) for _ in range(10)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+
+    # 10 requests at 100 per second need at least 9 intervals
+    assert max(ts_list) - min(ts_list) >= 9 * 0.01 * 0.9
+
+
+def test_fetch_array_dict_concurrent_with_failure():
+    exchange = FakeExchange(fail_call_set={2, 5, 9})
+    time_array = exchange.get_ohlcv_array('BTC-PERP')[:, 0]
+    task_list = [('BTC-PERP', '15m', int(time_array[i]), 96) for i in range(0, 96 * 20, 96)]
+
+    ohlcv_array_dict = func_get.fetch_ohlcv_array_dict(exchange, task_list, get_fetch_params(max_workers=4))
+
+    assert exchange.fail_count == 3
+    assert list(ohlcv_array_dict) == task_list
+
+    for i, task in enumerate(task_list):
+        np.testing.assert_array_equal(ohlcv_array_dict[task], exchange.get_ohlcv_array('BTC-PERP')[i * 96:(i + 1) * 96])
+
+
+@pytest.mark.parametrize('cache_flag', [False, True])
+def test_get_data_ordered_without_duplicate(tmp_path, cache_flag):
+    config_params = copy.deepcopy(func_bench.bench_config_dict['cryptoris'])
+    config_params['safety_ohlcv_range'] = 20
+    start_date = dt.datetime(2020, 3, 1)
+    end_date = dt.datetime(2020, 3, 10)
+    cache_dir = str(tmp_path) if cache_flag else None
+
+    exchange = FakeExchange(fail_call_set={1, 4, 7})
+    ohlcv_df_dict = func_get.get_data(exchange, start_date, end_date, 0, func_bench.bench_interval_dict, config_params, cache_dir=cache_dir, fetch_params=get_fetch_params(), timezone='UTC')
+    assert exchange.fail_count == 3
+
+    # Top up from cache fetches only what is missing
+    if cache_flag:
+        end_date = dt.datetime(2020, 3, 15)
+        ohlcv_df_dict = func_get.get_data(FakeExchange(fail_call_set={1}), start_date, end_date, 0, func_bench.bench_interval_dict, config_params, cache_dir=cache_dir, fetch_params=get_fetch_params(), timezone='UTC')
+
+    for symbol_type in ['base', 'lead']:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                time_array = ohlcv_df_dict[symbol_type][timeframe][symbol]['time'].values.astype('datetime64[ms]').astype(np.int64)
+                interval_ms = func_bench.bench_interval_dict[timeframe] * 60 * 1000
+
+                assert len(time_array) > 0
+                assert (np.diff(time_array) == interval_ms).all()
+
+    # 15m frames are the raw candles
+    ohlcv_df = ohlcv_df_dict['base']['15m']['BTC-PERP']
+    ohlcv_array = exchange.get_ohlcv_array('BTC-PERP')
+    start_index = np.searchsorted(ohlcv_array[:, 0], ohlcv_df['time'].values.astype('datetime64[ms]').astype(np.int64)[0])
+    np.testing.assert_allclose(ohlcv_df[['open', 'high', 'low', 'close', 'volume']].to_numpy(), ohlcv_array[start_index:start_index + len(ohlcv_df), 1:])
+
+
+class GapExchange(FakeExchange):
+    '''
+    FakeExchange without candles in [gap_start, gap_end), a permanent exchange gap.
+    '''
+    gap_start = 1578182400000  # 2020-01-05
+    gap_end = 1578312000000  # 2020-01-06 12:00
+
+    def get_ohlcv_array(self, symbol, timeframe='15m'):
+        ohlcv_array = super().get_ohlcv_array(symbol, timeframe)
+
+        return ohlcv_array[(ohlcv_array[:, 0] < self.gap_start) | (ohlcv_array[:, 0] >= self.gap_end)]
+
+
+def test_get_data_cache_settle_on_gap(tmp_path):
+    config_params = copy.deepcopy(func_bench.bench_config_dict['cryptoris'])
+    config_params['safety_ohlcv_range'] = 20
+    # Start before first candle of exchange on 2020-01-01
+    start_date = dt.datetime(2019, 12, 28)
+    end_date = dt.datetime(2020, 1, 10)
+    cache_dir = str(tmp_path)
+
+    exchange = GapExchange()
+    ohlcv_df_dict = func_get.get_data(exchange, start_date, end_date, 0, func_bench.bench_interval_dict, config_params, cache_dir=cache_dir, fetch_params=get_fetch_params(), timezone='UTC')
+    assert exchange.call_count > 0
+
+    exchange = GapExchange()
+    cache_df_dict = func_get.get_data(exchange, start_date, end_date, 0, func_bench.bench_interval_dict, config_params, cache_dir=cache_dir, fetch_params=get_fetch_params(), timezone='UTC')
+    assert exchange.call_count == 0
+
+    for symbol_type in ['base', 'lead']:
+        for timeframe in ohlcv_df_dict[symbol_type]:
+            for symbol in ohlcv_df_dict[symbol_type][timeframe]:
+                pd.testing.assert_frame_equal(cache_df_dict[symbol_type][timeframe][symbol], ohlcv_df_dict[symbol_type][timeframe][symbol])
+
+
+def group_timeframe_loop(ohlcv_df, step):
+    '''
+    group_timeframe(ohlcv_df, step) before interval_minute.
+    '''
+    ohlcv_dict = {'time':[], 'open':[], 'high':[], 'low':[], 'close':[]}
+
+    for i in range(0, len(ohlcv_df), step):
+        temp_df = ohlcv_df.iloc[i:min(i + step, len(ohlcv_df)), :].reset_index(drop=True)
+        ohlcv_dict['time'].append(temp_df['time'][0])
+        ohlcv_dict['open'].append(temp_df['open'][0])
+        ohlcv_dict['high'].append(max(temp_df['high']))
+        ohlcv_dict['low'].append(min(temp_df['low']))
+        ohlcv_dict['close'].append(temp_df['close'][len(temp_df) - 1])
+
+    return pd.DataFrame(ohlcv_dict)
+
+
+def get_group_ohlcv_df():
+    # Start 7 minutes past the hour and drop a few rows so rows and wall clock disagree
+    ohlcv_array = func_bench.gen_synthetic_ohlcv_array(1000, 1, 0, 1577836800000 + 7 * 60 * 1000)
+    ohlcv_array = np.delete(ohlcv_array, [50, 51, 52, 300], axis=0)
+
+    return func_get.gen_ohlcv_df(ohlcv_array, 'UTC')
+
+
+@pytest.mark.parametrize('step', [1, 4, 15, 999])
+def test_group_timeframe_step_same_as_loop(step):
+    ohlcv_df = get_group_ohlcv_df()
+
+    grouped_ohlcv_df = func_get.group_timeframe(ohlcv_df, step)
+    pd.testing.assert_frame_equal(grouped_ohlcv_df, group_timeframe_loop(ohlcv_df, step))
+
+    grouped_ohlcv_df = func_get.group_timeframe(ohlcv_df, step=step)
+    pd.testing.assert_frame_equal(grouped_ohlcv_df, group_timeframe_loop(ohlcv_df, step))
+
+
+def test_group_timeframe_interval_minute():
+    ohlcv_df = get_group_ohlcv_df()
+    grouped_ohlcv_df = func_get.group_timeframe(ohlcv_df, interval_minute=15)
+
+    time_series = ohlcv_df['time'].dt.tz_localize(None)
+    group_series = time_series.dt.floor('15min')
+    assert grouped_ohlcv_df['time'].tolist() == group_series.drop_duplicates().tolist()
+
+    for i, group_time in enumerate(grouped_ohlcv_df['time']):
+        temp_df = ohlcv_df[(group_series == group_time).values]
+        assert grouped_ohlcv_df['open'][i] == temp_df['open'].iloc[0]
+        assert grouped_ohlcv_df['high'][i] == temp_df['high'].max()
+        assert grouped_ohlcv_df['low'][i] == temp_df['low'].min()
+        assert grouped_ohlcv_df['close'][i] == temp_df['close'].iloc[-1]
+        assert np.isclose(grouped_ohlcv_df['volume'][i], temp_df['volume'].sum())
+
+
+def test_group_timeframe_one_of_step_or_interval_minute():
+    ohlcv_df = get_group_ohlcv_df()
+
+    with pytest.raises(ValueError):
+        func_get.group_timeframe(ohlcv_df)
+
+    with pytest.raises(ValueError):
+        func_get.group_timeframe(ohlcv_df, 4, interval_minute=15)
+
+
+def test_intrabar_series_over_action_range():
+    config_params = copy.deepcopy(func_bench.bench_config_dict['messi'])
+    start_date = dt.datetime(2020, 5, 1)
+    end_date = dt.datetime(2020, 5, 10)
+    series_list = func_get.gen_series_list(start_date, end_date, 0, func_bench.bench_interval_dict, config_params, 'UTC')
+
+    config_params['intrabar_timeframe'] = '1m'
+    intrabar_series_list = func_get.gen_series_list(start_date, end_date, 0, func_bench.bench_interval_dict, config_params, 'UTC')
+
+    # Signal series are planned as without intrabar, not refined to 1m
+    assert intrabar_series_list[:len(series_list)] == series_list
+    assert all(x['fetch_timeframe'] == '1h' for x in series_list)
+
+    series_dict = intrabar_series_list[-1]
+    assert len(intrabar_series_list) == len(series_list) + 1
+    assert (series_dict['symbol_type'], series_dict['timeframe'], series_dict['fetch_timeframe']) == ('base', '1m', '1m')
+
+    # Intrabar starts at the first signal check row, without warm-up of safety_ohlcv_range
+    assert series_dict['since_list'][0] == func_get.get_unix_datetime(start_date - dt.timedelta(hours=2), 0, 'UTC')
+    assert series_dict['since_list'][0] > series_list[0]['since_list'][0]
+    assert len(series_dict['since_list']) <= 11
+
+
+def test_intrabar_series_already_base_timeframe():
+    config_params = copy.deepcopy(func_bench.bench_config_dict['messi'])
+    config_params['intrabar_timeframe'] = '2h'
+
+    assert func_get.get_intrabar_timeframe(config_params) == None
+    assert len(func_get.gen_series_list(dt.datetime(2020, 5, 1), dt.datetime(2020, 5, 10), 0, func_bench.bench_interval_dict, config_params, 'UTC')) == 1
+
+
+def test_compact_ohlcv_df_dict():
+    config_params = copy.deepcopy(func_bench.bench_config_dict['cryptoris'])
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, 1000)
+    memory_info_df = func_get.get_memory_info(ohlcv_df_dict)
+
+    compact_df_dict = func_get.compact_ohlcv_df_dict(copy.deepcopy(ohlcv_df_dict))
+    compact_info_df = func_get.get_memory_info(compact_df_dict)
+
+    for symbol_type in ['base', 'lead']:
+        for timeframe in compact_df_dict[symbol_type]:
+            for symbol in compact_df_dict[symbol_type][timeframe]:
+                compact_df = compact_df_dict[symbol_type][timeframe][symbol]
+                ohlcv_df = ohlcv_df_dict[symbol_type][timeframe][symbol]
+
+                assert (compact_df.dtypes.drop('time') == np.float32).all()
+                assert compact_df['time'].equals(ohlcv_df['time'])
+                np.testing.assert_allclose(compact_df.drop(columns=['time']).to_numpy(), ohlcv_df.drop(columns=['time']).to_numpy(), rtol=1e-6)
+
+    assert compact_info_df[['symbol_type', 'timeframe', 'symbol', 'row', 'column']].equals(memory_info_df[['symbol_type', 'timeframe', 'symbol', 'row', 'column']])
+    assert (compact_info_df['bytes'] < memory_info_df['bytes']).all()
+
+
+@pytest.mark.parametrize('signal', list(func_bench.bench_signal_dict))
+def test_compact_add_indicator_float32(signal):
+    config_params = {'base': {'open': {'15m': {signal: func_bench.bench_signal_dict[signal]}}}}
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(1000, 15), 'UTC')
+
+    compact_df = func_get.compact_ohlcv_df(ohlcv_df)
+    compact_df = func_signal.add_indicator(signal, 'open', 'base', compact_df, '15m', func_signal.get_func_add_dict(), config_params)
+    indicator_df = compact_df.drop(columns=ohlcv_df.columns)
+
+    assert len(indicator_df.columns) > 0
+    assert not (indicator_df.dtypes == np.float64).any()
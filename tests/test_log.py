@@ -0,0 +1,81 @@
+import logging
+import json
+import io
+import copy
+import pytest
+
+import func_bench
+import func_signal
+import func_log
+
+
+interval_dict = func_bench.bench_interval_dict
+
+
+@pytest.fixture
+def log_reset():
+    yield func_log
+
+    func_log.set_event_trace(None)
+    func_log.set_log_level('WARNING')
+
+
+def add_bench_signal():
+    '''
+    Add signals of cryptoris bench config, which logs each added signal at INFO.
+    '''
+    config_params = copy.deepcopy(func_bench.bench_config_dict['cryptoris'])
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, 500)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+
+    return func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, config_params)
+
+
+def test_quiet_at_default_level(log_reset, caplog, capsys):
+    add_bench_signal()
+
+    for name in func_log.module_list:
+        assert not logging.getLogger(name).isEnabledFor(logging.INFO)
+
+    assert [x for x in caplog.records if x.levelno < logging.WARNING] == []
+    assert capsys.readouterr().out == ''
+
+
+def test_set_log_level(log_reset):
+    stream = io.StringIO()
+    func_log.set_log_level('INFO', stream)
+    add_bench_signal()
+
+    assert 'add' in stream.getvalue()
+
+    # Back to quiet, the stream handler is removed
+    func_log.set_log_level('WARNING')
+    log_text = stream.getvalue()
+    add_bench_signal()
+
+    assert stream.getvalue() == log_text
+    assert all(func_log.get_handler(logging.getLogger(x), 'func_log_stream') == None for x in func_log.module_list)
+
+
+def test_set_event_trace_json_lines(log_reset, capsys, tmp_path):
+    trace_path = str(tmp_path / 'trace.jsonl')
+    func_log.set_event_trace(trace_path, 'INFO')
+    add_bench_signal()
+    func_log.set_event_trace(None)
+
+    with open(trace_path) as trace_file:
+        event_list = [json.loads(x) for x in trace_file]
+
+    assert len(event_list) > 0
+
+    for event_dict in event_list:
+        assert list(event_dict) == ['t', 'm', 'l', 'msg', 'args']
+        assert event_dict['m'] in func_log.module_list
+        assert logging.getLevelName(event_dict['l']) >= logging.INFO
+
+    # Trace does not print, and loggers are quiet again after the trace is stopped
+    assert capsys.readouterr().out == ''
+
+    for name in func_log.module_list:
+        assert logging.getLogger(name).level == logging.WARNING
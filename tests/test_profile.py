@@ -0,0 +1,78 @@
+import copy
+import pytest
+
+import func_bench
+import func_signal
+import func_backtest
+import func_profile
+
+
+interval_dict = func_bench.bench_interval_dict
+
+
+@pytest.fixture
+def profile_reset():
+    func_profile.set_profile(False)
+    func_profile.clear_profile()
+
+    yield func_profile
+
+    func_profile.set_profile(False)
+    func_profile.clear_profile()
+
+
+@func_profile.profile_func
+def add_one(x):
+    return x + 1
+
+
+def run_profile_case():
+    with func_profile.profile_stage('stage'):
+        value_list = [add_one(i) for i in range(3)]
+
+    return value_list
+
+
+def test_profile_record_only_when_enabled(profile_reset):
+    assert run_profile_case() == [1, 2, 3]
+    assert len(func_profile.get_profile_df()) == 0
+
+    func_profile.set_profile(True)
+    assert run_profile_case() == [1, 2, 3]
+    func_profile.set_profile(False)
+    run_profile_case()
+
+    profile_df = func_profile.get_profile_df().set_index('name')
+
+    assert list(profile_df.index) == ['stage', 'test_profile.add_one']
+    assert profile_df.loc['stage', 'call'] == 1
+    assert profile_df.loc['test_profile.add_one', 'call'] == 3
+    # Nested function time is included in the stage
+    assert profile_df.loc['stage', 'second'] >= profile_df.loc['test_profile.add_one', 'second']
+
+
+def test_profile_backtest(profile_reset):
+    config_params = copy.deepcopy(func_bench.bench_config_dict['messi'])
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, 500)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+
+    func_profile.set_profile(True)
+    ohlcv_df_dict = func_signal.add_signal(start_date, ohlcv_df_dict, interval_dict, config_params)
+    func_backtest.run_backtest(100, True, config_params, ohlcv_df_dict, interval_dict)
+
+    name_list = func_profile.get_profile_df()['name'].to_list()
+
+    assert 'func_backtest.get_action_array' in name_list
+    assert any(x.startswith('add_tma ') for x in name_list)
+
+
+def test_profile_disabled_no_timing(profile_reset, monkeypatch):
+    def raise_perf_counter():
+        raise AssertionError("Timed while profile is disabled")
+
+    # Disabled path calls the function without reading the clock or touching profile_dict
+    monkeypatch.setattr(func_profile.time, 'perf_counter', raise_perf_counter)
+
+    assert run_profile_case() == [1, 2, 3]
+    assert func_profile.profile_dict == {}
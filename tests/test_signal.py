@@ -0,0 +1,165 @@
+import numpy as np
+import datetime as dt
+import pytest
+
+import func_bench
+import func_get
+import func_signal
+from func_signal import side_code_dict
+
+
+def gen_test_ohlcv_df(bar_count=500, interval=15, seed=0):
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(bar_count, interval, seed), 'UTC')
+
+    return ohlcv_df
+
+
+def get_check_config(signal, signal_dict):
+    config_params = {
+        'base': {
+            'open': {
+                '15m': {
+                    signal: signal_dict
+                }
+            },
+            'close': {
+            }
+        }
+    }
+
+    return config_params
+
+
+def test_check_before_first_row():
+    tma_dict = {'check': ['check_signal_side_change'], 'look_back': 1, 'windows': 20, 'revert': False}
+    # Bands meet so every row with rsi is outside
+    rsi_dict = {'check': ['check_signal_band'], 'look_back': 1, 'average_range': 14, 'trigger': 'outer', 'oversold': 50, 'overbought': 50, 'revert': False}
+
+    ema_dict = {'check': ['check_signal_side'], 'look_back': 1, 'windows': 20, 'revert': False}
+
+    for signal, signal_dict, check_func in [('tma', tma_dict, func_signal.check_signal_side_change), ('rsi', rsi_dict, func_signal.check_signal_band), ('ema', ema_dict, func_signal.check_signal_side)]:
+        config_params = get_check_config(signal, signal_dict)
+        ohlcv_df = gen_test_ohlcv_df()
+        ohlcv_df = func_signal.add_action_signal('open', ohlcv_df, 'base', '15m', 'BTC-PERP', func_signal.get_func_add_dict(), config_params)
+        ohlcv_df = func_signal.add_check_column('open', ohlcv_df, 'base', '15m', config_params)
+        ohlcv_df = ohlcv_df.dropna().reset_index(drop=True)
+
+        before_time = ohlcv_df.loc[0, 'time'] - dt.timedelta(minutes=15)
+        assert check_func('open', 'base', before_time, signal, [], ohlcv_df, '15m', config_params) == side_code_dict['no_action']
+
+        # Same as the array check on the last row after it
+        array_dict = {column: ohlcv_df[column].to_numpy() for column in ohlcv_df.columns}
+        last_time = ohlcv_df.loc[len(ohlcv_df) - 1, 'time']
+        action_side = check_func('open', 'base', last_time, signal, [], ohlcv_df, '15m', config_params)
+        assert action_side == func_signal.call_check_signal_array_func(signal_dict['check'][0])('open', 'base', len(ohlcv_df) - 1, signal, [], array_dict, '15m', config_params)
+
+
+def test_check_vector_before_first_row():
+    signal_dict = {'check': ['check_signal_side', 'check_signal_side_change'], 'look_back': 0, 'windows': 20, 'revert': False}
+    config_params = get_check_config('tma', signal_dict)
+    array_dict = {
+        'tma_20_side': np.array([1, -1, -1], dtype=np.int8),
+        'tma_20_change_0': np.array([True, True, True])
+    }
+    index_array = np.array([-1, 0, 2])
+
+    for check_func in [func_signal.check_signal_side_vector, func_signal.check_signal_side_change_vector]:
+        code_array = check_func('open', 'base', index_array, 'tma', array_dict, '15m', config_params)
+        assert code_array[0] == side_code_dict['no_action']
+        assert code_array[2] == -1
+
+
+def cal_rsi_loop(ohlcv_df, average_range):
+    '''
+    Row loop RSI of add_rsi before Wilder smoothing used ewm.
+    '''
+    temp_df = ohlcv_df.copy()
+
+    temp_df['diff'] = temp_df['close'].diff(1)
+    temp_df['gain'] = temp_df['diff'].clip(lower=0)
+    temp_df['loss'] = temp_df['diff'].clip(upper=0).abs()
+
+    temp_df['avg_gain'] = temp_df['gain'].rolling(window=average_range, min_periods=average_range).mean()[:average_range + 1]
+    temp_df['avg_loss'] = temp_df['loss'].rolling(window=average_range, min_periods=average_range).mean()[:average_range + 1]
+
+    for i, _ in enumerate(temp_df.loc[average_range + 1:, 'avg_gain']):
+        temp_df.loc[i + average_range + 1, 'avg_gain'] = (temp_df.loc[i + average_range, 'avg_gain'] * (average_range - 1) + temp_df.loc[i + average_range + 1, 'gain']) / average_range
+
+    for i, _ in enumerate(temp_df.loc[average_range + 1:, 'avg_loss']):
+        temp_df.loc[i + average_range + 1, 'avg_loss'] = (temp_df.loc[i + average_range, 'avg_loss'] * (average_range - 1) + temp_df.loc[i + average_range + 1, 'loss']) / average_range
+
+    rsi_series = 100 - (100 / (1.0 + temp_df['avg_gain'] / temp_df['avg_loss']))
+
+    return rsi_series
+
+
+def test_rsi_same_as_loop():
+    for bar_count, average_range in [(2000, 14), (300, 7), (10, 14), (15, 14)]:
+        config_params = get_check_config('rsi', {'average_range': average_range})
+        ohlcv_df = gen_test_ohlcv_df(bar_count)
+
+        rsi_array = func_signal.add_rsi('open', ohlcv_df.copy(), '15m', config_params)['rsi'].to_numpy()
+        loop_rsi_array = cal_rsi_loop(ohlcv_df, average_range).to_numpy()
+
+        np.testing.assert_array_equal(np.isnan(rsi_array), np.isnan(loop_rsi_array))
+        np.testing.assert_allclose(rsi_array, loop_rsi_array, rtol=0, atol=1e-10)
+
+
+def test_rsi_flat_close_same_as_loop():
+    ohlcv_df = gen_test_ohlcv_df(100)
+    ohlcv_df.loc[:40, 'close'] = 100.0
+    config_params = get_check_config('rsi', {'average_range': 14})
+
+    rsi_array = func_signal.add_rsi('open', ohlcv_df.copy(), '15m', config_params)['rsi'].to_numpy()
+    loop_rsi_array = cal_rsi_loop(ohlcv_df, 14).to_numpy()
+
+    np.testing.assert_array_equal(np.isnan(rsi_array), np.isnan(loop_rsi_array))
+    np.testing.assert_allclose(rsi_array, loop_rsi_array, rtol=0, atol=1e-10)
+
+
+def check_supertrend_same_as_reference(monkeypatch, cal_supertrend_array):
+    monkeypatch.setattr(func_signal, 'cal_supertrend_array', cal_supertrend_array)
+
+    for bar_count, atr_range, multiplier in [(1000, 10, 3), (500, 7, 1.5), (30, 14, 2)]:
+        config_params = get_check_config('supertrend', {'atr_range': atr_range, 'multiplier': multiplier})
+        ohlcv_df = gen_test_ohlcv_df(bar_count, seed=bar_count)
+
+        supertrend_df = func_signal.add_supertrend('open', ohlcv_df.copy(), '15m', config_params)
+        reference_df = func_signal.add_supertrend_reference('open', ohlcv_df.copy(), '15m', config_params)
+
+        reference_code_array = np.array([{'buy': 1, 'sell': -1}.get(x, 0) for x in reference_df['supertrend_side']], dtype=np.int8)
+        np.testing.assert_array_equal(supertrend_df['supertrend_side'].to_numpy(), reference_code_array)
+        np.testing.assert_allclose(supertrend_df['supertrend'].to_numpy(), reference_df['supertrend'].to_numpy(dtype=np.float64), rtol=0, atol=1e-10)
+
+
+def test_supertrend_python_same_as_reference(monkeypatch):
+    # py_func is the plain python kernel under numba.njit
+    cal_supertrend_array = getattr(func_signal.cal_supertrend_array, 'py_func', func_signal.cal_supertrend_array)
+    check_supertrend_same_as_reference(monkeypatch, cal_supertrend_array)
+
+
+def test_supertrend_njit_same_as_reference(monkeypatch):
+    numba = pytest.importorskip('numba')
+    cal_supertrend_array = getattr(func_signal.cal_supertrend_array, 'py_func', func_signal.cal_supertrend_array)
+    check_supertrend_same_as_reference(monkeypatch, numba.njit(cal_supertrend_array))
+
+
+@pytest.mark.parametrize('signal, signal_dict, legacy_column_list', [
+    ('tma', {'windows': 50}, ['tma', 'tma_side']),
+    ('cross_sma', {'short_windows': 15, 'long_windows': 200}, ['short_sma', 'long_sma', 'cross_sma_side']),
+    ('bollinger', {'windows': 20, 'std': 2}, ['bollinger_upper', 'bollinger_lower'])
+])
+def test_rename_legacy_column(signal, signal_dict, legacy_column_list):
+    ohlcv_df = gen_test_ohlcv_df()
+    column_list = list(ohlcv_df.columns)
+
+    # Same raw add_* columns as before get_signal_key
+    legacy_df = func_signal.get_func_add_dict()[signal]('open', ohlcv_df.copy(), '15m', get_check_config(signal, signal_dict))
+    assert list(legacy_df.columns) == column_list + legacy_column_list
+
+    ohlcv_df = func_signal.add_action_signal('open', ohlcv_df, 'base', '15m', 'BTC-PERP', func_signal.get_func_add_dict(), get_check_config(signal, signal_dict))
+    assert not set(legacy_column_list) & set(ohlcv_df.columns)
+
+    renamed_df = func_signal.rename_legacy_column(ohlcv_df, signal, signal_dict)
+    assert sorted(renamed_df.columns) == sorted(legacy_df.columns)
+    np.testing.assert_array_equal(renamed_df[legacy_column_list].to_numpy(dtype=np.float64), legacy_df[legacy_column_list].to_numpy(dtype=np.float64))
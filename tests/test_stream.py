@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import func_bench
+import func_get
+import func_signal
+import func_stream
+
+
+stream_signal_list = ['sma', 'ema', 'tma', 'bollinger', 'rsi', 'wt', 'supertrend', 'donchian', 'hull']
+
+
+def gen_test_ohlcv_df(bar_count=4000, seed=0):
+    '''
+    Synthetic candles with a flat stretch, where rolling sums and divisions hit their edge cases.
+    '''
+    ohlcv_df = func_get.gen_ohlcv_df(func_bench.gen_synthetic_ohlcv_array(bar_count, 15, seed), 'UTC')
+    ohlcv_df.loc[1000:1100, ['open', 'high', 'low', 'close']] = 100.0
+
+    return ohlcv_df
+
+
+@pytest.mark.parametrize('signal', stream_signal_list)
+def test_stream_same_as_batch(signal):
+    signal_dict = func_bench.bench_signal_dict[signal]
+    config_params = {'base': {'open': {'15m': {signal: signal_dict}}}}
+    ohlcv_df = gen_test_ohlcv_df()
+
+    batch_df = func_signal.get_func_add_dict()[signal]('open', ohlcv_df.copy(), '15m', config_params)
+    stream_df = func_stream.update_stream_df(func_stream.gen_stream_indicator(signal, signal_dict), ohlcv_df)
+
+    for column in stream_df.columns:
+        if column.endswith('_side'):
+            np.testing.assert_array_equal(stream_df[column].to_numpy(dtype=np.int8), batch_df[column].to_numpy(dtype=np.int8), err_msg=column)
+        else:
+            np.testing.assert_allclose(stream_df[column].to_numpy(dtype=np.float64), batch_df[column].to_numpy(dtype=np.float64), rtol=0, atol=1e-9, err_msg=column)
+
+
+def test_stream_atr_same_as_batch():
+    ohlcv_df = gen_test_ohlcv_df()
+
+    atr_array = func_signal.cal_atr(ohlcv_df, 10).to_numpy(dtype=np.float64)
+    stream_df = func_stream.update_stream_df(func_stream.gen_stream_indicator('atr', {'atr_range': 10}), ohlcv_df)
+
+    np.testing.assert_allclose(stream_df['atr'].to_numpy(dtype=np.float64), atr_array, rtol=0, atol=1e-9)
+
+
+def test_stream_update_after_warm_up():
+    signal_dict = func_bench.bench_signal_dict['bollinger']
+    config_params = {'base': {'open': {'15m': {'bollinger': signal_dict}}}}
+    ohlcv_df = gen_test_ohlcv_df(500)
+
+    batch_df = func_signal.add_bollinger('open', ohlcv_df.copy(), '15m', config_params)
+    stream_indicator = func_stream.gen_stream_indicator('bollinger', signal_dict)
+    func_stream.update_stream_df(stream_indicator, ohlcv_df.iloc[:400])
+
+    # Live bars one at a time after history
+    for i in range(400, 500):
+        indicator_dict = stream_indicator.update(ohlcv_df.loc[i, ['open', 'high', 'low', 'close']].to_dict())
+
+        for column in indicator_dict:
+            assert indicator_dict[column] == pytest.approx(batch_df.loc[i, column], abs=1e-9)
+
+
+@pytest.mark.parametrize('windows', [4, 16, 200])
+def test_stream_wma_long_run_same_as_batch(windows):
+    ohlcv_df = gen_test_ohlcv_df(50000)
+    ohlcv_df.loc[2000:2004, 'close'] = np.nan
+
+    wma_array = np.array(func_signal.cal_wma(ohlcv_df, 'close', windows), dtype=np.float64)
+    wma_stream = func_stream.StreamWMA(windows)
+    stream_array = np.array([wma_stream.update(x) for x in ohlcv_df['close'].to_numpy(dtype=np.float64)])
+
+    np.testing.assert_allclose(stream_array, wma_array, rtol=0, atol=1e-9)
+
+    # Flat window is exactly the flat value
+    if windows <= 101:
+        assert (stream_array[1000 + windows - 1:1101] == 100.0).all()
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import datetime as dt
+import copy
+import pytest
+
+import func_bench
+import func_sweep
+
+
+interval_dict = func_bench.bench_interval_dict
+
+
+def get_sweep_input():
+    config_params = copy.deepcopy(func_bench.bench_config_dict['messi'])
+    config_params['safety_ohlcv_range'] = 50
+    ohlcv_df_dict = func_bench.gen_synthetic_ohlcv_df_dict(config_params, 2000)
+    start_date = func_bench.get_bench_start_date(config_params, ohlcv_df_dict)
+
+    param_dict = {
+        'windows': {'path': [('base', 'open', '2h', 'tma', 'windows'), ('base', 'close', '2h', 'tma', 'windows')], 'value': [20, 50]},
+        'tp': {'path': [('tp', 'price_percent')], 'value': [None, 2]}
+    }
+
+    return start_date, config_params, param_dict, ohlcv_df_dict
+
+
+def test_sweep_parallel_same_as_serial():
+    start_date, config_params, param_dict, ohlcv_df_dict = get_sweep_input()
+    param_list = func_sweep.gen_grid_param_list(param_dict)
+
+    serial_df = func_sweep.run_sweep(start_date, 100, True, config_params, param_dict, param_list, ohlcv_df_dict, interval_dict, max_workers=1)
+    parallel_df = func_sweep.run_sweep(start_date, 100, True, config_params, param_dict, param_list, ohlcv_df_dict, interval_dict, max_workers=2)
+
+    assert len(serial_df) == 4
+    assert (serial_df['transaction'] > 0).all()
+    pd.testing.assert_frame_equal(serial_df, parallel_df)
+
+
+def test_sweep_worker_close():
+    start_date, config_params, _, ohlcv_df_dict = get_sweep_input()
+    shared_ohlcv, shared_meta = func_sweep.gen_shared_ohlcv(ohlcv_df_dict)
+
+    try:
+        func_sweep.init_sweep_worker(shared_meta, {})
+        worker_shared_ohlcv = func_sweep.worker_dict['shared_ohlcv']
+        shared_df_dict = func_sweep.gen_shared_ohlcv_df_dict(func_sweep.worker_dict['shared_array'], shared_meta)
+        np.testing.assert_array_equal(shared_df_dict['base']['2h']['ETH-PERP']['close'], ohlcv_df_dict['base']['2h']['ETH-PERP']['close'])
+        del shared_df_dict
+
+        func_sweep.close_sweep_worker()
+        assert func_sweep.worker_dict == {}
+        assert worker_shared_ohlcv.buf is None
+    finally:
+        shared_ohlcv.close()
+        shared_ohlcv.unlink()
+
+
+@pytest.mark.parametrize('step_day, anchor_flag', [(None, False), (None, True), (30, False)])
+def test_walk_forward_window_tile(step_day, anchor_flag):
+    start_date = dt.datetime(2020, 1, 1)
+    end_date = dt.datetime(2020, 6, 1)
+    window_list = func_sweep.gen_walk_forward_window_list(start_date, end_date, 40, 20, step_day, anchor_flag)
+
+    assert len(window_list) > 1
+    assert window_list[0]['train_start'] == start_date
+    assert window_list[-1]['test_end'] <= end_date
+
+    for i, window_dict in enumerate(window_list):
+        assert window_dict['train_start'] < window_dict['train_end'] == window_dict['test_start'] < window_dict['test_end']
+        assert window_dict['train_start'] == (start_date if anchor_flag else window_dict['train_end'] - dt.timedelta(days=40))
+
+        # Test windows follow each other without overlap, and without hole when moved by test_day
+        if i > 0:
+            if step_day == None:
+                assert window_dict['test_start'] == window_list[i - 1]['test_end']
+            else:
+                assert window_dict['test_start'] >= window_list[i - 1]['test_end']
+
+
+def test_walk_forward_slice_and_budget():
+    _, config_params, param_dict, ohlcv_df_dict = get_sweep_input()
+    param_list = func_sweep.gen_grid_param_list(param_dict)
+    action_df = ohlcv_df_dict['base']['2h']['ETH-PERP']
+    window_list = func_sweep.gen_walk_forward_window_list(dt.datetime(2020, 1, 10), action_df['time'].iloc[-1].to_pydatetime(), 40, 20)
+
+    for window_dict in window_list:
+        window_df_dict = func_sweep.slice_ohlcv_df_dict(window_dict['test_start'], window_dict['test_end'], config_params, ohlcv_df_dict, interval_dict)
+        window_df = window_df_dict['base']['2h']['ETH-PERP']
+        expect_df = action_df[(action_df['time'] >= window_dict['test_start']) & (action_df['time'] < window_dict['test_end'])]
+
+        # First row is the bar before test_start, only read for signal check
+        assert window_df['time'].iloc[0] == window_dict['test_start'] - dt.timedelta(hours=2)
+        pd.testing.assert_frame_equal(window_df.iloc[1:].reset_index(drop=True), expect_df.reset_index(drop=True))
+
+    window_result_df, budget_series = func_sweep.run_walk_forward(100, True, config_params, param_dict, param_list, window_list, ohlcv_df_dict, interval_dict, max_workers=1)
+
+    assert len(window_result_df) == len(window_list)
+    assert budget_series.index.is_monotonic_increasing & budget_series.index.is_unique
+
+    # Each test window starts from the budget at the end of the previous one
+    current_budget = 100
+
+    for window_dict, test_final_budget in zip(window_list, window_result_df['test_final_budget']):
+        window_series = budget_series[(budget_series.index >= window_dict['test_start']) & (budget_series.index < window_dict['test_end'])]
+
+        assert np.isclose(window_series.iloc[0], current_budget)
+        current_budget = current_budget * test_final_budget / 100
+        assert np.isclose(window_series.iloc[-1], current_budget)